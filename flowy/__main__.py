@@ -1,7 +1,8 @@
 import argparse
+import json
 import sys
 
-from flowy import workflow_starter
+from flowy.backend.boilerplate import workflow_starter
 
 
 def main():
@@ -12,14 +13,60 @@ def main():
     parser.add_argument("--task-list")
     parser.add_argument("--decision-duration", type=int, default=None)
     parser.add_argument("--workflow-duration", type=int, default=None)
+    parser.add_argument("--many", metavar="FILE",
+                        help="start an execution for every JSON line of the "
+                             "file, - for stdin")
+    parser.add_argument("--output", metavar="FILE",
+                        help="where to write the outcome of every start")
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--rate", type=float, default=None,
+                        help="the maximum starts per second")
     parser.add_argument('args', nargs=argparse.REMAINDER)
 
     args = parser.parse_args()
 
     wf = workflow_starter(args.domain, args.name, args.version, args.task_list,
                           args.decision_duration, args.workflow_duration)
+    if args.many is not None:
+        return start_many(wf, args.many, args.output, args.workers,
+                          args.rate)
     return not wf.start(*args.args)  # 0 is success
 
 
+def start_many(wf, path, output_path, workers, rate):
+    """ Every line is a JSON object with the optional args, kwargs, id and
+    tags of an execution or just the list of its args. A JSON line with the
+    run id or the error of every start is written to the output.
+    """
+    input = sys.stdin if path == '-' else open(path)
+    output = sys.stdout if output_path is None else open(output_path, 'w')
+    failed = 0
+    try:
+        for id, run_id, error in wf.start_many(_rows(input), workers, rate):
+            if error is None:
+                outcome = {'id': id, 'runId': run_id}
+            else:
+                outcome = {'id': id, 'error': error}
+                failed += 1
+            output.write(json.dumps(outcome) + '\n')
+    finally:
+        if input is not sys.stdin:
+            input.close()
+        if output is not sys.stdout:
+            output.close()
+    return int(bool(failed))
+
+
+def _rows(lines):
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        row = json.loads(line)
+        if isinstance(row, list):
+            row = {'args': row}
+        yield row
+
+
 if __name__ == '__main__':
     sys.exit(main())
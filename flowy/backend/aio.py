@@ -0,0 +1,208 @@
+""" Run many activities concurrently on an asyncio event loop.
+
+The SWF client is blocking so every SWF call (the long-polls, the responses
+and the heartbeats) is made on the default executor of the event loop, while
+the activity bodies returning coroutines run on the loop itself. This keeps
+the module free of any Python 3 only syntax, it can be imported on Python 2
+but the classes can't be used there.
+"""
+import logging
+import signal
+
+try:
+    import asyncio
+except ImportError:  # Python 2
+    asyncio = None
+
+from flowy.backend.swf import SWFActivity
+from flowy.exception import SuspendTask
+from flowy.instrument import timer
+from flowy.worker import _stop_poller
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncActivity(SWFActivity):
+    """ An activity whose `run` method may return a coroutine or a future.
+
+    Calling the activity from a running event loop returns a future that is
+    done after the result, or the failure, was sent to SWF. Inside `run`,
+    :meth:`heartbeat` returns a future of the heartbeat outcome that can be
+    waited on without blocking the loop.
+    """
+    def __call__(self):
+        done = self._call_async(asyncio.get_event_loop())
+        done.add_done_callback(lambda _: self._metrics.finish())
+        return done
+
+    def _call_async(self, loop):
+        # stopped by _finish and _fail
+        if self._heartbeater is not None:
+            self._heartbeater.start(self)
+        start = timer()
+        try:
+            args, kwargs = self._decode_input()
+            result = self.run(*args, **kwargs)
+        except SuspendTask:
+            self._stop_heartbeats()
+            return _resolved(loop)
+        except Exception as e:
+            logger.exception('Error while running the task:')
+            return loop.run_in_executor(None, self._fail, e)
+        if not _is_awaitable(result):
+            self._metrics.add_time('run', timer() - start)
+            return loop.run_in_executor(None, self._finish, result)
+        done = _new_future(loop)
+
+        def respond(f):
+            self._metrics.add_time('run', timer() - start)
+            if f.cancelled():
+                respond_with = self._fail, 'The activity was cancelled.'
+            elif isinstance(f.exception(), SuspendTask):
+                self._stop_heartbeats()
+                done.set_result(None)
+                return
+            elif f.exception() is not None:
+                logger.error('Error while running the task: %r', f.exception())
+                respond_with = self._fail, f.exception()
+            else:
+                respond_with = self._finish, f.result()
+            r = loop.run_in_executor(None, *respond_with)
+            r.add_done_callback(lambda _: done.set_result(None))
+
+        _ensure_future(result, loop).add_done_callback(respond)
+        return done
+
+    def heartbeat(self, details=None):
+        loop = asyncio.get_event_loop()
+        heartbeat = super(AsyncActivity, self).heartbeat
+        return loop.run_in_executor(None, heartbeat, details)
+
+    def _stop_heartbeats(self):
+        if self._heartbeater is not None:
+            self._heartbeater.stop(self)
+
+
+class AsyncPoller(object):
+    """ Make the long-polls of a poller on the executor of the event loop. """
+    def __init__(self, poller):
+        self._poller = poller
+
+    def poll_next_task(self, loop):
+        return loop.run_in_executor(None, self._poller.poll_next_task)
+
+
+class AsyncWorker(object):
+    """ Keep `pollers` long-polls and up to `concurrency` tasks in flight.
+
+    :class:`AsyncActivity` instances run on the event loop, any other task
+    (like the decisions) runs on the executor of the loop that is a pool of
+    `threads` threads. On SIGTERM the worker stops polling and returns after
+    the tasks in flight are finished; a poller with a `stop` method, like the
+    PrefetchPoller, is stopped and the tasks it already received are started
+    first.
+    """
+    def __init__(self, poller, concurrency=100, pollers=1, threads=32):
+        self._poller = poller
+        self._async_poller = AsyncPoller(poller)
+        # a poller that can be stopped returns None once drained
+        self._drain = hasattr(poller, 'stop')
+        self._concurrency = max(int(concurrency), 1)
+        self._pollers = max(int(pollers), 1)
+        self._threads = threads
+        self._loop = None
+        self._polling = 0
+        self._running = set()
+        self._left = None
+        self._stopping = False
+        self._drained = False
+
+    def run_forever(self, loop=-1):
+        from concurrent.futures import ThreadPoolExecutor
+        self._loop = asyncio.new_event_loop()
+        self._loop.set_default_executor(ThreadPoolExecutor(self._threads))
+        self._left = loop if loop >= 0 else None
+        self._stopping = False
+        self._drained = False
+        try:
+            self._loop.add_signal_handler(signal.SIGTERM, self.stop)
+        except (NotImplementedError, RuntimeError, ValueError):
+            pass  # not on the main thread or not supported on the platform
+        self._loop.call_soon(self._fill)
+        try:
+            self._loop.run_forever()
+        finally:
+            self._loop.close()
+
+    def stop(self):
+        logger.info('Stopping the worker, waiting for the running tasks.')
+        self._stopping = True
+        _stop_poller(self._poller)
+        self._loop.call_soon_threadsafe(self._fill)
+
+    def _fill(self):
+        while ((self._drain or not self._stopping)
+               and not self._drained
+               and self._left != 0
+               and self._polling < self._pollers
+               and self._polling + len(self._running) < self._concurrency):
+            if self._left is not None:
+                self._left -= 1
+            self._polling += 1
+            f = self._async_poller.poll_next_task(self._loop)
+            f.add_done_callback(self._on_task)
+        if not self._polling and not self._running:
+            self._loop.stop()
+
+    def _on_task(self, f):
+        self._polling -= 1
+        try:
+            task = f.result()
+        except Exception:
+            logger.exception('Error while polling for tasks:')
+            if self._left is not None:
+                self._left += 1
+        else:
+            if task is None:
+                self._drained = True
+            else:
+                self._start(task)
+        self._fill()
+
+    def _start(self, task):
+        if isinstance(task, AsyncActivity):
+            running = task()
+        else:
+            running = self._loop.run_in_executor(None, task)
+        self._running.add(running)
+        running.add_done_callback(self._on_done)
+
+    def _on_done(self, f):
+        self._running.discard(f)
+        if not f.cancelled() and f.exception() is not None:
+            logger.error('Unhandled error in the task: %r', f.exception())
+        self._fill()
+
+
+def _is_awaitable(value):
+    return asyncio.iscoroutine(value) or isinstance(value, asyncio.Future)
+
+
+def _ensure_future(value, loop):
+    # asyncio.async was renamed to ensure_future in Python 3.4.4
+    ensure_future = getattr(asyncio, 'ensure_future', None)
+    if ensure_future is None:
+        ensure_future = getattr(asyncio, 'async')
+    return ensure_future(value, loop=loop)
+
+
+def _new_future(loop):
+    if hasattr(loop, 'create_future'):
+        return loop.create_future()
+    return asyncio.Future(loop=loop)
+
+
+def _resolved(loop):
+    f = _new_future(loop)
+    f.set_result(None)
+    return f
@@ -3,38 +3,73 @@ import logging.config
 import os
 import socket
 import sys
+import threading
 import uuid
 from contextlib import contextmanager
+from functools import partial
 
-from boto.swf.layer1 import Layer1
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
 
-from flowy.poller import SWFActivityPoller
-from flowy.poller import SWFWorkflowPoller
-from flowy.proxy import serialize_args
-from flowy.scanner import SWFScanner
-from flowy.spec import _sentinel
-from flowy.spec import SWFWorkflowSpec
-from flowy.task import AsyncSWFActivity
+from boto.swf.exceptions import SWFResponseError
+from boto.swf.exceptions import SWFWorkflowExecutionAlreadyStartedError
+
+from flowy.backend.aio import AsyncWorker
+from flowy.backend.cache import RegistrationCache
+from flowy.backend.client import default_client_factory
+from flowy.backend.client import SWFClientFactory
+from flowy.backend.heartbeat import Heartbeater
+from flowy.backend.poller import PrefetchPoller
+from flowy.backend.poller import SWFActivityPoller
+from flowy.backend.poller import SWFWorkflowPoller
+from flowy.backend.retry import RateLimiter
+from flowy.backend.retry import RetryPolicy
+from flowy.backend.spec import _sentinel
+from flowy.backend.spec import SWFWorkflowSpec
+from flowy.backend.swf import load_manifest
+from flowy.backend.swf import SWFActivity
+from flowy.backend.swf import SWFScanner
+from flowy.blobstore import CachingBlobStore
+from flowy.serialization import default_serializer
+from flowy.serialization import set_default_blob_store
 from flowy.util import MagicBind
+from flowy.worker import ProcessPoolWorker
 from flowy.worker import SingleThreadedWorker
+from flowy.worker import ThreadPoolWorker
 
 logger = logging.getLogger(__name__)
 
 
 def start_activity_worker(domain, task_list, layer1=None, reg_remote=True,
                           loop=-1, package=None, ignore=None, setup_log=True,
-                          identity=None):
+                          identity=None, threads=None, processes=None,
+                          prefetch=None, asyncio_tasks=None,
+                          retry_policy=None, blob_store=None, reg_cache=None,
+                          reg_workers=1, manifest=None, instrumentation=None,
+                          auto_heartbeat=None):
     if setup_log:
         _setup_default_logger()
-    if identity is None:
-        identity = _default_identity()
-    swf_client = _get_client(layer1, domain, identity)
-    scanner = SWFScanner()
-    scanner.scan_activities(package=package, ignore=ignore, level=1)
-    poller = SWFActivityPoller(swf_client, task_list, scanner)
-    worker = SingleThreadedWorker(poller)
+    _setup_blob_store(blob_store)
+    if retry_policy is None:
+        retry_policy = RetryPolicy()
+    swf_client = _get_client(layer1, domain, identity or _default_identity())
+    if manifest is not None:
+        scanner = SWFScanner(load_manifest(manifest, 'activity'))
+    else:
+        scanner = SWFScanner()
+        scanner.scan_activities(package=package, ignore=ignore, level=1)
+
+    # the processes build their own client
+    poller_factory = partial(_activity_poller, layer1, domain, identity,
+                             None if processes else swf_client, task_list,
+                             scanner, retry_policy, instrumentation,
+                             auto_heartbeat, prefetch)
+    worker = _make_worker(poller_factory, threads, processes, asyncio_tasks)
     if reg_remote:
-        not_registered = scanner.register_remote(swf_client)
+        not_registered = _register_remote(scanner, swf_client, domain,
+                                          reg_cache, reg_workers)
         if not_registered:
             logger.error(
                 'Not all activities could be registered: %s', not_registered
@@ -48,18 +83,32 @@ def start_activity_worker(domain, task_list, layer1=None, reg_remote=True,
 
 def start_workflow_worker(domain, task_list, layer1=None, reg_remote=True,
                           loop=-1, package=None, ignore=None, setup_log=True,
-                          identity=None):
+                          identity=None, history_cache=None, threads=None,
+                          processes=None, retry_policy=None, blob_store=None,
+                          reg_cache=None, reg_workers=1, manifest=None,
+                          instrumentation=None, spill_threshold=None,
+                          page_prefetch=0, event_handlers=None):
     if setup_log:
         _setup_default_logger()
-    if identity is None:
-        identity = _default_identity()
-    swf_client = _get_client(layer1, domain, identity)
-    scanner = SWFScanner()
-    scanner.scan_workflows(package=package, ignore=ignore, level=1)
-    poller = SWFWorkflowPoller(swf_client, task_list, scanner)
-    worker = SingleThreadedWorker(poller)
+    _setup_blob_store(blob_store)
+    if retry_policy is None:
+        retry_policy = RetryPolicy()
+    swf_client = _get_client(layer1, domain, identity or _default_identity())
+    if manifest is not None:
+        scanner = SWFScanner(load_manifest(manifest, 'workflow'))
+    else:
+        scanner = SWFScanner()
+        scanner.scan_workflows(package=package, ignore=ignore, level=1)
+
+    poller_factory = partial(_workflow_poller, layer1, domain, identity,
+                             None if processes else swf_client, task_list,
+                             scanner, history_cache, retry_policy,
+                             instrumentation, spill_threshold, page_prefetch,
+                             event_handlers)
+    worker = _make_worker(poller_factory, threads, processes)
     if reg_remote:
-        not_registered = scanner.register_remote(swf_client)
+        not_registered = _register_remote(scanner, swf_client, domain,
+                                          reg_cache, reg_workers)
         if not_registered:
             logger.error(
                 'Not all workflows could be registered: %s', not_registered
@@ -71,40 +120,122 @@ def start_workflow_worker(domain, task_list, layer1=None, reg_remote=True,
         pass
 
 
+def write_manifest(path, package=None, ignore=None):
+    """ Scan for activities and workflows and write a manifest that the
+    workers can load, with the `manifest` argument, instead of scanning.
+    """
+    scanner = SWFScanner()
+    scanner.scan_activities(package=package, ignore=ignore, level=1)
+    scanner.scan_workflows(package=package, ignore=ignore, level=1)
+    scanner.write_manifest(path)
+
+
 def async_scheduler(domain, token, layer1=None):
-    return AsyncSWFActivity(_get_client(layer1, domain), token)
+    # an activity finished later, from outside of the worker, by its token
+    return SWFActivity(_get_client(layer1, domain), None, token)
 
 
 def workflow_starter(domain, name, version, task_list=None,
                      decision_duration=None, workflow_duration=None,
-                     id=None, tags=None, layer1=None, setup_log=True):
+                     id=None, tags=None, layer1=None, setup_log=True,
+                     serializer=None):
     if setup_log:
         _setup_default_logger()
     spec = SWFWorkflowSpec(name, version, task_list, decision_duration,
-                           workflow_duration)
+                           workflow_duration, serializer)
     client = _get_client(layer1, domain)
-    return SWFWorkflowStarter(spec, client, id, tags)
+    return SWFWorkflowStarter(spec, client, id, tags, serializer)
+
+
+# The poller factories are module level functions, the worker processes
+# started with spawn unpickle them and build their own client.
+
+def _activity_poller(layer1, domain, identity, swf_client, task_list, scanner,
+                     retry_policy, instrumentation, auto_heartbeat, prefetch):
+    if swf_client is None:
+        swf_client = _get_client(layer1, domain,
+                                 identity or _default_identity())
+    heartbeater = None
+    if auto_heartbeat:
+        heartbeater = Heartbeater(swf_client, auto_heartbeat)
+    poller = SWFActivityPoller(swf_client, task_list, scanner,
+                               retry_policy=retry_policy,
+                               instrumentation=instrumentation,
+                               heartbeater=heartbeater)
+    if prefetch:
+        poller = PrefetchPoller(poller, prefetch)
+    return poller
+
+
+def _workflow_poller(layer1, domain, identity, swf_client, task_list, scanner,
+                     history_cache, retry_policy, instrumentation,
+                     spill_threshold, page_prefetch, event_handlers=None):
+    if swf_client is None:
+        swf_client = _get_client(layer1, domain,
+                                 identity or _default_identity())
+    return SWFWorkflowPoller(swf_client, task_list, scanner,
+                             history_cache=history_cache,
+                             retry_policy=retry_policy,
+                             instrumentation=instrumentation,
+                             spill_threshold=spill_threshold,
+                             page_prefetch=page_prefetch,
+                             event_handlers=event_handlers)
+
+
+def _make_worker(poller_factory, threads=None, processes=None,
+                 asyncio_tasks=None):
+    # the processes build their own pollers and clients after the fork
+    if processes:
+        return ProcessPoolWorker(poller_factory, processes)
+    if asyncio_tasks:
+        return AsyncWorker(poller_factory(), asyncio_tasks)
+    if threads:
+        return ThreadPoolWorker(poller_factory(), threads)
+    return SingleThreadedWorker(poller_factory())
 
 
 def _get_client(layer1, domain, identity=None):
+    # all the workers and starters of a process share a client and its pool;
+    # a layer1 passed in is shared by the forked worker processes too, unless
+    # it's a factory that builds a client per process
     if layer1 is None:
-        layer1 = Layer1()
+        layer1 = default_client_factory
+    if isinstance(layer1, SWFClientFactory):
+        layer1 = layer1()
     if identity is not None:
         identity = str(identity)
     return MagicBind(layer1, domain=str(domain), identity=identity)
 
 
+def _register_remote(scanner, swf_client, domain, reg_cache, reg_workers):
+    cache = None
+    if reg_cache is not None:
+        cache = RegistrationCache(reg_cache, domain)
+    return scanner.register_remote(swf_client, cache, reg_workers)
+
+
+def _setup_blob_store(blob_store):
+    # fetch the offloaded payloads through an in-memory cache
+    if blob_store is not None:
+        if not isinstance(blob_store, CachingBlobStore):
+            blob_store = CachingBlobStore(blob_store)
+        set_default_blob_store(blob_store)
+
+
 def _default_identity():
     id = "%s-%s" % (socket.getfqdn(), os.getpid())
     return id[-256:]
 
 
 class SWFWorkflowStarter(object):
-    def __init__(self, spec, client, id=None, tags=None):
+    def __init__(self, spec, client, id=None, tags=None, serializer=None):
+        if serializer is None:
+            serializer = default_serializer
         self._spec = spec
         self._client = client
         self._id = id
         self._tags = tags
+        self._serializer = serializer
 
     @contextmanager
     def options(self, task_list=_sentinel, decision_duration=_sentinel,
@@ -129,7 +260,126 @@ class SWFWorkflowStarter(object):
         input = self._serialize_arguments(*args, **kwargs)
         return self._spec.start(self._client, id, input, self._tags)
 
-    _serialize_arguments = serialize_args
+    def start_many(self, rows, workers=16, rate=None, retries=5,
+                   retry_policy=None):
+        """ Start an execution for every row and yield `(id, run_id, error)`
+        as the starts finish.
+
+        A row is a dict with the optional `args`, `kwargs`, `id` and `tags`,
+        the executions without an id get a random one. At most `workers`
+        starts are in flight and at most `rate` are made per second. The
+        throttled starts are retried up to `retries` times with the backoff
+        of the `retry_policy`, shared by all the workers. An id repeated in
+        the rows or already running fails as a duplicate.
+
+        Closing the generator early stops the threads, the rows not started
+        yet are dropped.
+        """
+        if retry_policy is None:
+            retry_policy = RetryPolicy()
+        limiter = RateLimiter(rate) if rate else None
+        todo = queue.Queue(workers * 2)
+        done = queue.Queue()
+        stop = threading.Event()
+
+        def put(item):
+            # timeouts so the threads notice when the caller stops consuming
+            while not stop.is_set():
+                try:
+                    todo.put(item, timeout=1)
+                    return
+                except queue.Full:
+                    continue
+
+        def feed():
+            seen = set()
+            try:
+                for row in rows:
+                    if stop.is_set():
+                        break
+                    id = row.get('id')
+                    id = str(uuid.uuid4() if id is None else id)
+                    if id in seen:
+                        done.put((id, None, 'duplicate'))
+                        continue
+                    seen.add(id)
+                    put((id, row))
+            except Exception as e:
+                logger.exception('Error while reading the rows:')
+                done.put((None, None, str(e)))
+            finally:
+                for _ in range(workers):
+                    put(None)
+
+        def work():
+            while not stop.is_set():
+                try:
+                    item = todo.get(timeout=1)
+                except queue.Empty:
+                    continue
+                if item is None:
+                    break
+                id, row = item
+                done.put(self._start_row(id, row, limiter, retries,
+                                         retry_policy))
+            done.put(None)
+
+        threads = [threading.Thread(target=feed, name='flowy-start-feed')]
+        threads.extend(threading.Thread(target=work,
+                                        name='flowy-start-%s' % i)
+                       for i in range(workers))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        running = workers
+        try:
+            while running:
+                result = done.get()
+                if result is None:
+                    running -= 1
+                else:
+                    yield result
+        finally:
+            stop.set()
+            for q in (todo, done):
+                try:
+                    while 1:
+                        q.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def _start_row(self, id, row, limiter, retries, retry_policy):
+        try:
+            input = self._serialize_arguments(*row.get('args', []),
+                                              **row.get('kwargs', {}))
+        except Exception as e:
+            return id, None, str(e)
+        for attempt in range(retries + 1):
+            if limiter is not None:
+                limiter.acquire()
+            try:
+                run_id = self._spec._start(self._client, id, input,
+                                           row.get('tags', self._tags))
+            except SWFWorkflowExecutionAlreadyStartedError:
+                return id, None, 'duplicate'
+            except SWFResponseError as e:
+                if attempt == retries or not _throttled(e):
+                    return id, None, e.error_message or str(e)
+                retry_policy.failure()
+            except Exception as e:
+                logger.exception('Error while starting the workflow:')
+                return id, None, str(e)
+            else:
+                retry_policy.success()
+                return id, run_id, None
+
+    def _serialize_arguments(self, *args, **kwargs):
+        return self._serializer.serialize_args(args, kwargs)
+
+
+def _throttled(error):
+    return (error.status >= 500
+            or 'Throttling' in (getattr(error, 'error_code', None) or ''))
 
 
 def _setup_default_logger():
@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from flowy.backend.payloads import SpilledPayloads
+
+
+class LRUCache(object):
+    """ A thread safe LRU cache bounded both by number of entries and by an
+    approximate memory budget.
+
+    The size of each entry is computed by :meth:`_sizeof` when the entry is
+    stored; the least recently used entries are evicted until both limits are
+    respected again. An entry bigger than the whole budget is not kept at all.
+
+    >>> c = LRUCache(max_items=2)
+    >>> c.put('a', 1)
+    >>> c.put('b', 2)
+    >>> c.get('a')
+    1
+    >>> c.put('c', 3)
+    >>> c.get('b') is None
+    True
+    >>> sorted(c.keys())
+    ['a', 'c']
+
+    """
+    def __init__(self, max_items=1000, max_size=None):
+        self._max_items = max_items
+        self._max_size = max_size
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # the worker processes started with spawn begin with an empty cache
+        state = self.__dict__.copy()
+        del state['_lock']
+        state['_entries'] = OrderedDict()
+        state['_size'] = 0
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, size = self._entries.pop(key)
+            except KeyError:
+                return default
+            self._entries[key] = value, size
+            return value
+
+    def put(self, key, value):
+        size = self._sizeof(value)
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = value, size
+            self._size += size
+            self._evict()
+
+    def discard(self, key):
+        with self._lock:
+            self._discard(key)
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries.keys())
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _discard(self, key):
+        try:
+            _, size = self._entries.pop(key)
+        except KeyError:
+            return
+        self._size -= size
+
+    def _evict(self):
+        while self._entries and (
+            (self._max_items is not None
+             and len(self._entries) > self._max_items)
+            or (self._max_size is not None and self._size > self._max_size)
+        ):
+            _, (_, size) = self._entries.popitem(last=False)
+            self._size -= size
+
+    def _sizeof(self, value):
+        return 1
+
+
+class HistoryCache(LRUCache):
+    """ Cache the parsed decision history of workflow runs between decisions.
+
+    The cache is keyed by the workflow run id and the memory budget, in bytes,
+    is approximated by the size of the raw results and errors kept in memory,
+    the results spilled to disk only count for their offsets. Every history
+    with a spill file open also takes `1 / max_files` of the budget, so at
+    most `max_files` file descriptors are held by the cached histories; the
+    file of an evicted history is closed once its last decision is done.
+
+    With `keep_decoded` the deserialized results are kept too, so each result
+    is decoded once per run instead of once per decision. The workflows must
+    not modify the results they receive in this case.
+    """
+    def __init__(self, max_runs=1000, max_size=64 * 1024 * 1024,
+                 keep_decoded=False, max_files=128):
+        super(HistoryCache, self).__init__(max_runs, max_size)
+        self.keep_decoded = keep_decoded
+        self._file_size = 0
+        if max_size is not None:
+            self._file_size = max_size // max_files
+
+    def _sizeof(self, history):
+        # counted by the history as it's parsed and decoded, the results
+        # decoded by a decision are counted when the next one puts it back
+        size = history.size
+        if (isinstance(history.results, SpilledPayloads)
+                and history.results.has_file):
+            size += self._file_size
+        return size
+
+
+class RegistrationCache(object):
+    """ Remember on disk the task types known to be registered in a domain
+    with a compatible configuration, so the workers can skip the register and
+    describe calls for them on the next start.
+
+    The entries are keyed by the domain and by the full configuration of the
+    spec, changing any of the timers or the default task list makes the spec
+    go through the registration again.
+    """
+    def __init__(self, path, domain):
+        self._path = path
+        self._domain = domain
+        self._lock = threading.Lock()
+        self._keys = set()
+        try:
+            with open(path) as f:
+                self._keys = set(json.load(f))
+        except (IOError, OSError, ValueError):
+            pass  # missing or corrupted, start from scratch
+
+    def is_registered(self, spec):
+        return self._key(spec) in self._keys
+
+    def add(self, spec):
+        with self._lock:
+            self._keys.add(self._key(spec))
+
+    def save(self):
+        with self._lock:
+            keys = sorted(self._keys)
+        directory = os.path.dirname(os.path.abspath(self._path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(keys, f)
+            os.rename(tmp_path, self._path)
+        except Exception:
+            # the old file is left untouched
+            os.remove(tmp_path)
+            raise
+
+    def _key(self, spec):
+        key = '%s\n%r' % (self._domain, spec)
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
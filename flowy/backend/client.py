@@ -0,0 +1,145 @@
+import os
+import threading
+import time
+
+from boto.swf.layer1 import Layer1
+
+
+class ConnectionPool(object):
+    """ A thread-safe pool of keep-alive HTTP connections, in place of the
+    boto one.
+
+    At most `size` idle connections are kept per host and the ones idle for
+    longer than `keep_alive` seconds are closed before SWF times them out on
+    its side. With `thread_affinity` a thread gets back the connection it used
+    last, if it's ready, before the ones used by other threads. The pool is
+    emptied in a forked child so the processes never share a socket.
+
+    The connections reused are counted as `hits`, the new ones as `misses`
+    and the closed idle ones as `discarded`.
+    """
+    def __init__(self, size=10, keep_alive=55, thread_affinity=True):
+        self._size = size
+        self._keep_alive = keep_alive
+        self._thread_affinity = thread_affinity
+        self._lock = threading.Lock()
+        self._reset()
+
+    def __getstate__(self):
+        # pickled for the worker processes started with spawn, they get an
+        # empty pool like the forked ones
+        state = self.__dict__.copy()
+        del state['_lock'], state['_idle']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = {}
+        self.hits = self.misses = self.discarded = 0
+
+    def get_http_connection(self, host, port, is_secure):
+        thread = threading.current_thread().ident
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            idle = self._idle.get((host, port, is_secure), [])
+            self._discard(idle, time.time() - self._keep_alive)
+            found = None
+            # the most recently used connections first
+            for i in range(len(idle) - 1, -1, -1):
+                conn, _, owner = idle[i]
+                if not _ready(conn):
+                    continue
+                if found is None:
+                    found = i
+                if not self._thread_affinity or owner == thread:
+                    found = i
+                    break
+            if found is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return idle.pop(found)[0]
+
+    def put_http_connection(self, host, port, is_secure, conn):
+        thread = threading.current_thread().ident
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            idle = self._idle.setdefault((host, port, is_secure), [])
+            idle.append((conn, time.time(), thread))
+            while len(idle) > self._size:
+                idle.pop(0)[0].close()
+                self.discarded += 1
+
+    def _discard(self, idle, stale_before):
+        while idle and idle[0][1] < stale_before:
+            idle.pop(0)[0].close()
+            self.discarded += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'discarded': self.discarded,
+                'idle': sum(len(idle) for idle in self._idle.values()),
+            }
+
+
+def _ready(conn):
+    # the connection is put back before its response is read, see the boto
+    # HostConnectionPool
+    response = getattr(conn, '_HTTPConnection__response', None)
+    return response is None or response.isclosed()
+
+
+class PooledLayer1(Layer1):
+    """ A boto SWF client that takes its connections from a given pool. """
+    def __init__(self, pool, *args, **kwargs):
+        super(PooledLayer1, self).__init__(*args, **kwargs)
+        self._pool = pool
+
+
+class SWFClientFactory(object):
+    """ Make the boto SWF clients of a process, all of them sharing one
+    connection pool.
+
+    The client is built once per process and shared by the pollers, the
+    activities responses and heartbeats and the workflow starters. The
+    `layer1_kwargs` are passed to the boto Layer1, like the region or the
+    credentials.
+    """
+    def __init__(self, pool_size=10, keep_alive=55, thread_affinity=True,
+                 **layer1_kwargs):
+        self.pool = ConnectionPool(pool_size, keep_alive, thread_affinity)
+        self._layer1_kwargs = layer1_kwargs
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        state['_clients'] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        pid = os.getpid()
+        with self._lock:
+            if pid not in self._clients:
+                self._clients = {
+                    pid: PooledLayer1(self.pool, **self._layer1_kwargs)
+                }
+            return self._clients[pid]
+
+
+default_client_factory = SWFClientFactory()
@@ -0,0 +1,658 @@
+""" An in-memory emulator of the parts of the SWF API used by flowy.
+
+:class:`SWFEmulator` is a drop-in replacement for the boto ``Layer1`` client.
+Pass the same instance as `layer1` to the workers and to the workflow starter
+to run the workflows locally, without network, in tests and load tests. It
+keeps the decision histories, pages them, fires the timers and enforces the
+activity, decision and execution timeouts; child workflows are supported and
+terminated when their parent closes. The workers must share the emulator, so
+use threads instead of processes.
+
+>>> from boto.swf.layer1_decisions import Layer1Decisions
+>>> swf = SWFEmulator(poll_timeout=0.1)
+>>> swf.register_workflow_type(
+...     'dom', 'Hello', '1', task_list='tl',
+...     default_task_start_to_close_timeout='10',
+...     default_execution_start_to_close_timeout='60')
+>>> r = swf.start_workflow_execution('dom', 'hello-1', 'Hello', '1')
+>>> task = swf.poll_for_decision_task('dom', 'tl')
+>>> [e['eventType'] for e in task['events']]
+['WorkflowExecutionStarted', 'DecisionTaskScheduled', 'DecisionTaskStarted']
+>>> d = Layer1Decisions()
+>>> d.complete_workflow_execution('"hi"')
+>>> swf.respond_decision_task_completed(task['taskToken'], d._data)
+>>> swf.history('dom', 'hello-1')[-1]['eventType']
+'WorkflowExecutionCompleted'
+>>> swf.poll_for_decision_task('dom', 'tl')
+{}
+
+"""
+import collections
+import heapq
+import itertools
+import threading
+import time
+import uuid
+
+from boto.exception import SWFResponseError
+from boto.swf.layer1 import Layer1
+
+
+_FAULT = 'com.amazonaws.swf.base.model#%s'
+
+
+class SWFEmulator(Layer1):
+    """ Serve the SWF requests of the boto client from memory.
+
+    The polls wait at most `poll_timeout` seconds for a task, like the SWF
+    long polling, and the histories are paged by `page_size` events. Every
+    request is delayed by `latency` seconds, or by the result of calling
+    `latency` with the name of the action, to emulate the network.
+    """
+    # Layer1.__init__ is not called, there is no connection to set up
+    def __init__(self, poll_timeout=60, page_size=1000, latency=0):
+        self._poll_timeout = poll_timeout
+        self._page_size = page_size
+        self._latency = latency
+        self._lock = threading.Lock()
+        self._conditions = {}
+        self._queues = collections.defaultdict(collections.deque)
+        self._types = {}
+        self._open = {}
+        self._runs = {}
+        self._decision_tasks = {}
+        self._activity_tasks = {}
+        self._timers = []
+        self._timer_ids = itertools.count()
+
+    def json_request(self, action, data, object_hook=None):
+        self._normalize_request_dict(data)
+        latency = self._latency
+        if callable(latency):
+            latency = latency(action)
+        if latency:
+            time.sleep(latency)
+        try:
+            handler = getattr(self, _actions[action])
+        except KeyError:
+            raise _error('UnknownOperationException',
+                         'Unsupported action: %s' % action)
+        return handler(data)
+
+    def history(self, domain, workflow_id, run_id=None):
+        """ The events of a run, the latest run of `workflow_id` if no
+        `run_id` is given.
+        """
+        with self._lock:
+            return list(self._get_run(domain, workflow_id, run_id).events)
+
+    def counts(self):
+        """ The number of executions in each state. """
+        counts = collections.defaultdict(int)
+        with self._lock:
+            for run in self._runs.values():
+                counts[run.status] += 1
+        return dict(counts)
+
+    # Types
+
+    def _register_activity_type(self, data):
+        self._register_type('activity', data)
+
+    def _register_workflow_type(self, data):
+        self._register_type('workflow', data)
+
+    def _describe_activity_type(self, data):
+        return self._describe_type('activity', data['activityType'], data)
+
+    def _describe_workflow_type(self, data):
+        return self._describe_type('workflow', data['workflowType'], data)
+
+    def _register_type(self, kind, data):
+        key = kind, data['domain'], data['name'], data['version']
+        with self._lock:
+            if key in self._types:
+                raise _error('TypeAlreadyExistsFault',
+                             'Type already exists: %s' % (key,))
+            config = dict((k, v) for k, v in data.items()
+                          if k.startswith('default'))
+            self._types[key] = config
+
+    def _describe_type(self, kind, t, data):
+        key = kind, data['domain'], t['name'], t['version']
+        with self._lock:
+            try:
+                config = self._types[key]
+            except KeyError:
+                raise _error('UnknownResourceFault',
+                             'Unknown type: %s' % (key,))
+            return {'configuration': dict(config),
+                    'typeInfo': {kind + 'Type': dict(t),
+                                 'status': 'REGISTERED'}}
+
+    # Executions
+
+    def _start_workflow_execution(self, data):
+        with self._lock:
+            run = self._start_run(data['domain'], data['workflowId'],
+                                  data['workflowType'], data)
+            return {'runId': run.run_id}
+
+    def _start_run(self, domain, workflow_id, workflow_type, attrs,
+                   parent=None, initiated_event_id=None):
+        key = ('workflow', domain, workflow_type['name'],
+               workflow_type['version'])
+        try:
+            config = self._types[key]
+        except KeyError:
+            raise _error('UnknownResourceFault',
+                         'Unknown type: %s' % (key,))
+        if (domain, workflow_id) in self._open:
+            raise _error('WorkflowExecutionAlreadyStartedFault',
+                         'Already started: %s' % workflow_id)
+        task_list = attrs.get('taskList', config.get('defaultTaskList'))
+        if not task_list:
+            raise _error('DefaultUndefinedFault', 'No task list.')
+        decision_timeout = attrs.get(
+            'taskStartToCloseTimeout',
+            config.get('defaultTaskStartToCloseTimeout'))
+        execution_timeout = attrs.get(
+            'executionStartToCloseTimeout',
+            config.get('defaultExecutionStartToCloseTimeout'))
+        run = _Run(domain, workflow_id, uuid.uuid4().hex, workflow_type,
+                   task_list['name'], decision_timeout, execution_timeout,
+                   parent, initiated_event_id)
+        self._open[domain, workflow_id] = run
+        self._runs[run.run_id] = run
+        started = {
+            'workflowType': dict(workflow_type),
+            'taskList': {'name': run.task_list},
+            'taskStartToCloseTimeout': run.decision_timeout,
+            'executionStartToCloseTimeout': run.execution_timeout,
+            'childPolicy': 'TERMINATE',
+        }
+        for k in 'input', 'tagList', 'continuedExecutionRunId':
+            if k in attrs:
+                started[k] = attrs[k]
+        if parent is not None:
+            started['parentWorkflowExecution'] = parent.execution()
+            started['parentInitiatedEventId'] = initiated_event_id
+            parent.children.append(run)
+        run.add_event('WorkflowExecutionStarted', started)
+        self._add_timer(run.execution_timeout, self._execution_timed_out, run)
+        self._schedule_decision(run)
+        return run
+
+    def _close(self, run, event_type, attrs, parent_event_type=None):
+        run.add_event(event_type, attrs)
+        run.status = event_type[len('WorkflowExecution'):].upper()
+        del self._open[run.domain, run.workflow_id]
+        for token in run.activities.values():
+            self._activity_tasks.pop(token, None)
+        run.activities.clear()
+        if run.decision is not None:
+            self._decision_tasks.pop(run.decision, None)
+            run.decision = None
+        for child in run.children:
+            if child.status == 'OPEN':
+                self._close(child, 'WorkflowExecutionTerminated',
+                            {'cause': 'CHILD_POLICY_APPLIED',
+                             'childPolicy': 'TERMINATE'})
+        parent = run.parent
+        if parent_event_type is not None and parent.status == 'OPEN':
+            attrs = dict(attrs, workflowExecution=run.execution(),
+                         workflowType=dict(run.workflow_type),
+                         initiatedEventId=run.initiated_event_id,
+                         startedEventId=run.parent_started_event_id)
+            attrs.pop('decisionTaskCompletedEventId', None)
+            parent.add_event(parent_event_type, attrs)
+            self._schedule_decision(parent)
+
+    def _execution_timed_out(self, run):
+        if run.status == 'OPEN':
+            self._close(run, 'WorkflowExecutionTimedOut',
+                        {'timeoutType': 'START_TO_CLOSE',
+                         'childPolicy': 'TERMINATE'},
+                        run.parent and 'ChildWorkflowExecutionTimedOut')
+
+    # Decisions
+
+    def _poll_for_decision_task(self, data):
+        if data.get('nextPageToken'):
+            with self._lock:
+                token, offset = data['nextPageToken'].rsplit(':', 1)
+                try:
+                    run, end = self._decision_tasks[token]
+                except KeyError:
+                    raise _error('UnknownResourceFault',
+                                 'Unknown page token.')
+                return self._decision_page(run, token, end, int(offset),
+                                           data)
+        queue = 'decision', data['domain'], data['taskList']['name']
+        with self._lock:
+            run = self._wait_for_task(queue)
+            if run is None:
+                return {}
+            token = uuid.uuid4().hex
+            run.decision = token
+            run.previous_started_event_id = run.started_event_id
+            run.started_event_id = run.add_event(
+                'DecisionTaskStarted',
+                {'scheduledEventId': run.decision_scheduled_event_id,
+                 'identity': data.get('identity')})
+            end = len(run.events)
+            self._decision_tasks[token] = run, end
+            self._add_timer(run.decision_timeout, self._decision_timed_out,
+                            run, token)
+            return self._decision_page(run, token, end, 0, data)
+
+    def _decision_page(self, run, token, end, offset, data):
+        size = min(data.get('maximumPageSize') or self._page_size,
+                   self._page_size)
+        if data.get('reverseOrder'):
+            start = max(end - offset - size, 0)
+            events = run.events[start:end - offset][::-1]
+        else:
+            events = run.events[offset:min(offset + size, end)]
+        page = {
+            'taskToken': token,
+            'startedEventId': run.started_event_id,
+            'workflowExecution': run.execution(),
+            'workflowType': dict(run.workflow_type),
+            'events': events,
+        }
+        if run.previous_started_event_id:
+            page['previousStartedEventId'] = run.previous_started_event_id
+        if offset + size < end:
+            page['nextPageToken'] = '%s:%s' % (token, offset + size)
+        return page
+
+    def _respond_decision_task_completed(self, data):
+        with self._lock:
+            token = data['taskToken']
+            try:
+                run, _ = self._decision_tasks.pop(token)
+            except KeyError:
+                raise _error('UnknownResourceFault', 'Unknown task token.')
+            completed = run.add_event(
+                'DecisionTaskCompleted',
+                {'scheduledEventId': run.decision_scheduled_event_id,
+                 'startedEventId': run.started_event_id})
+            run.decision = None
+            for decision in data.get('decisions', []):
+                if run.status != 'OPEN':
+                    break
+                self._decide(run, decision, completed)
+            if run.status == 'OPEN' and run.decision_pending:
+                run.decision_pending = False
+                self._schedule_decision(run)
+
+    def _decide(self, run, decision, completed):
+        d_type = decision['decisionType']
+        attrs = dict(decision.get(
+            d_type[0].lower() + d_type[1:] + 'DecisionAttributes', {}))
+        attrs['decisionTaskCompletedEventId'] = completed
+        if d_type == 'ScheduleActivityTask':
+            self._schedule_activity(run, attrs)
+        elif d_type == 'StartTimer':
+            started = run.add_event('TimerStarted', attrs)
+            self._add_timer(attrs['startToFireTimeout'], self._timer_fired,
+                            run, attrs['timerId'], started)
+        elif d_type == 'StartChildWorkflowExecution':
+            self._start_child(run, attrs)
+        elif d_type == 'CompleteWorkflowExecution':
+            self._close(run, 'WorkflowExecutionCompleted', attrs,
+                        run.parent and 'ChildWorkflowExecutionCompleted')
+        elif d_type == 'FailWorkflowExecution':
+            self._close(run, 'WorkflowExecutionFailed', attrs,
+                        run.parent and 'ChildWorkflowExecutionFailed')
+        elif d_type == 'ContinueAsNewWorkflowExecution':
+            self._continue_as_new(run, attrs)
+        else:
+            raise _error('ValidationException',
+                         'Unsupported decision: %s' % d_type)
+
+    def _schedule_decision(self, run):
+        if run.decision is not None:
+            # a decision is in progress, another one follows it
+            run.decision_pending = True
+            return
+        if run.decision_scheduled:
+            return
+        run.decision_scheduled = True
+        run.decision_scheduled_event_id = run.add_event(
+            'DecisionTaskScheduled',
+            {'taskList': {'name': run.task_list},
+             'startToCloseTimeout': run.decision_timeout})
+        self._enqueue(('decision', run.domain, run.task_list), run)
+
+    def _decision_timed_out(self, run, token):
+        if run.decision != token:
+            return
+        self._decision_tasks.pop(token, None)
+        run.decision = None
+        run.add_event('DecisionTaskTimedOut',
+                      {'scheduledEventId': run.decision_scheduled_event_id,
+                       'startedEventId': run.started_event_id,
+                       'timeoutType': 'START_TO_CLOSE'})
+        run.decision_pending = False
+        self._schedule_decision(run)
+
+    def _timer_fired(self, run, timer_id, started_event_id):
+        if run.status != 'OPEN':
+            return
+        run.add_event('TimerFired', {'timerId': timer_id,
+                                     'startedEventId': started_event_id})
+        self._schedule_decision(run)
+
+    def _start_child(self, run, attrs):
+        initiated = run.add_event('StartChildWorkflowExecutionInitiated',
+                                  attrs)
+        try:
+            child = self._start_run(run.domain, attrs['workflowId'],
+                                    attrs['workflowType'], attrs, run,
+                                    initiated)
+        except SWFResponseError as e:
+            cause = 'WORKFLOW_TYPE_DOES_NOT_EXIST'
+            if e.error_code == 'WorkflowExecutionAlreadyStartedFault':
+                cause = 'WORKFLOW_ALREADY_RUNNING'
+            run.add_event('StartChildWorkflowExecutionFailed',
+                          {'workflowId': attrs['workflowId'],
+                           'workflowType': attrs['workflowType'],
+                           'cause': cause,
+                           'initiatedEventId': initiated,
+                           'decisionTaskCompletedEventId':
+                               attrs['decisionTaskCompletedEventId']})
+            self._schedule_decision(run)
+            return
+        child.parent_started_event_id = run.add_event(
+            'ChildWorkflowExecutionStarted',
+            {'workflowExecution': child.execution(),
+             'workflowType': dict(child.workflow_type),
+             'initiatedEventId': initiated})
+
+    def _continue_as_new(self, run, attrs):
+        workflow_type = dict(run.workflow_type)
+        if 'workflowTypeVersion' in attrs:
+            workflow_type['version'] = attrs['workflowTypeVersion']
+        attrs.setdefault('taskList', {'name': run.task_list})
+        attrs.setdefault('taskStartToCloseTimeout', run.decision_timeout)
+        attrs.setdefault('executionStartToCloseTimeout',
+                         run.execution_timeout)
+        attrs['continuedExecutionRunId'] = run.run_id
+        parent, initiated = run.parent, run.initiated_event_id
+        # the new run takes the place of the old one
+        run.parent = None
+        self._close(run, 'WorkflowExecutionContinuedAsNew',
+                    {'decisionTaskCompletedEventId':
+                        attrs['decisionTaskCompletedEventId']})
+        new_run = self._start_run(run.domain, run.workflow_id, workflow_type,
+                                  attrs, parent, initiated)
+        run.events[-1]['workflowExecutionContinuedAsNewEventAttributes'][
+            'newExecutionRunId'] = new_run.run_id
+        new_run.parent_started_event_id = run.parent_started_event_id
+
+    # Activities
+
+    def _schedule_activity(self, run, attrs):
+        t = attrs['activityType']
+        key = 'activity', run.domain, t['name'], t['version']
+        config = self._types.get(key)
+        cause = None
+        if config is None:
+            cause = 'ACTIVITY_TYPE_DOES_NOT_EXIST'
+        elif attrs['activityId'] in run.activities:
+            cause = 'ACTIVITY_ID_ALREADY_IN_USE'
+        if cause is not None:
+            run.add_event('ScheduleActivityTaskFailed',
+                          {'activityId': attrs['activityId'],
+                           'activityType': t,
+                           'cause': cause,
+                           'decisionTaskCompletedEventId':
+                               attrs['decisionTaskCompletedEventId']})
+            self._schedule_decision(run)
+            return
+        for timeout in ('HeartbeatTimeout', 'ScheduleToCloseTimeout',
+                        'ScheduleToStartTimeout', 'StartToCloseTimeout'):
+            k = timeout[0].lower() + timeout[1:]
+            attrs.setdefault(k, config.get('defaultTask' + timeout, 'NONE'))
+        attrs.setdefault('taskList', config.get('defaultTaskList'))
+        task = _ActivityTask(run, attrs)
+        task.scheduled_event_id = run.add_event('ActivityTaskScheduled',
+                                                attrs)
+        run.activities[task.activity_id] = task.token
+        self._activity_tasks[task.token] = task
+        self._enqueue(('activity', run.domain, attrs['taskList']['name']),
+                      task)
+        self._add_timer(attrs['scheduleToStartTimeout'], self._timed_out,
+                        task, 'SCHEDULE_TO_START')
+        self._add_timer(attrs['scheduleToCloseTimeout'], self._timed_out,
+                        task, 'SCHEDULE_TO_CLOSE')
+
+    def _poll_for_activity_task(self, data):
+        queue = 'activity', data['domain'], data['taskList']['name']
+        with self._lock:
+            task = self._wait_for_task(queue)
+            if task is None:
+                return {}
+            task.started_event_id = task.run.add_event(
+                'ActivityTaskStarted',
+                {'scheduledEventId': task.scheduled_event_id,
+                 'identity': data.get('identity')})
+            task.last_heartbeat = time.time()
+            self._add_timer(task.attrs['startToCloseTimeout'],
+                            self._timed_out, task, 'START_TO_CLOSE')
+            self._add_timer(task.attrs['heartbeatTimeout'],
+                            self._heartbeat_timed_out, task)
+            response = {
+                'taskToken': task.token,
+                'activityId': task.activity_id,
+                'activityType': dict(task.attrs['activityType']),
+                'startedEventId': task.started_event_id,
+                'workflowExecution': task.run.execution(),
+            }
+            if 'input' in task.attrs:
+                response['input'] = task.attrs['input']
+            return response
+
+    def _record_activity_task_heartbeat(self, data):
+        with self._lock:
+            task = self._started_activity(data['taskToken'])
+            task.last_heartbeat = time.time()
+            return {'cancelRequested': False}
+
+    def _respond_activity_task_completed(self, data):
+        with self._lock:
+            task = self._started_activity(data['taskToken'])
+            attrs = {'result': data.get('result')}
+            self._finish_activity(task, 'ActivityTaskCompleted', attrs)
+
+    def _respond_activity_task_failed(self, data):
+        with self._lock:
+            task = self._started_activity(data['taskToken'])
+            attrs = {'reason': data.get('reason'),
+                     'details': data.get('details')}
+            self._finish_activity(task, 'ActivityTaskFailed', attrs)
+
+    def _started_activity(self, token):
+        task = self._activity_tasks.get(token)
+        if task is None or task.started_event_id is None:
+            raise _error('UnknownResourceFault', 'Unknown task token.')
+        return task
+
+    def _finish_activity(self, task, event_type, attrs):
+        del self._activity_tasks[task.token]
+        del task.run.activities[task.activity_id]
+        attrs = dict((k, v) for k, v in attrs.items() if v is not None)
+        attrs['scheduledEventId'] = task.scheduled_event_id
+        if task.started_event_id is not None:
+            attrs['startedEventId'] = task.started_event_id
+        task.run.add_event(event_type, attrs)
+        self._schedule_decision(task.run)
+
+    def _timed_out(self, task, timeout_type):
+        if self._activity_tasks.get(task.token) is not task:
+            return
+        if timeout_type == 'SCHEDULE_TO_START' and task.started_event_id:
+            return
+        self._finish_activity(task, 'ActivityTaskTimedOut',
+                              {'timeoutType': timeout_type})
+
+    def _heartbeat_timed_out(self, task):
+        if self._activity_tasks.get(task.token) is not task:
+            return
+        timeout = _seconds(task.attrs['heartbeatTimeout'])
+        late = time.time() - task.last_heartbeat - timeout
+        if late < 0:
+            self._add_timer(-late, self._heartbeat_timed_out, task)
+            return
+        self._finish_activity(task, 'ActivityTaskTimedOut',
+                              {'timeoutType': 'HEARTBEAT'})
+
+    # Task lists and timers
+
+    def _condition(self, queue):
+        try:
+            return self._conditions[queue]
+        except KeyError:
+            c = self._conditions[queue] = threading.Condition(self._lock)
+            return c
+
+    def _enqueue(self, queue, item):
+        self._queues[queue].append(item)
+        self._condition(queue).notify()
+
+    def _wait_for_task(self, queue):
+        """ Wait, with the lock held, for the next valid task in the queue
+        while firing the timers that are due.
+        """
+        deadline = time.time() + self._poll_timeout
+        condition = self._condition(queue)
+        items = self._queues[queue]
+        while 1:
+            self._fire_timers()
+            while items:
+                item = items.popleft()
+                if isinstance(item, _Run):
+                    if item.status == 'OPEN' and item.decision_scheduled:
+                        item.decision_scheduled = False
+                        return item
+                elif self._activity_tasks.get(item.token) is item:
+                    return item
+            now = time.time()
+            if now >= deadline:
+                return None
+            wait = deadline - now
+            if self._timers:
+                wait = min(wait, max(self._timers[0][0] - now, 0))
+            condition.wait(wait)
+
+    def _add_timer(self, timeout, callback, *args):
+        seconds = _seconds(timeout)
+        if seconds is None:
+            return
+        entry = time.time() + seconds, next(self._timer_ids), callback, args
+        heapq.heappush(self._timers, entry)
+        # wake up the pollers so they wait for the new deadline
+        for condition in self._conditions.values():
+            condition.notify()
+
+    def _fire_timers(self):
+        now = time.time()
+        while self._timers and self._timers[0][0] <= now:
+            _, _, callback, args = heapq.heappop(self._timers)
+            callback(*args)
+
+    def _get_run(self, domain, workflow_id, run_id=None):
+        if run_id is not None:
+            return self._runs[run_id]
+        run = self._open.get((domain, workflow_id))
+        if run is None:
+            runs = [r for r in self._runs.values()
+                    if r.domain == domain and r.workflow_id == workflow_id]
+            if not runs:
+                raise KeyError(workflow_id)
+            run = max(runs, key=lambda r: r.created)
+        return run
+
+
+class _Run(object):
+    """ A workflow execution run and its history. """
+    _created = itertools.count()
+
+    def __init__(self, domain, workflow_id, run_id, workflow_type, task_list,
+                 decision_timeout, execution_timeout, parent=None,
+                 initiated_event_id=None):
+        self.domain = domain
+        self.workflow_id = workflow_id
+        self.run_id = run_id
+        self.workflow_type = workflow_type
+        self.task_list = task_list
+        self.decision_timeout = decision_timeout
+        self.execution_timeout = execution_timeout
+        self.parent = parent
+        self.initiated_event_id = initiated_event_id
+        self.parent_started_event_id = None
+        self.created = next(self._created)
+        self.status = 'OPEN'
+        self.events = []
+        self.children = []
+        self.activities = {}
+        self.decision = None
+        self.decision_scheduled = False
+        self.decision_pending = False
+        self.decision_scheduled_event_id = None
+        self.started_event_id = None
+        self.previous_started_event_id = None
+
+    def add_event(self, event_type, attrs):
+        event_id = len(self.events) + 1
+        key = event_type[0].lower() + event_type[1:] + 'EventAttributes'
+        self.events.append({
+            'eventId': event_id,
+            'eventType': event_type,
+            'eventTimestamp': time.time(),
+            key: dict((k, v) for k, v in attrs.items() if v is not None),
+        })
+        return event_id
+
+    def execution(self):
+        return {'workflowId': self.workflow_id, 'runId': self.run_id}
+
+
+class _ActivityTask(object):
+    def __init__(self, run, attrs):
+        self.run = run
+        self.attrs = attrs
+        self.activity_id = attrs['activityId']
+        self.token = uuid.uuid4().hex
+        self.scheduled_event_id = None
+        self.started_event_id = None
+        self.last_heartbeat = None
+
+
+def _seconds(timeout):
+    if timeout is None or timeout == 'NONE':
+        return None
+    return float(timeout)
+
+
+def _error(fault, message):
+    body = {'__type': _FAULT % fault, 'message': message}
+    exc_class = Layer1._fault_excp.get(body['__type'], SWFResponseError)
+    return exc_class(400, 'Bad Request', body)
+
+
+_actions = {
+    'RegisterActivityType': '_register_activity_type',
+    'RegisterWorkflowType': '_register_workflow_type',
+    'DescribeActivityType': '_describe_activity_type',
+    'DescribeWorkflowType': '_describe_workflow_type',
+    'StartWorkflowExecution': '_start_workflow_execution',
+    'PollForDecisionTask': '_poll_for_decision_task',
+    'RespondDecisionTaskCompleted': '_respond_decision_task_completed',
+    'PollForActivityTask': '_poll_for_activity_task',
+    'RecordActivityTaskHeartbeat': '_record_activity_task_heartbeat',
+    'RespondActivityTaskCompleted': '_respond_activity_task_completed',
+    'RespondActivityTaskFailed': '_respond_activity_task_failed',
+}
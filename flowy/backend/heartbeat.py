@@ -0,0 +1,105 @@
+import logging
+import threading
+import time
+
+from boto.swf.exceptions import SWFResponseError
+
+logger = logging.getLogger(__name__)
+
+
+class Heartbeater(object):
+    """ Send the heartbeats of all the activities running in a worker from a
+    single background thread, using the worker's client.
+
+    Every running activity is heartbeated every `fraction` of the heartbeat
+    `timeout` the activities are scheduled with, so the CPU-bound activities
+    don't need to call :meth:`SWFActivity.heartbeat` at all. The explicit
+    calls don't block on the network, their details are sent with the next
+    heartbeats and only the last ones are kept. An activity whose cancellation
+    was requested gets its `cancel_requested` flag set. The thread exits
+    when no activity ran for a whole interval, like after the worker stopped,
+    and the next activity starts it again.
+    """
+    def __init__(self, swf_client, timeout, fraction=0.5):
+        self._swf_client = swf_client
+        self._interval = max(float(timeout) * fraction, 0.1)
+        self._beats = {}
+        self._lock = threading.Lock()
+        self._wake_up = threading.Condition(self._lock)
+        self._thread = None
+
+    def start(self, activity):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._heartbeat,
+                                                name='flowy-heartbeat')
+                self._thread.daemon = True
+                self._thread.start()
+            due = time.time() + self._interval
+            self._beats[activity] = _Beat(due)
+            self._wake_up.notify()
+
+    def stop(self, activity):
+        with self._lock:
+            self._beats.pop(activity, None)
+
+    def update(self, activity, details=None):
+        """ Coalesce an explicit heartbeat into the next one. Return False if
+        the last heartbeat failed or the cancellation was requested.
+        """
+        with self._lock:
+            beat = self._beats.get(activity)
+            if beat is None:
+                return False
+            if details is not None:
+                beat.details = details
+            return beat.ok and not activity.cancel_requested
+
+    def _heartbeat(self):
+        while 1:
+            with self._lock:
+                now = time.time()
+                due = [(a, b) for a, b in self._beats.items() if b.due <= now]
+                if not self._beats:
+                    self._wake_up.wait(self._interval)
+                    if not self._beats:
+                        self._thread = None
+                        return
+                    continue
+                if not due:
+                    wait = min(b.due for b in self._beats.values()) - now
+                    self._wake_up.wait(wait)
+                    continue
+                for activity, beat in due:
+                    beat.due = now + self._interval
+            for activity, beat in due:
+                self._send(activity, beat)
+
+    def _send(self, activity, beat):
+        try:
+            r = self._swf_client.record_activity_task_heartbeat(
+                task_token=str(activity._token),
+                details=_str_or_none(beat.details))
+        except SWFResponseError:
+            # the activity might have finished in the meantime
+            if activity in self._beats:
+                logger.exception('Error while sending the heartbeat:')
+                beat.ok = False
+            return
+        beat.ok = True
+        if r and r.get('cancelRequested'):
+            activity.cancel_requested = True
+
+
+class _Beat(object):
+    __slots__ = ('due', 'details', 'ok')
+
+    def __init__(self, due):
+        self.due = due
+        self.details = None
+        self.ok = True
+
+
+def _str_or_none(maybe_none):
+    if maybe_none is not None:
+        return str(maybe_none)
@@ -0,0 +1,94 @@
+import tempfile
+import threading
+
+
+class SpilledPayloads(object):
+    """ A mapping of call keys to the raw results of a history that keeps the
+    payloads bigger than `threshold` bytes in an anonymous temporary file,
+    only their offsets stay in memory. A payload is read back when its call
+    is looked up, so the memory used while replaying a huge history depends
+    on the results the workflow holds on to, not on the size of the history.
+
+    >>> p = SpilledPayloads(threshold=4)
+    >>> p['0-0'], p['1-0'], p['2-0'] = '"a"', '"%s"' % ('x' * 100), None
+    >>> p['1-0'] == '"%s"' % ('x' * 100), p['0-0'], p['2-0']
+    (True, '"a"', None)
+    >>> '1-0' in p, '3-0' in p, len(p), p.get('3-0')
+    (True, False, 3, None)
+    >>> p.memory_size < 100, p.has_file
+    (True, True)
+
+    """
+    def __init__(self, threshold=4096):
+        self._threshold = threshold
+        self._small = {}
+        self._spilled = {}
+        self._file = None
+        self._end = 0
+        self._lock = threading.Lock()
+        # the bytes kept in memory, for the history cache budget
+        self.memory_size = 0
+
+    def __setitem__(self, key, payload):
+        self._discard(key)
+        if payload is None or len(payload) <= self._threshold:
+            self._small[key] = payload
+            self.memory_size += len(key) + len(payload or '')
+            return
+        data = payload.encode('utf-8')
+        with self._lock:
+            if self._file is None:
+                self._file = tempfile.TemporaryFile()
+            self._file.seek(self._end)
+            self._file.write(data)
+            self._spilled[key] = (self._end, len(data))
+            self._end += len(data)
+        self.memory_size += len(key) + 16
+
+    def __getitem__(self, key):
+        try:
+            return self._small[key]
+        except KeyError:
+            offset, length = self._spilled[key]
+        with self._lock:
+            self._file.seek(offset)
+            data = self._file.read(length)
+        return data.decode('utf-8')
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return key in self._small or key in self._spilled
+
+    def __len__(self):
+        return len(self._small) + len(self._spilled)
+
+    def __iter__(self):
+        for key in self._small:
+            yield key
+        for key in self._spilled:
+            yield key
+
+    @property
+    def has_file(self):
+        """ True once a payload was spilled, the file stays open until the
+        mapping is garbage collected.
+        """
+        return self._file is not None
+
+    def payload_size(self, key):
+        """ The size of a payload without reading it. """
+        if key in self._spilled:
+            return self._spilled[key][1]
+        return len(self._small.get(key) or '')
+
+    def _discard(self, key):
+        if key in self._small:
+            self.memory_size -= len(key) + len(self._small.pop(key) or '')
+        elif key in self._spilled:
+            del self._spilled[key]
+            self.memory_size -= len(key) + 16
@@ -1,28 +1,52 @@
 import logging
+import threading
+
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
 
 from boto.swf.exceptions import SWFResponseError
 
-from flowy.spec import SWFSpecKey
-from flowy.spec import SWFWorkflowSpec
+from flowy.backend.payloads import SpilledPayloads
+from flowy.backend.retry import RetryPolicy
+from flowy.backend.spec import SWFSpecKey
+from flowy.backend.spec import SWFWorkflowSpec
+from flowy.instrument import null_instrumentation
+from flowy.instrument import null_metrics
 
 logger = logging.getLogger(__name__)
 
 
 class SWFActivityPoller(object):
-    def __init__(self, swf_client, task_list, task_factory):
+    def __init__(self, swf_client, task_list, task_factory,
+                 retry_policy=None, instrumentation=None, heartbeater=None):
+        if retry_policy is None:
+            retry_policy = RetryPolicy()
+        if instrumentation is None:
+            instrumentation = null_instrumentation
         self._swf_client = swf_client
         self._task_list = task_list
         self._task_factory = task_factory
+        self._retry_policy = retry_policy
+        self._instrumentation = instrumentation
+        self._heartbeater = heartbeater
 
     def poll_next_task(self):
-        swf_response = self._poll_response()
+        metrics = self._instrumentation.start('activity')
+        with metrics.time('poll'):
+            swf_response = self._poll_response()
         spec_key, input, token = self._parse_response(swf_response)
-        return self._task_factory(
+        task = self._task_factory(
             spec_key,
             swf_client=self._swf_client,
             input=input,
             token=token
         )
+        task._metrics = metrics
+        if self._heartbeater is not None:
+            task._heartbeater = self._heartbeater
+        return task
 
     def _parse_response(self, swf_response):
         return (
@@ -42,23 +66,118 @@ class SWFActivityPoller(object):
                     task_list=self._task_list
                 )
             except SWFResponseError:
-                # add a delay before retrying?
                 logger.exception('Error while polling for activities:')
+                self._retry_policy.failure()
+            else:
+                self._retry_policy.success()
         return swf_response
 
 
+class PrefetchPoller(object):
+    """ Decouple the long-polling from the task execution.
+
+    A background thread keeps polling with the wrapped poller and fills a
+    queue of at most `size` tasks that :meth:`poll_next_task` drains. A new
+    poll request is only issued when there is a free slot in the queue, so the
+    worker never holds more received and not yet started tasks than `size`;
+    keep it small since the tasks timers are already running while they wait
+    in the queue.
+
+    After :meth:`stop` no new poll request is issued; :meth:`poll_next_task`
+    keeps returning the tasks already received, including the one of the
+    poll in flight, and then returns None.
+    """
+    def __init__(self, poller, size=1):
+        self._poller = poller
+        self._slots = threading.Semaphore(max(int(size), 1))
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def poll_next_task(self):
+        self._start()
+        while 1:
+            try:
+                # a timeout makes the wait interruptible on Python 2
+                task = self._queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            if task is _drained:
+                self._queue.put(task)  # for the other threads
+                return None
+            self._slots.release()
+            return task
+
+    def stop(self):
+        self._stopped.set()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._prefetch,
+                                                name='flowy-prefetch')
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _prefetch(self):
+        while 1:
+            self._slots.acquire()
+            if self._stopped.is_set():
+                break
+            try:
+                task = self._poller.poll_next_task()
+            except Exception:
+                logger.exception('Error while prefetching a task:')
+                self._slots.release()
+            else:
+                self._queue.put(task)
+        self._queue.put(_drained)
+
+
+# put in the queue of a stopped PrefetchPoller after the last task
+_drained = object()
+
+
 class SWFWorkflowPoller(object):
+    _page_attempts = 7
+
     def __init__(self, swf_client, task_list, task_factory,
-                 spec_factory=SWFWorkflowSpec):
+                 spec_factory=SWFWorkflowSpec, history_cache=None,
+                 retry_policy=None, event_handlers=None,
+                 instrumentation=None, spill_threshold=None,
+                 page_prefetch=0):
+        if retry_policy is None:
+            retry_policy = RetryPolicy()
+        if instrumentation is None:
+            instrumentation = null_instrumentation
+        self._event_handlers = dict(default_event_handlers)
+        if event_handlers is not None:
+            self._event_handlers.update(event_handlers)
         self._swf_client = swf_client
         self._task_list = task_list
         self._task_factory = task_factory
         self._spec_factory = spec_factory
+        self._history_cache = history_cache
+        self._retry_policy = retry_policy
+        self._instrumentation = instrumentation
+        self._spill_threshold = spill_threshold
+        self._page_prefetch = page_prefetch
 
     def poll_next_task(self):
-        first_page = self._poll_response_first_page()
+        metrics = self._instrumentation.start('decision')
+        if self._history_cache is not None:
+            task = self._poll_next_task_cached(metrics)
+        else:
+            task = self._poll_next_task(metrics)
+        task._metrics = metrics
+        return task
+
+    def _poll_next_task(self, metrics):
+        with metrics.time('poll'):
+            first_page = self._poll_response_first_page()
         token = _parse_token(first_page)
-        all_events = self._events(first_page)
+        all_events = self._events(first_page, metrics=metrics)
         # the first page sometimes contains an empty events list, because
         # of that we can't get the WorkflowExecutionStarted before the
         # events generator is created - is this an Amazon SWF bug?
@@ -67,22 +186,88 @@ class SWFWorkflowPoller(object):
         spec = _parse_spec(first_event, self._spec_factory)
         tags = _parse_tags(first_event)
         try:
-            p = self._parse_events
-            running, timedout, results, errors, order = p(all_events)
+            with metrics.time('parse'):
+                h = self._parse_events(all_events)
         except _PaginationError:
-            return self.poll_next_task()
+            return self._poll_next_task(metrics)
         return self._task_factory(spec, self._swf_client, input, token,
-                                  running, timedout, results, errors, order,
-                                  spec, tags)
+                                  h.running, h.timedout, h.results, h.errors,
+                                  h.order, spec, tags, extra=h.extra)
 
-    def _events(self, first_page):
-        page = first_page
-        while 1:
+    def _poll_next_task_cached(self, metrics):
+        # The history is requested newest events first so the pagination can
+        # stop as soon as it reaches the events already parsed by the previous
+        # decision of the same run. The previous decision saw everything up to
+        # previousStartedEventId, the cache remembers the last event parsed.
+        with metrics.time('poll'):
+            first_page = self._poll_response_first_page(reverse_order=True)
+        token = _parse_token(first_page)
+        run_id = first_page['workflowExecution']['runId']
+        history = self._history_cache.get(run_id)
+        last_event_id = 0
+        if history is not None:
+            last_event_id = history.last_event_id
+        new_events = []
+        try:
+            for event in self._events(first_page, reverse_order=True,
+                                      metrics=metrics,
+                                      last_event_id=last_event_id):
+                if event['eventId'] <= last_event_id:
+                    break
+                new_events.append(event)
+        except _PaginationError:
+            return self._poll_next_task_cached(metrics)
+        new_events.reverse()
+        if history is None:
+            first_event = new_events[0]
+            history = _History(_parse_input(first_event),
+                               _parse_spec(first_event, self._spec_factory),
+                               _parse_tags(first_event),
+                               self._spill_threshold)
+        try:
+            with metrics.time('parse'):
+                self._parse_events(new_events, history)
+        except Exception:
+            # don't keep a partially updated history around
+            self._history_cache.discard(run_id)
+            raise
+        if new_events:
+            history.last_event_id = new_events[-1]['eventId']
+        self._history_cache.put(run_id, history)
+        task = self._task_factory(history.spec, self._swf_client,
+                                  history.input, token, history.running,
+                                  history.timedout, history.results,
+                                  history.errors, history.order, history.spec,
+                                  history.tags, extra=history.extra)
+        if self._history_cache.keep_decoded:
+            # not copied, the decoded values are shared by the decisions of
+            # the run and must not be modified by the workflow
+            task._decoded = history.decoded
+        return task
+
+    def _events(self, first_page, reverse_order=None, metrics=null_metrics,
+                last_event_id=None):
+        if self._page_prefetch:
+            pages = self._prefetched_pages(first_page, reverse_order, metrics,
+                                           last_event_id)
+        else:
+            pages = self._pages(first_page, reverse_order, metrics)
+        for page in pages:
+            metrics.count('pages')
+            metrics.count('events', len(page['events']))
             for event in page['events']:
                 yield event
+
+    def _pages(self, first_page, reverse_order=None, metrics=null_metrics):
+        page = first_page
+        while 1:
+            yield page
             if not page.get('nextPageToken'):
                 break
-            next_p = self._poll_response_page(page_token=page['nextPageToken'])
+            with metrics.time('pagination'):
+                next_p = self._poll_response_page(
+                    page_token=page['nextPageToken'],
+                    reverse_order=reverse_order)
             # curiously enough, this assert doesn't always hold...
             # assert (
             #     next_p['taskToken'] == page['taskToken']
@@ -98,110 +283,111 @@ class SWFWorkflowPoller(object):
             # ), 'Inconsistent decision pages.'
             page = next_p
 
-    def _parse_events(self, events):
-        running, timedout, results, errors, order = set(), set(), {}, {}, []
-        event2call = {}
+    def _prefetched_pages(self, first_page, reverse_order=None,
+                          metrics=null_metrics, last_event_id=None):
+        """ Fetch the next pages on a background thread while the current
+        one is parsed, at most `page_prefetch` pages ahead. The pagination
+        time is the time spent waiting for them.
+
+        In reverse order the fetching stops at the page that reaches
+        `last_event_id`, the events before it are already known.
+        """
+        def last_page(page):
+            if not page.get('nextPageToken'):
+                return True
+            events = page['events']
+            return (reverse_order and last_event_id and events
+                    and events[-1]['eventId'] <= last_event_id)
+
+        if last_page(first_page):
+            yield first_page
+            return
+        pages = queue.Queue(self._page_prefetch)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    # a timeout so an abandoned history doesn't block forever
+                    pages.put(item, timeout=1)
+                    return
+                except queue.Full:
+                    continue
+
+        def fetch():
+            page = first_page
+            try:
+                while not last_page(page) and not stop.is_set():
+                    page = self._poll_response_page(
+                        page_token=page['nextPageToken'],
+                        reverse_order=reverse_order)
+                    put(page)
+            except Exception as e:
+                put(e)
+            put(None)
+
+        thread = threading.Thread(target=fetch, name='flowy-pages')
+        thread.daemon = True
+        if reverse_order:
+            # the newest events first are read by the cached histories that
+            # usually stop within the first page, only prefetch past it
+            yield first_page
+        thread.start()
+        try:
+            if not reverse_order:
+                yield first_page
+            while 1:
+                with metrics.time('pagination'):
+                    page = pages.get()
+                if page is None:
+                    break
+                if isinstance(page, Exception):
+                    raise page
+                yield page
+        finally:
+            stop.set()
+
+    def _parse_events(self, events, history=None):
+        if history is None:
+            history = _History(spill_threshold=self._spill_threshold)
+        handlers = self._event_handlers
         for e in events:
-            e_type = e.get('eventType')
-            if e_type == 'ActivityTaskScheduled':
-                id = e['activityTaskScheduledEventAttributes']['activityId']
-                event2call[e['eventId']] = id
-                running.add(id)
-            elif e_type == 'ActivityTaskCompleted':
-                ATCEA = 'activityTaskCompletedEventAttributes'
-                id = event2call[e[ATCEA]['scheduledEventId']]
-                result = e[ATCEA]['result']
-                running.remove(id)
-                results[id] = result
-                order.append(id)
-            elif e_type == 'ActivityTaskFailed':
-                ATFEA = 'activityTaskFailedEventAttributes'
-                id = event2call[e[ATFEA]['scheduledEventId']]
-                reason = e[ATFEA]['reason']
-                running.remove(id)
-                errors[id] = reason
-                order.append(id)
-            elif e_type == 'ActivityTaskTimedOut':
-                ATTOEA = 'activityTaskTimedOutEventAttributes'
-                id = event2call[e[ATTOEA]['scheduledEventId']]
-                running.remove(id)
-                timedout.add(id)
-                order.append(id)
-            elif e_type == 'ScheduleActivityTaskFailed':
-                SATFEA = 'scheduleActivityTaskFailedEventAttributes'
-                id = e[SATFEA]['activityId']
-                reason = e[SATFEA]['cause']
-                # when a job is not found it's not even started
-                errors[id] = reason
-                order.append(id)
-            elif e_type == 'StartChildWorkflowExecutionInitiated':
-                SCWEIEA = 'startChildWorkflowExecutionInitiatedEventAttributes'
-                id = _subworkflow_id(e[SCWEIEA]['workflowId'])
-                running.add(id)
-            elif e_type == 'ChildWorkflowExecutionCompleted':
-                CWECEA = 'childWorkflowExecutionCompletedEventAttributes'
-                id = _subworkflow_id(
-                    e[CWECEA]['workflowExecution']['workflowId']
-                )
-                result = e[CWECEA]['result']
-                running.remove(id)
-                results[id] = result
-                order.append(id)
-            elif e_type == 'ChildWorkflowExecutionFailed':
-                CWEFEA = 'childWorkflowExecutionFailedEventAttributes'
-                id = _subworkflow_id(
-                    e[CWEFEA]['workflowExecution']['workflowId']
-                )
-                reason = e[CWEFEA]['reason']
-                running.remove(id)
-                errors[id] = reason
-                order.append(id)
-            elif e_type == 'ChildWorkflowExecutionTimedOut':
-                CWETOEA = 'childWorkflowExecutionTimedOutEventAttributes'
-                id = _subworkflow_id(
-                    e[CWETOEA]['workflowExecution']['workflowId']
-                )
-                running.remove(id)
-                timedout.add(id)
-                order.append(id)
-            elif e_type == 'StartChildWorkflowExecutionFailed':
-                SCWEFEA = 'startChildWorkflowExecutionFailedEventAttributes'
-                id = _subworkflow_id(e[SCWEFEA]['workflowId'])
-                reason = e[SCWEFEA]['cause']
-                errors[id] = reason
-                order.append(id)
-            elif e_type == 'TimerStarted':
-                id = e['timerStartedEventAttributes']['timerId']
-                running.add(id)
-            elif e_type == 'TimerFired':
-                id = e['timerFiredEventAttributes']['timerId']
-                running.remove(id)
-                results[id] = None
-        return running, timedout, results, errors, order
-
-    def _poll_response_first_page(self):
+            handler = handlers.get(e.get('eventType'))
+            if handler is not None:
+                handler(history, e)
+        return history
+
+    def _poll_response_first_page(self, reverse_order=None):
         swf_response = {}
         while 'taskToken' not in swf_response or not swf_response['taskToken']:
             try:
                 swf_response = self._swf_client.poll_for_decision_task(
-                    task_list=self._task_list
+                    task_list=self._task_list, reverse_order=reverse_order
                 )
             except SWFResponseError:
                 logger.exception('Error while polling for decisions:')
+                self._retry_policy.failure()
+            else:
+                self._retry_policy.success()
         return swf_response
 
-    def _poll_response_page(self, page_token):
-        swf_response = None
-        for _ in range(7):  # give up after a limited number of retries
+    def _poll_response_page(self, page_token, reverse_order=None):
+        # give up after a limited number of retries, before the decision
+        # times out; the retries back off without counting as failures of
+        # the shared policy, its circuit breaker pause would lose the task
+        for attempt in range(self._page_attempts):
+            if attempt:
+                self._retry_policy.backoff(attempt - 1)
             try:
                 swf_response = self._swf_client.poll_for_decision_task(
-                    task_list=self._task_list, next_page_token=page_token)
-                break
+                    task_list=self._task_list, next_page_token=page_token,
+                    reverse_order=reverse_order)
             except SWFResponseError:
                 logger.exception('Error while polling for decision page:')
-        else:
-            raise _PaginationError()
-        return swf_response
+            else:
+                self._retry_policy.success()
+                return swf_response
+        raise _PaginationError()
 
 
 def _parse_token(page):
@@ -236,5 +422,176 @@ def _subworkflow_id(workflow_id):
     return workflow_id.rsplit('-', 1)[-1]
 
 
+# The history events handlers. Each one is called with the history state and
+# the event and updates the state in place; extra handlers, for signals or
+# markers for example, can be passed to the workflow poller and keep what
+# they collect in the `extra` dict, passed to the workflow. The results and
+# errors are added with add_result and add_error so the history cache knows
+# their size.
+
+def _activity_scheduled(h, e):
+    id = e['activityTaskScheduledEventAttributes']['activityId']
+    h.event2call[e['eventId']] = id
+    h.running.add(id)
+
+
+def _activity_completed(h, e):
+    attrs = e['activityTaskCompletedEventAttributes']
+    id = h.event2call[attrs['scheduledEventId']]
+    h.running.remove(id)
+    h.add_result(id, attrs['result'])
+    h.order.append(id)
+
+
+def _activity_failed(h, e):
+    attrs = e['activityTaskFailedEventAttributes']
+    id = h.event2call[attrs['scheduledEventId']]
+    h.running.remove(id)
+    h.add_error(id, attrs['reason'])
+    h.order.append(id)
+
+
+def _activity_timedout(h, e):
+    attrs = e['activityTaskTimedOutEventAttributes']
+    id = h.event2call[attrs['scheduledEventId']]
+    h.running.remove(id)
+    h.timedout.add(id)
+    h.order.append(id)
+
+
+def _schedule_activity_failed(h, e):
+    attrs = e['scheduleActivityTaskFailedEventAttributes']
+    id = attrs['activityId']
+    # when a job is not found it's not even started
+    h.add_error(id, attrs['cause'])
+    h.order.append(id)
+
+
+def _child_workflow_initiated(h, e):
+    attrs = e['startChildWorkflowExecutionInitiatedEventAttributes']
+    h.running.add(_subworkflow_id(attrs['workflowId']))
+
+
+def _child_workflow_completed(h, e):
+    attrs = e['childWorkflowExecutionCompletedEventAttributes']
+    id = _subworkflow_id(attrs['workflowExecution']['workflowId'])
+    h.running.remove(id)
+    h.add_result(id, attrs['result'])
+    h.order.append(id)
+
+
+def _child_workflow_failed(h, e):
+    attrs = e['childWorkflowExecutionFailedEventAttributes']
+    id = _subworkflow_id(attrs['workflowExecution']['workflowId'])
+    h.running.remove(id)
+    h.add_error(id, attrs['reason'])
+    h.order.append(id)
+
+
+def _child_workflow_timedout(h, e):
+    attrs = e['childWorkflowExecutionTimedOutEventAttributes']
+    id = _subworkflow_id(attrs['workflowExecution']['workflowId'])
+    h.running.remove(id)
+    h.timedout.add(id)
+    h.order.append(id)
+
+
+def _start_child_workflow_failed(h, e):
+    attrs = e['startChildWorkflowExecutionFailedEventAttributes']
+    id = _subworkflow_id(attrs['workflowId'])
+    h.add_error(id, attrs['cause'])
+    h.order.append(id)
+
+
+def _timer_started(h, e):
+    h.running.add(e['timerStartedEventAttributes']['timerId'])
+
+
+def _timer_fired(h, e):
+    id = e['timerFiredEventAttributes']['timerId']
+    h.running.remove(id)
+    h.add_result(id, None)
+
+
+default_event_handlers = {
+    'ActivityTaskScheduled': _activity_scheduled,
+    'ActivityTaskCompleted': _activity_completed,
+    'ActivityTaskFailed': _activity_failed,
+    'ActivityTaskTimedOut': _activity_timedout,
+    'ScheduleActivityTaskFailed': _schedule_activity_failed,
+    'StartChildWorkflowExecutionInitiated': _child_workflow_initiated,
+    'ChildWorkflowExecutionCompleted': _child_workflow_completed,
+    'ChildWorkflowExecutionFailed': _child_workflow_failed,
+    'ChildWorkflowExecutionTimedOut': _child_workflow_timedout,
+    'StartChildWorkflowExecutionFailed': _start_child_workflow_failed,
+    'TimerStarted': _timer_started,
+    'TimerFired': _timer_fired,
+}
+
+
+class _History(object):
+    """ The state of a workflow run as parsed from its decision history. With
+    a `spill_threshold` the big results are kept on disk until looked up.
+    """
+    def __init__(self, input=None, spec=None, tags=None,
+                 spill_threshold=None):
+        self.input = input
+        self.spec = spec
+        self.tags = tags
+        self.running = set()
+        self.timedout = set()
+        self.results = {}
+        if spill_threshold is not None:
+            self.results = SpilledPayloads(spill_threshold)
+        self.errors = {}
+        self.order = []
+        self.event2call = {}
+        # the state collected by the custom event handlers
+        self.extra = {}
+        self.last_event_id = 0
+        self.decoded = _Decoded(self)
+        # the bytes of the errors, of the results not spilled to disk and
+        # of the decoded results, counted as they are added
+        self._bytes = 0
+
+    def add_result(self, call_key, payload):
+        self.results[call_key] = payload
+        if not isinstance(self.results, SpilledPayloads):
+            self._bytes += len(call_key) + len(payload or '')
+
+    def add_error(self, call_key, reason):
+        self.errors[call_key] = reason
+        self._bytes += len(call_key) + len(reason or '')
+
+    def payload_size(self, call_key):
+        results = self.results
+        if isinstance(results, SpilledPayloads):
+            return results.payload_size(call_key)
+        return len(results.get(call_key) or '')
+
+    @property
+    def size(self):
+        """ The approximate memory used by the history, in bytes. """
+        size = self._bytes + 64 * (len(self.running) + len(self.timedout)
+                                   + len(self.event2call))
+        if isinstance(self.results, SpilledPayloads):
+            size += self.results.memory_size
+        return size
+
+
+class _Decoded(dict):
+    """ The decoded results of a history, each one is assumed as big as its
+    payload.
+    """
+    def __init__(self, history):
+        super(_Decoded, self).__init__()
+        self._history = history
+
+    def __setitem__(self, call_key, value):
+        if call_key not in self:
+            self._history._bytes += self._history.payload_size(call_key)
+        super(_Decoded, self).__setitem__(call_key, value)
+
+
 class _PaginationError(RuntimeError):
     """ A page of the history is unavailable. """
@@ -0,0 +1,127 @@
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class RetryPolicy(object):
+    """ Exponential backoff with jitter and a circuit breaker for retries.
+
+    Call :meth:`failure` after each failed attempt, it sleeps before the next
+    one, and :meth:`success` after a successful one. The delay doubles with
+    every consecutive failure, starting from `base` and capped at `max_delay`
+    seconds; with `jitter` on, a random delay between 0 and that value is used
+    so the workers of a fleet don't retry in lockstep. After `max_failures`
+    consecutive failures the circuit opens and every attempt waits `pause`
+    seconds until one of them succeeds.
+
+    The state is shared, one policy can be used by all the pollers of a
+    worker so they back off together while the service is throttling.
+
+    >>> delays = []
+    >>> p = RetryPolicy(base=1, max_delay=5, jitter=False, max_failures=5,
+    ...                 pause=60, sleep=delays.append)
+    >>> for _ in range(6):
+    ...     p.failure()
+    >>> delays
+    [1, 2, 4, 5, 60, 60]
+    >>> p.success()
+    >>> p.failure()
+    >>> delays[-1]
+    1
+
+    """
+    def __init__(self, base=0.1, max_delay=20, jitter=True, max_failures=10,
+                 pause=60, sleep=time.sleep):
+        self._base = base
+        self._max_delay = max_delay
+        self._jitter = jitter
+        self._max_failures = max_failures
+        self._pause = pause
+        self._sleep = sleep
+        self._failures = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # pickled for the worker processes started with spawn
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            failures = self._failures
+        if self._max_failures and failures >= self._max_failures:
+            if failures == self._max_failures:
+                logger.warning('%s consecutive failures, pausing for %ss.',
+                               failures, self._pause)
+            self._sleep(self._pause)
+        else:
+            self._sleep(self.delay(failures - 1))
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+
+    def backoff(self, attempt):
+        """ Sleep before retrying a single call, without counting a failure:
+        the retries of one call can't open the circuit of the others.
+
+        >>> delays = []
+        >>> p = RetryPolicy(base=1, jitter=False, max_failures=2,
+        ...                 sleep=delays.append)
+        >>> for attempt in range(3):
+        ...     p.backoff(attempt)
+        >>> p.failure()
+        >>> delays
+        [1, 2, 4, 1]
+
+        """
+        self._sleep(self.delay(attempt))
+
+    def delay(self, attempt):
+        delay = min(self._base * 2 ** attempt, self._max_delay)
+        if self._jitter:
+            delay = random.uniform(0, delay)
+        return delay
+
+
+class RateLimiter(object):
+    """ Allow at most `rate` calls per second, shared by many threads.
+
+    :meth:`acquire` sleeps until the next call is allowed, the calls are
+    evenly spaced with bursts of at most `burst` calls.
+
+    >>> delays = []
+    >>> clock = [0.25, 0, 0].pop  # the third call comes after a sleep
+    >>> r = RateLimiter(4, burst=1, sleep=delays.append, clock=clock)
+    >>> for _ in range(3):
+    ...     r.acquire()
+    >>> delays
+    [0.25, 0.25]
+
+    """
+    def __init__(self, rate, burst=1, sleep=time.sleep, clock=time.time):
+        self._interval = 1.0 / rate
+        self._burst = burst * self._interval
+        self._sleep = sleep
+        self._clock = clock
+        self._next = None
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = self._clock()
+            if self._next is None or self._next < now - self._burst:
+                self._next = now - self._burst
+            self._next += self._interval
+            delay = self._next - now
+        if delay > 0:
+            self._sleep(delay)
@@ -6,6 +6,8 @@ from functools import total_ordering
 from boto.swf.exceptions import SWFResponseError
 from boto.swf.exceptions import SWFTypeAlreadyExistsError
 
+from flowy.serialization import default_serializer
+
 logger = logging.getLogger(__name__)
 
 
@@ -21,7 +23,9 @@ def SWFSpecKey(name, version):
 class SWFActivitySpec(object):
     def __init__(self, name, version, task_list=None, heartbeat=None,
                  schedule_to_close=None, schedule_to_start=None,
-                 start_to_close=None):
+                 start_to_close=None, serializer=None):
+        if serializer is None:
+            serializer = default_serializer
         self._name = name
         self._version = version
         self._task_list = task_list
@@ -29,6 +33,7 @@ class SWFActivitySpec(object):
         self._schedule_to_close = schedule_to_close
         self._schedule_to_start = schedule_to_start
         self._start_to_close = start_to_close
+        self._serializer = serializer
 
     def schedule(self, swf_decisions, call_key, a, kw):
         input = str(self._serialize_arguments(a, kw))
@@ -130,6 +135,20 @@ class SWFActivitySpec(object):
     def __hash__(self):
         return hash(self._key)
 
+    def _serialize_arguments(self, a, kw):
+        return self._serializer.serialize_args(a, kw)
+
+    def _config(self):
+        return {
+            'name': self._name,
+            'version': self._version,
+            'task_list': self._task_list,
+            'heartbeat': self._heartbeat,
+            'schedule_to_close': self._schedule_to_close,
+            'schedule_to_start': self._schedule_to_start,
+            'start_to_close': self._start_to_close,
+        }
+
     def _timers_encode(self):
         return (
             _timer_encode(self._heartbeat, 'heartbeat'),
@@ -150,26 +169,32 @@ class SWFActivitySpec(object):
 @total_ordering
 class SWFWorkflowSpec(object):
     def __init__(self, name, version, task_list=None, decision_duration=None,
-                 workflow_duration=None):
+                 workflow_duration=None, serializer=None):
+        if serializer is None:
+            serializer = default_serializer
         self._name = name
         self._version = version
         self._task_list = task_list
         self._decision_duration = decision_duration
         self._workflow_duration = workflow_duration
+        self._serializer = serializer
 
     def start(self, swf_client, call_id, input, tags=None):
-        decision_duration, workflow_duration = self._timers_encode()
         try:
-            r = swf_client.start_workflow_execution(
-                str(call_id), str(self._name), str(self._version),
-                task_start_to_close_timeout=decision_duration,
-                execution_start_to_close_timeout=workflow_duration,
-                task_list=_str_or_none(self._task_list),
-                input=str(input),
-                tag_list=_tags_encode(tags))
+            return self._start(swf_client, call_id, input, tags)
         except SWFResponseError:
             logger.exception('Error while starting the workflow:')
             return None
+
+    def _start(self, swf_client, call_id, input, tags=None):
+        decision_duration, workflow_duration = self._timers_encode()
+        r = swf_client.start_workflow_execution(
+            str(call_id), str(self._name), str(self._version),
+            task_start_to_close_timeout=decision_duration,
+            execution_start_to_close_timeout=workflow_duration,
+            task_list=_str_or_none(self._task_list),
+            input=str(input),
+            tag_list=_tags_encode(tags))
         return r['runId']
 
     def restart(self, swf_decisions, input, tags=None):
@@ -271,6 +296,18 @@ class SWFWorkflowSpec(object):
     def __hash__(self):
         return hash(self._key)
 
+    def _serialize_arguments(self, a, kw):
+        return self._serializer.serialize_args(a, kw)
+
+    def _config(self):
+        return {
+            'name': self._name,
+            'version': self._version,
+            'task_list': self._task_list,
+            'decision_duration': self._decision_duration,
+            'workflow_duration': self._workflow_duration,
+        }
+
     def _timers_encode(self):
         return (
             _timer_encode(self._decision_duration, 'decision_duration'),
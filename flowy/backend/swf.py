@@ -1,183 +1,257 @@
+import importlib
+import json
+import logging
+import uuid
 from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
 
+import venusian
+from boto.swf.exceptions import SWFResponseError
+from boto.swf.layer1_decisions import Layer1Decisions
+
+from flowy.backend.spec import SWFActivitySpec
+from flowy.backend.spec import SWFWorkflowSpec
 from flowy.proxy import _sentinel
 from flowy.proxy import TaskProxy
+from flowy.result import Result
+from flowy.scanner import Scanner
+from flowy.scanner import TaskRegistry
+from flowy.serialization import default_serializer
+from flowy.task import _RESULT
 from flowy.task import Task
 from flowy.task import Workflow
 
+logger = logging.getLogger(__name__)
+
 
 class SWFActivity(Task):
 
+    serializer = default_serializer
+    # set by the poller when the heartbeats are sent automatically
+    _heartbeater = None
+    cancel_requested = False
+
     def __init__(self, swf_client, input, token):
         self._swf_client = swf_client
         self._token = token
         super(SWFActivity, self).__init__(input)
 
-    def heartbeat(self):
+    def heartbeat(self, details=None):
+        """ Return False if the heartbeat failed or the cancellation of the
+        activity was requested. With automatic heartbeats it doesn't wait for
+        the network and the details are sent with the next heartbeat.
+        """
+        if self._heartbeater is not None:
+            return self._heartbeater.update(self, details)
+        if details is not None:
+            details = str(details)
         try:
             t = str(self._token)
-            self._swf_client.record_activity_task_heartbeat(task_token=t)
+            r = self._swf_client.record_activity_task_heartbeat(
+                task_token=t, details=details)
         except SWFResponseError:
             logger.exception('Error while sending the heartbeat:')
             return False
-        return True
+        if r and r.get('cancelRequested'):
+            self.cancel_requested = True
+        return not self.cancel_requested
+
+    def _call(self):
+        if self._heartbeater is None:
+            super(SWFActivity, self)._call()
+            return
+        self._heartbeater.start(self)
+        try:
+            super(SWFActivity, self)._call()
+        finally:
+            self._heartbeater.stop(self)
+
+    def serialize_result(self, result):
+        return self.serializer.serialize_result(result)
 
     def _flush(self):
         pass
 
     def _fail(self, reason):
+        if self._heartbeater is not None:
+            self._heartbeater.stop(self)
         try:
-            self._swf_client.respond_activity_task_failed(
-                reason=str(reason)[:256], task_token=str(self._token))
+            with self._metrics.time('send'):
+                self._swf_client.respond_activity_task_failed(
+                    reason=str(reason)[:256], task_token=str(self._token))
         except SWFResponseError:
             logger.exception('Error while failing the activity:')
 
     def _finish(self, result):
+        if self._heartbeater is not None:
+            self._heartbeater.stop(self)
         try:
             result = self.serialize_result(result)
         except Exception as e:
             logger.exception('Error while serializing the result:')
             self._fail(e)
+            return
         try:
-            self._swf_client.respond_activity_task_completed(
-                result=str(result), task_token=str(self._token))
+            with self._metrics.time('send'):
+                self._swf_client.respond_activity_task_completed(
+                    result=str(result), task_token=str(self._token))
         except SWFResponseError:
             logger.exception('Error while finishing the activity:')
 
 
 class SWFWorkflow(Workflow):
-    def __init__(self, swf_client, token, timers, input, running, timedout,
-                 results, errors, order):
+    """ A workflow that is its own backend, the decisions are collected in
+    boto's Layer1Decisions and sent to SWF when the decision ends.
+
+    The state collected from the history by the custom `event_handlers` of
+    the worker is in :attr:`extra`, shared by the decisions of a cached run.
+    """
+    serializer = default_serializer
+
+    def __init__(self, swf_client, input, token, running, timedout, results,
+                 errors, order, spec=None, tags=None, extra=None):
         self._swf_client = swf_client
         self._token = token
-        self._timers = timers
+        self._spec = spec
+        self._tags = tags
+        self.extra = extra if extra is not None else {}
+        self._decisions = Layer1Decisions()
         super(SWFWorkflow, self).__init__(input, running, timedout, results,
                                           errors, order)
 
-    def _restart(self, *args, **kwargs):
-        decisions = Layer1Decisions()
-        decision_duration, workflow_duration = self._timers_encode()
-        # BOTO has a bug in this call when setting the decision_duration
-        decisions.continue_as_new_workflow_execution(
-            start_to_close_timeout=decision_duration,
-            execution_start_to_close_timeout=workflow_duration,
-            task_list=_str_or_none(self._task_list),
-            input=str(input),
-            tag_list=_tags_encode(tags))
-        CANWEDA = 'continueAsNewWorkflowExecutionDecisionAttributes'
-        last_decision_attrs = swf_decisions._data[-1][CANWEDA]
-        STCT, TSTCT = 'startToCloseTimeout', 'taskStartToCloseTimeout'
-        if STCT in last_decision_attrs:
-            last_decision_attrs[TSTCT] = last_decision_attrs.pop(STCT)
-        self._flush_layer1(decisions)
-
-    def _complete(self, result):
-        decisions = Layer1Decisions()
-        result = str(self.serialize_result(result))
-        decisions.complete_workflow_execution(result)
-        self._flush_layer1(decisions)
+    def serialize_result(self, result):
+        return self.serializer.serialize_result(result)
 
-    def _fail(self, reason):
-        decisions = Layer1Decisions()
-        decisions.fail_workflow_execution(reason=str(reason)[:256])
-        self._flush_layer1(decisions)
+    def schedule(self, proxy, call_key, a, kw, delay):
+        timer_id = '%s:timer' % call_key
+        if not delay or self._calls.get(timer_id) is _RESULT:
+            proxy.schedule(self._decisions, call_key, a, kw)
+        elif timer_id not in self._calls:
+            self._decisions.start_timer(start_to_fire_timeout=str(delay),
+                                        timer_id=timer_id)
 
-    def _flush(self):
-        decisions = Layer1Decisions()
-        for proxy, call_key, a, kw, delay in self._scheduled:
-            if call_key in self._timers:
-                proxy.schedule(decisions, call_key, a, kw, delay)
-            else:
-                decisions.start_timer(start_to_fire_timeout=str(delay),
-                                      timer_id='%s:timer' % call_key)
-        self._flush_layer1(decisions)
+    def wake_up(self, timer_id):
+        self._decisions.start_timer(start_to_fire_timeout='0',
+                                    timer_id=timer_id)
+
+    def restart(self, a, kw):
+        input = self.serializer.serialize_args(a, kw)
+        self._spec.restart(self._decisions, input, self._tags)
+        self._send()
+
+    def complete(self, result):
+        try:
+            result = self.serialize_result(result)
+        except Exception as e:
+            logger.exception('Error while serializing the result:')
+            self.fail(e)
+            return
+        self._decisions.complete_workflow_execution(str(result))
+        self._send()
+
+    def fail(self, reason):
+        self._decisions = Layer1Decisions()
+        self._decisions.fail_workflow_execution(reason=str(reason)[:256])
+        self._send()
+
+    def flush(self):
+        self._respond()
 
-    def _flush_layer1(self, decisions):
+    def _send(self):
+        with self._metrics.time('send'):
+            self._respond()
+
+    def _respond(self):
         try:
-            task_completed = self._swf_client.respond_decision_task_completed(
-                task_token=self._token, decisions=self._decisions._data)
+            self._swf_client.respond_decision_task_completed(
+                task_token=str(self._token), decisions=self._decisions._data)
         except SWFResponseError:
             logger.exception('Error while sending the decisions:')
 
 
 class JSONResult(Result):
-    pass
+    __slots__ = ()
 
 
 class SWFActivityProxy(TaskProxy):
     def __init__(self, name, version, task_list=None, heartbeat=None,
                  schedule_to_close=None, schedule_to_start=None,
-                 start_to_close=None, retry=[0, 0, 0], error_handling=False):
-        self._name = name
-        self._version = version
-        self._task_list = task_list
-        self._hartbeat = heartbeat
-        self._schedule_to_close = schedule_to_close
-        self._schedule_to_start = schedule_to_start
-        self._start_to_close = start_to_close
+                 start_to_close=None, retry=[0, 0, 0], error_handling=False,
+                 serializer=None, limit=None, weight=1):
+        self._spec = SWFActivitySpec(name, version, task_list, heartbeat,
+                                     schedule_to_close, schedule_to_start,
+                                     start_to_close, serializer)
+        self._limit = limit
+        self._weight = weight
         super(SWFActivityProxy, self).__init__(retry, error_handling)
 
+    @property
+    def _task_list(self):
+        return self._spec._task_list
+
+    @property
+    def _serializer(self):
+        return self._spec._serializer
+
     @contextmanager
     def options(self, task_list=_sentinel, heartbeat=_sentinel,
                 schedule_to_close=_sentinel, schedule_to_start=_sentinel,
                 start_to_close=_sentinel, retry=_sentinel,
-                error_handling=_sentinel):
-        old_task_list = self._task_list
-        old_heartbeat = self._heartbeat
-        old_schedule_to_close = self._schedule_to_close
-        old_schedule_to_start = self._schedule_to_start
-        old_start_to_close = self._start_to_close
-        if task_list is not _sentinel:
-            self._task_list = task_list
-        if heartbeat is not _sentinel:
-            self._heartbeat = heartbeat
-        if schedule_to_close is not _sentinel:
-            self._schedule_to_close = schedule_to_close
-        if schedule_to_start is not _sentinel:
-            self._schedule_to_start = schedule_to_start
-        if start_to_close is not _sentinel:
-            self._start_to_close = start_to_close
-        with super(SWFActivityProxy, self).options(retry, error_handling):
-            yield
-        self._task_list = old_task_list
-        self._heartbeat = old_heartbeat
-        self._schedule_to_close = old_schedule_to_close
-        self._schedule_to_start = old_schedule_to_start
-        self._start_to_close = old_start_to_close
-
-    def schedule(self, scheduler, *args, **kwargs):
-        input = str(self._serialize_arguments(a, kw))
-        heartbeat, schedule_to_close, schedule_to_start, start_to_close = (
-            self._timers_encode())
-        swf_decisions.schedule_activity_task(
-            str(call_key), str(self._name), str(self._version),
-            heartbeat_timeout=heartbeat,
-            schedule_to_close_timeout=schedule_to_close,
-            schedule_to_start_timeout=schedule_to_start,
-            start_to_close_timeout=start_to_close,
-            task_list=_str_or_none(self._task_list),
-            input=input)
+                error_handling=_sentinel, limit=_sentinel, weight=_sentinel):
+        old_limit, old_weight = self._limit, self._weight
+        if limit is not _sentinel:
+            self._limit = limit
+        if weight is not _sentinel:
+            self._weight = weight
+        try:
+            with self._spec.options(task_list, heartbeat, schedule_to_close,
+                                    schedule_to_start, start_to_close):
+                with super(SWFActivityProxy, self).options(retry,
+                                                           error_handling):
+                    yield
+        finally:
+            self._limit, self._weight = old_limit, old_weight
+
+    def schedule(self, swf_decisions, call_key, a, kw):
+        return self._spec.schedule(swf_decisions, call_key, a, kw)
 
 
 class SWFWorkflowProxy(TaskProxy):
     def __init__(self, name, version, task_list=None, decision_duration=None,
                  workflow_duration=None, retry=[0, 0, 0], error_handling=False,
-                 serialize_arguments=serialize_arguments,
-                 deserialize_result=deserialize_result):
+                 serializer=None, limit=None, weight=1):
         self._spec = SWFWorkflowSpec(name, version, task_list,
                                      decision_duration, workflow_duration,
-                                     serialize_arguments)
-        super(SWFWorkflowProxy, self).__init__(retry, error_handling,
-                                               deserialize_result)
+                                     serializer)
+        self._limit = limit
+        self._weight = weight
+        super(SWFWorkflowProxy, self).__init__(retry, error_handling)
+
+    @property
+    def _task_list(self):
+        return self._spec._task_list
+
+    @property
+    def _serializer(self):
+        return self._spec._serializer
 
     @contextmanager
     def options(self, task_list=_sentinel, decision_duration=_sentinel,
                 workflow_duration=_sentinel, retry=_sentinel,
-                error_handling=_sentinel):
-        with self._spec.options(task_list, decision_duration,
-                                workflow_duration):
-            with super(SWFWorkflowProxy, self).options(retry, error_handling):
-                yield
+                error_handling=_sentinel, limit=_sentinel, weight=_sentinel):
+        old_limit, old_weight = self._limit, self._weight
+        if limit is not _sentinel:
+            self._limit = limit
+        if weight is not _sentinel:
+            self._weight = weight
+        try:
+            with self._spec.options(task_list, decision_duration,
+                                    workflow_duration):
+                with super(SWFWorkflowProxy, self).options(retry,
+                                                           error_handling):
+                    yield
+        finally:
+            self._limit, self._weight = old_limit, old_weight
 
     def schedule(self, swf_decisions, call_key, a, kw):
         call_key = '%s-%s' % (uuid.uuid4(), call_key)
@@ -205,16 +279,6 @@ def swf_workflow(version, task_list=None, workflow_duration=None,
                  decision_duration=None, name=None):
 
     def wrapper(workflow_factory):
-
-        scanner.attach(
-            'swf_workflows',
-            workflow_factory,
-            version=version,
-            task_list=task_list,
-            workflow_duration=workflow_duration,
-            decision_duration=decision_duration,
-        )
-
         def callback(scanner, f_name, ob):
             if name is not None:
                 f_name = name
@@ -228,14 +292,56 @@ def swf_workflow(version, task_list=None, workflow_duration=None,
 
 
 class SWFTaskRegistry(TaskRegistry):
-    def register_remote(self, swf_client):
-        unregistered = []
+    def register_remote(self, swf_client, cache=None, workers=1):
+        """ Register the specs, the ones found in the `cache` are skipped and
+        up to `workers` specs are registered concurrently.
+        """
         # sort it to be deterministic, helps on tests
-        for spec in sorted(self._registry.keys()):
-            if not spec.register_remote(swf_client):
+        specs = sorted(self._registry.keys())
+        if cache is not None:
+            specs = [s for s in specs if not cache.is_registered(s)]
+
+        def register(spec):
+            return spec.register_remote(swf_client)
+
+        if workers > 1 and len(specs) > 1:
+            pool = ThreadPool(min(workers, len(specs)))
+            try:
+                registered = pool.map(register, specs)
+            finally:
+                pool.close()
+        else:
+            registered = map(register, specs)
+        unregistered = []
+        for spec, success in zip(specs, registered):
+            if not success:
                 unregistered.append(spec)
+            elif cache is not None:
+                cache.add(spec)
+        if cache is not None:
+            cache.save()
         return unregistered
 
+    def write_manifest(self, path):
+        """ Write a manifest with the specs and the import paths of the
+        tasks, a registry can be loaded from it with :func:`load_manifest`
+        without importing the tasks.
+        """
+        entries = []
+        for spec in sorted(self._registry.keys()):
+            factory = self._registry[spec]
+            if isinstance(factory, _LazyFactory):
+                import_path = factory.import_path
+            else:
+                import_path = _import_path(factory)
+            kind = 'activity'
+            if isinstance(spec, SWFWorkflowSpec):
+                kind = 'workflow'
+            entries.append({'kind': kind, 'spec': spec._config(),
+                            'factory': import_path})
+        with open(path, 'w') as f:
+            json.dump(entries, f, indent=1, sort_keys=True)
+
 
 class SWFScanner(Scanner):
     def __init__(self, registry=None):
@@ -243,5 +349,54 @@ class SWFScanner(Scanner):
             registry = SWFTaskRegistry()
         super(SWFScanner, self).__init__(registry)
 
-    def register_remote(self, swf_client):
-        return self._registry.register_remote(swf_client)
+    def register_remote(self, swf_client, cache=None, workers=1):
+        return self._registry.register_remote(swf_client, cache, workers)
+
+    def write_manifest(self, path):
+        return self._registry.write_manifest(path)
+
+
+def load_manifest(path, kind=None, registry=None):
+    """ Load a registry from a manifest written by
+    :meth:`SWFTaskRegistry.write_manifest`. The modules of the tasks are only
+    imported when the first task of their type arrives. Use `kind` to load
+    only the ``'activity'`` or the ``'workflow'`` specs.
+    """
+    if registry is None:
+        registry = SWFTaskRegistry()
+    with open(path) as f:
+        entries = json.load(f)
+    for entry in entries:
+        if kind is not None and entry['kind'] != kind:
+            continue
+        spec_class = SWFActivitySpec
+        if entry['kind'] == 'workflow':
+            spec_class = SWFWorkflowSpec
+        spec = spec_class(**entry['spec'])
+        registry.add(spec, _LazyFactory(entry['factory']))
+    return registry
+
+
+class _LazyFactory(object):
+    """ Import the task factory on its first use. """
+    def __init__(self, import_path):
+        self.import_path = import_path
+        self._factory = None
+
+    def __call__(self, *args, **kwargs):
+        if self._factory is None:
+            module_name, attrs = self.import_path.split(':', 1)
+            factory = importlib.import_module(module_name)
+            for attr in attrs.split('.'):
+                factory = getattr(factory, attr)
+            self._factory = factory
+        return self._factory(*args, **kwargs)
+
+
+def _import_path(factory):
+    name = getattr(factory, '__qualname__', factory.__name__)
+    import_path = '%s:%s' % (factory.__module__, name)
+    if '<locals>' in name:
+        raise ValueError('%r is not importable, it can not be added to the'
+                         ' manifest.' % factory)
+    return import_path
@@ -0,0 +1,84 @@
+""" Stores for the payloads too big to be sent through SWF.
+
+The blobs are content addressed: the key of a blob is the SHA1 of its data,
+storing the same payload twice is a no-op.
+
+>>> import shutil, tempfile
+>>> d = tempfile.mkdtemp()
+>>> store = CachingBlobStore(LocalBlobStore(d))
+>>> key = store.put(b'some data')
+>>> store.get(key) == b'some data'
+True
+>>> shutil.rmtree(d)
+
+"""
+import hashlib
+import os
+import re
+import tempfile
+
+from flowy.backend.cache import LRUCache
+
+# the SHA1 hex digests, a key from a payload can't point outside of the store
+_key_re = re.compile(r'^[0-9a-f]{40}\Z')
+
+
+class BlobStore(object):
+    """ The interface of a blob store. """
+    def put(self, data):
+        """ Store the bytes in `data` and return the key of the blob. """
+        raise NotImplementedError
+
+    def get(self, key):
+        """ Return the bytes stored under `key`. """
+        raise NotImplementedError
+
+
+class LocalBlobStore(BlobStore):
+    """ Keep the blobs in a local directory, useful for tests and for workers
+    sharing a filesystem.
+    """
+    def __init__(self, path):
+        self._path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def put(self, data):
+        key = hashlib.sha1(data).hexdigest()
+        path = os.path.join(self._path, key)
+        if not os.path.exists(path):
+            fd, tmp_path = tempfile.mkstemp(dir=self._path)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.rename(tmp_path, path)  # atomic, readers never see half blobs
+        return key
+
+    def get(self, key):
+        if not _key_re.match(key):
+            raise ValueError('Invalid blob key: %r' % (key,))
+        with open(os.path.join(self._path, key), 'rb') as f:
+            return f.read()
+
+
+class CachingBlobStore(BlobStore):
+    """ Keep the recently used blobs of another store in memory. """
+    def __init__(self, store, max_size=64 * 1024 * 1024, max_blobs=1000):
+        self._store = store
+        self._cache = _BlobCache(max_blobs, max_size)
+
+    def put(self, data):
+        key = self._store.put(data)
+        self._cache.put(key, data)
+        return key
+
+    def get(self, key):
+        data = self._cache.get(key)
+        if data is None:
+            data = self._store.get(key)
+            self._cache.put(key, data)
+        return data
+
+
+class _BlobCache(LRUCache):
+    def _sizeof(self, data):
+        return len(data)
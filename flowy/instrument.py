@@ -0,0 +1,272 @@
+""" Per task timings and counters.
+
+The pollers ask the instrumentation for a new :class:`Metrics` object for
+every task they receive and the task reports it back when it's done. The
+phases measured for the decisions are:
+
+* ``poll`` - waiting for the first page of the history
+* ``pagination`` - downloading the rest of the pages
+* ``parse`` - parsing the history events, this includes the pagination
+  since the pages are downloaded while the events are parsed
+* ``run`` - replaying the workflow code
+* ``extract`` - extracting the arguments of the calls and building the
+  decisions
+* ``send`` - sending the decisions
+
+the counters are ``pages``, ``events``, ``scheduled``, ``deferred``,
+``decoded`` (the results deserialized) and ``decode_hits`` (the results
+reused without deserializing them again). The activities measure ``poll``,
+``run`` and ``send``. The duration of a task is the sum of its timings
+without ``poll`` and ``pagination``.
+
+>>> i = InMemoryInstrumentation()
+>>> m = i.start('decision')
+>>> with m.time('run'):
+...     pass
+>>> m.count('scheduled', 3)
+>>> m.finish()
+>>> s = i.summary()['decision']
+>>> s['tasks'], s['counts']['scheduled'], s['timings']['run']['count']
+(1, 3, 1)
+>>> m.add_time('poll', 20)
+>>> m.duration() < 20
+True
+
+"""
+import cProfile
+import heapq
+import itertools
+import logging
+import pstats
+import random
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+timer = getattr(time, 'perf_counter', time.time)
+
+# waiting for SWF, the pagination is also part of the parse time
+_IDLE_PHASES = ('poll', 'pagination')
+
+
+class Metrics(object):
+    """ The measurements of a single task. """
+    def __init__(self, kind, instrumentation, profile=False):
+        self.kind = kind
+        self.timings = {}
+        self.counts = {}
+        self.profiler = None
+        self._instrumentation = instrumentation
+        self._profile = profile
+        self._finished = False
+
+    def begin(self):
+        """ Called by the task when it starts running, on its thread. """
+        if not self._profile or self.profiler is not None:
+            return
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            pass  # another profiler is active on this thread
+        else:
+            self.profiler = profiler
+
+    @contextmanager
+    def time(self, phase):
+        start = timer()
+        try:
+            yield
+        finally:
+            self.add_time(phase, timer() - start)
+
+    def add_time(self, phase, seconds):
+        self.timings[phase] = self.timings.get(phase, 0) + seconds
+
+    def count(self, name, n=1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def duration(self):
+        return sum(seconds for phase, seconds in self.timings.items()
+                   if phase not in _IDLE_PHASES)
+
+    def finish(self):
+        if not self._finished:
+            self._finished = True
+            self._instrumentation.finish(self)
+
+
+class _NullMetrics(object):
+    """ Used when there is no instrumentation, measures nothing. """
+    kind = None
+    profiler = None
+
+    @contextmanager
+    def time(self, phase):
+        yield
+
+    def add_time(self, phase, seconds):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+    def begin(self):
+        pass
+
+    def finish(self):
+        pass
+
+
+null_metrics = _NullMetrics()
+
+
+class Instrumentation(object):
+    """ The base instrumentation, subclasses implement :meth:`export`.
+
+    A `profile_rate` fraction of the decisions are run under cProfile, from
+    the moment the workflow starts running to the decisions being sent, and
+    the profiles of the `profile_keep` slowest of them are kept, see
+    :meth:`slowest_profiles`.
+    """
+    def __init__(self, profile_rate=0.0, profile_keep=10):
+        self._profile_rate = profile_rate
+        self._profile_keep = profile_keep
+        self._profiles = []
+        self._profile_ids = itertools.count()
+        self._profile_lock = threading.Lock()
+
+    def __getstate__(self):
+        # the worker processes started with spawn start measuring afresh
+        state = self.__dict__.copy()
+        del state['_profile_ids'], state['_profile_lock']
+        state['_profiles'] = []
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._profile_ids = itertools.count()
+        self._profile_lock = threading.Lock()
+
+    def start(self, kind):
+        profile = (kind == 'decision' and self._profile_rate
+                   and random.random() < self._profile_rate)
+        return Metrics(kind, self, bool(profile))
+
+    def finish(self, metrics):
+        if metrics.profiler is not None:
+            metrics.profiler.disable()
+            self._keep_profile(metrics)
+        try:
+            self.export(metrics)
+        except Exception:
+            logger.exception('Error while exporting the metrics:')
+
+    def export(self, metrics):
+        raise NotImplementedError
+
+    def slowest_profiles(self):
+        """ Return a list of (duration, pstats.Stats) tuples, the slowest
+        decision first.
+        """
+        with self._profile_lock:
+            profiles = sorted(self._profiles, reverse=True)
+        return [(d, pstats.Stats(p)) for d, _, p in profiles]
+
+    def _keep_profile(self, metrics):
+        entry = metrics.duration(), next(self._profile_ids), metrics.profiler
+        with self._profile_lock:
+            if len(self._profiles) < self._profile_keep:
+                heapq.heappush(self._profiles, entry)
+            else:
+                heapq.heappushpop(self._profiles, entry)
+
+
+class _NullInstrumentation(Instrumentation):
+    def start(self, kind):
+        return null_metrics
+
+    def export(self, metrics):
+        pass
+
+
+null_instrumentation = _NullInstrumentation()
+
+
+class InMemoryInstrumentation(Instrumentation):
+    """ Aggregate the metrics in memory, per task kind. """
+    def __init__(self, *args, **kwargs):
+        super(InMemoryInstrumentation, self).__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+        self._summary = {}
+
+    def __getstate__(self):
+        state = super(InMemoryInstrumentation, self).__getstate__()
+        del state['_lock']
+        state['_summary'] = {}
+        return state
+
+    def __setstate__(self, state):
+        super(InMemoryInstrumentation, self).__setstate__(state)
+        self._lock = threading.Lock()
+
+    def export(self, metrics):
+        with self._lock:
+            s = self._summary.setdefault(
+                metrics.kind, {'tasks': 0, 'timings': {}, 'counts': {}})
+            s['tasks'] += 1
+            for phase, seconds in metrics.timings.items():
+                t = s['timings'].setdefault(
+                    phase, {'count': 0, 'total': 0.0, 'max': 0.0})
+                t['count'] += 1
+                t['total'] += seconds
+                t['max'] = max(t['max'], seconds)
+            for name, n in metrics.counts.items():
+                s['counts'][name] = s['counts'].get(name, 0) + n
+
+    def summary(self):
+        with self._lock:
+            return dict(
+                (kind, {'tasks': s['tasks'],
+                        'timings': dict((p, dict(t))
+                                        for p, t in s['timings'].items()),
+                        'counts': dict(s['counts'])})
+                for kind, s in self._summary.items())
+
+
+class StatsdInstrumentation(Instrumentation):
+    """ Send the metrics of every task to a statsd server over UDP. The
+    timings are sent in milliseconds as ``<prefix>.<kind>.<phase>`` and the
+    counters as ``<prefix>.<kind>.<name>``.
+    """
+    def __init__(self, host='localhost', port=8125, prefix='flowy',
+                 *args, **kwargs):
+        super(StatsdInstrumentation, self).__init__(*args, **kwargs)
+        self._address = host, port
+        self._prefix = prefix
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def __getstate__(self):
+        state = super(StatsdInstrumentation, self).__getstate__()
+        del state['_socket']
+        return state
+
+    def __setstate__(self, state):
+        super(StatsdInstrumentation, self).__setstate__(state)
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def export(self, metrics):
+        prefix = '%s.%s' % (self._prefix, metrics.kind)
+        lines = ['%s.tasks:1|c' % prefix]
+        for phase, seconds in sorted(metrics.timings.items()):
+            lines.append('%s.%s:%.3f|ms' % (prefix, phase, seconds * 1000))
+        for name, n in sorted(metrics.counts.items()):
+            lines.append('%s.%s:%s|c' % (prefix, name, n))
+        try:
+            self._socket.sendto('\n'.join(lines).encode('utf-8'),
+                                self._address)
+        except socket.error:
+            logger.exception('Error while sending the metrics:')
@@ -1,8 +1,6 @@
-import json
 from contextlib import contextmanager
 
 from flowy.util import MagicBind
-from flowy.task import extract_results
 
 
 _sentinel = object()
@@ -16,9 +14,16 @@ class TaskProxy(object):
     from flowy.result import LinkedError
     from flowy.result import Timeout
 
-    def __init__(self, name, retry=[0, 0, 0]):
-        self._name = name
+    # the concurrency limits, see Workflow._apply_limits
+    _limit = None
+    _task_list = None
+    _weight = 1
+    # decodes the results, the default serializer if None
+    _serializer = None
+
+    def __init__(self, retry=[0, 0, 0], error_handling=False):
         self._retry = retry
+        self._error_handling = error_handling
 
     def __get__(self, obj, objtype):
         if obj is None:
@@ -26,14 +31,21 @@ class TaskProxy(object):
         return MagicBind(self, workflow=obj)
 
     @contextmanager
-    def options(self, retry=_sentinel):
-        new_retry = self._retry
+    def options(self, retry=_sentinel, error_handling=_sentinel):
+        old_retry = self._retry
+        old_error_handling = self._error_handling
         if retry is not _sentinel:
-            new_retry = retry
-        yield TaskProxy(self._name, new_retry)
+            self._retry = retry
+        if error_handling is not _sentinel:
+            self._error_handling = error_handling
+        try:
+            yield
+        finally:
+            self._retry = old_retry
+            self._error_handling = old_error_handling
 
     def __call__(self, workflow, *args, **kwargs):
-        return wolkflow._lookup(self, args, kwargs)
+        return workflow._lookup(self, args, kwargs)
 
     def __iter__(self):
         return iter(self._retry)
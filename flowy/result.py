@@ -1,12 +1,17 @@
 from flowy.exception import SuspendTask
 from flowy.exception import TaskError
 from flowy.exception import TaskTimedout
+from flowy.serialization import deserialize_result
 
 
-__all__ ['Placeholder', 'Result', 'Error', 'LinkedError', 'Timeout']
+__all__ = ['Placeholder', 'Result', 'Error', 'LinkedError', 'Timeout']
 
 
+# The results are created for every call on every replay, they use slots to
+# keep the big fan-outs small.
+
 class TaskResult(object):
+    __slots__ = ()
     _order = None
 
     def __lt__(self, other):
@@ -20,6 +25,19 @@ class TaskResult(object):
 
 
 class Placeholder(TaskResult):
+    """ The result of an unfinished call. It has no state so all the
+    placeholders of a class are the same object.
+    """
+    __slots__ = ()
+    _instances = {}
+
+    def __new__(cls):
+        try:
+            return cls._instances[cls]
+        except KeyError:
+            instance = super(Placeholder, cls).__new__(cls)
+            return cls._instances.setdefault(cls, instance)
+
     def result(self):
         raise SuspendTask
     wait = result
@@ -27,12 +45,19 @@ class Placeholder(TaskResult):
 
 
 class Result(TaskResult):
-    def __init__(self, result, d_result, order):
+    __slots__ = ('_result', '_order', '_serializer')
+
+    def __init__(self, result, order, serializer=None):
         self._result = result
         self._order = order
+        self._serializer = serializer
 
     def result(self):
-        return self._result
+        # the codec is picked from the payload tag, the serializer of the
+        # proxy brings the blob store of the offloaded payloads
+        if self._serializer is None:
+            return deserialize_result(self._result)
+        return self._serializer.deserialize_result(self._result)
 
     def wait(self):
         return self
@@ -42,6 +67,8 @@ class Result(TaskResult):
 
 
 class Error(Result):
+    __slots__ = ('_reason',)
+
     def __init__(self, reason, order):
         self._reason = reason
         self._order = order
@@ -57,12 +84,18 @@ class Error(Result):
 
 
 class LinkedError(Error):
+    __slots__ = ('_error',)
+
     def __init__(self, error):
         self._error = error
 
     def result(self):
         return self._error.result()
 
+    @property
+    def _order(self):
+        return self._error._order
+
     def __lt__(self, other):
         return self._error < other
 
@@ -71,5 +104,7 @@ class LinkedError(Error):
 
 
 class Timeout(Error):
+    __slots__ = ()
+
     def result(self):
         raise TaskTimedout(self._reason)
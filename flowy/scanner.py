@@ -17,6 +17,7 @@ def attach(identity, category, task_factory, *a, **kw):
         venusian_scanner.registry[identity(f_name, obj)] = f
     venusian.attach(task_factory, callback, category=category)
 
+
 def scan_for(package=None, ignore=None, categories=None, level=0):
     registry = {}
     scanner = venusian.Scanner(registry=registry)
@@ -26,6 +27,51 @@ def scan_for(package=None, ignore=None, categories=None, level=0):
     return registry
 
 
+class TaskRegistry(object):
+    """ Map the specs of the tasks to their factories. Calling the registry
+    with a spec, or its key, builds a task with the matching factory.
+    """
+    def __init__(self):
+        self._registry = {}
+
+    def add(self, spec, factory):
+        if spec in self._registry:
+            raise ValueError('%r is already registered.' % (spec,))
+        self._registry[spec] = factory
+
+    def __call__(self, key, *args, **kwargs):
+        try:
+            factory = self._registry[key]
+        except KeyError:
+            raise ValueError('No task is registered for %r.' % (key,))
+        return factory(*args, **kwargs)
+
+
+class Scanner(object):
+    """ Fill a registry with the tasks found by venusian. The decorators of
+    the tasks attach callbacks that add them to `scanner.registry`.
+    """
+    def __init__(self, registry=None):
+        if registry is None:
+            registry = TaskRegistry()
+        self._registry = registry
+
+    def scan(self, categories=None, package=None, ignore=None, level=0):
+        if package is None:
+            package = caller_package(level=2 + level)
+        scanner = venusian.Scanner(registry=self._registry)
+        scanner.scan(package, categories=categories, ignore=ignore)
+
+    def scan_activities(self, package=None, ignore=None, level=0):
+        self.scan(('activity',), package, ignore, level + 1)
+
+    def scan_workflows(self, package=None, ignore=None, level=0):
+        self.scan(('workflow',), package, ignore, level + 1)
+
+    def __call__(self, key, *args, **kwargs):
+        return self._registry(key, *args, **kwargs)
+
+
 # Stolen from Pyramid
 
 def caller_module(level=2, sys=sys):
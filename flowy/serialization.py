@@ -0,0 +1,232 @@
+""" Encode the task arguments and results using pluggable codecs.
+
+The payloads of the plain JSON codecs are written as they are, so they stay
+readable by every worker. The payloads of the other codecs are tagged with
+the codec name, like ``!msgpack:<base64 data>``, and are decoded with the
+codec in the tag no matter what codec the reader is configured with. This
+keeps mixed fleets compatible as long as all the workers know the codecs in
+use.
+
+>>> s = Serializer('json+zlib')
+>>> payload = s.serialize_args((1, 2), {'x': [3]})
+>>> payload.startswith('!json+zlib:')
+True
+>>> Serializer().deserialize_args(payload)
+([1, 2], {'x': [3]})
+>>> deserialize_result(Serializer().serialize_result({'a': 1}))
+{'a': 1}
+>>> deserialize_result(serialize_result(float('inf')))
+inf
+
+Big payloads can be compressed and, if they are still too big, offloaded
+to a blob store (see :mod:`flowy.blobstore`) and replaced by a reference.
+Both are tagged too, ``!zlib:<base64 data>`` and ``!blob:<key>``; the blobs
+are fetched only when the payload is decoded.
+
+>>> import shutil, tempfile
+>>> from flowy.blobstore import LocalBlobStore
+>>> d = tempfile.mkdtemp()
+>>> s = Serializer(compress_above=100, offload_above=100,
+...                blob_store=LocalBlobStore(d))
+>>> s.serialize_result('x' * 200)[:6]
+'!zlib:'
+>>> payload = s.serialize_result(list(range(1000)))
+>>> payload[:6]
+'!blob:'
+>>> s.deserialize_result(payload) == list(range(1000))
+True
+>>> shutil.rmtree(d)
+
+"""
+import base64
+import json
+import zlib
+from collections import namedtuple
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+_TAG = '!'
+_ZLIB = 'zlib'
+_BLOB = 'blob'
+_Codec = namedtuple('_Codec', 'name dumps loads tagged')
+_codecs = {}
+_default_blob_store = None
+
+
+def register_codec(name, dumps, loads, tagged=True):
+    """ Register a new codec. `dumps` must return a text payload and `loads`
+    must accept it. Untagged codecs must write JSON.
+    """
+    if ':' in name or name in (_ZLIB, _BLOB):
+        raise ValueError('Invalid codec name: %r' % name)
+    _codecs[name] = _Codec(name, dumps, loads, tagged)
+
+
+def get_codec(name):
+    try:
+        return _codecs[name]
+    except KeyError:
+        raise ValueError('Unknown or unavailable codec: %r' % name)
+
+
+def dumps(value, codec='json'):
+    codec = get_codec(codec)
+    payload = codec.dumps(value)
+    if codec.tagged:
+        payload = '%s%s:%s' % (_TAG, codec.name, payload)
+    return payload
+
+
+def loads(payload, blob_store=None):
+    while payload.startswith(_TAG):
+        name, data = payload[len(_TAG):].split(':', 1)
+        if name == _BLOB:
+            payload = _get_blob_store(blob_store).get(data).decode('utf-8')
+        elif name == _ZLIB:
+            payload = zlib.decompress(_b64decode(data)).decode('utf-8')
+        else:
+            return get_codec(name).loads(data)
+    return _json_loads(payload)
+
+
+def set_default_blob_store(blob_store):
+    """ Set the blob store used to fetch the offloaded payloads when the
+    serializer doesn't have one.
+    """
+    global _default_blob_store
+    _default_blob_store = blob_store
+
+
+def _get_blob_store(blob_store):
+    if blob_store is None:
+        blob_store = _default_blob_store
+    if blob_store is None:
+        raise ValueError('No blob store configured for offloaded payloads.')
+    return blob_store
+
+
+class Serializer(object):
+    """ Serialize the arguments and results with the named codec.
+
+    Payloads longer than `compress_above` characters are compressed and the
+    ones still longer than `offload_above` are written to the blob store.
+    """
+    def __init__(self, codec='json', compress_above=None, offload_above=None,
+                 blob_store=None):
+        get_codec(codec)  # fail early
+        self._codec = codec
+        self._compress_above = compress_above
+        self._offload_above = offload_above
+        self._blob_store = blob_store
+
+    def serialize_args(self, args, kwargs):
+        return self._dumps([list(args), kwargs])
+
+    def deserialize_args(self, payload):
+        args, kwargs = loads(payload, self._blob_store)
+        return args, kwargs
+
+    def serialize_result(self, result):
+        return self._dumps(result)
+
+    def deserialize_result(self, payload):
+        return loads(payload, self._blob_store)
+
+    def _dumps(self, value):
+        payload = dumps(value, self._codec)
+        if (self._compress_above is not None
+                and len(payload) > self._compress_above):
+            data = zlib.compress(payload.encode('utf-8'))
+            payload = '%s%s:%s' % (_TAG, _ZLIB, _b64encode(data))
+        if (self._offload_above is not None
+                and len(payload) > self._offload_above):
+            blob_store = _get_blob_store(self._blob_store)
+            key = blob_store.put(payload.encode('utf-8'))
+            payload = '%s%s:%s' % (_TAG, _BLOB, key)
+        return payload
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self._codec)
+
+
+def _json_dumps(value):
+    return json.dumps(value)
+
+
+# the plain json codec keeps the stdlib decoder, orjson rejects the NaN and
+# Infinity the stdlib encoder writes
+_json_loads = json.loads
+
+
+if orjson is not None:
+    def _fast_json_dumps(value):
+        return orjson.dumps(value).decode('utf-8')
+    _fast_json_loads = orjson.loads
+elif ujson is not None:
+    _fast_json_dumps = ujson.dumps
+    _fast_json_loads = ujson.loads
+else:
+    _fast_json_dumps = _json_dumps
+    _fast_json_loads = _json_loads
+
+
+def _b64encode(data):
+    return base64.b64encode(data).decode('ascii')
+
+
+def _b64decode(payload):
+    return base64.b64decode(payload.encode('ascii'))
+
+
+def _json_zlib_dumps(value):
+    return _b64encode(zlib.compress(_fast_json_dumps(value).encode('utf-8')))
+
+
+def _json_zlib_loads(payload):
+    return _json_loads(zlib.decompress(_b64decode(payload)).decode('utf-8'))
+
+
+register_codec('json', _json_dumps, _json_loads, tagged=False)
+register_codec('fastjson', _fast_json_dumps, _fast_json_loads, tagged=False)
+register_codec('json+zlib', _json_zlib_dumps, _json_zlib_loads)
+
+if msgpack is not None:
+    def _msgpack_dumps(value):
+        return _b64encode(msgpack.packb(value, use_bin_type=True))
+
+    def _msgpack_loads(payload):
+        return msgpack.unpackb(_b64decode(payload), raw=False)
+
+    def _msgpack_zlib_dumps(value):
+        data = msgpack.packb(value, use_bin_type=True)
+        return _b64encode(zlib.compress(data))
+
+    def _msgpack_zlib_loads(payload):
+        data = zlib.decompress(_b64decode(payload))
+        return msgpack.unpackb(data, raw=False)
+
+    register_codec('msgpack', _msgpack_dumps, _msgpack_loads)
+    register_codec('msgpack+zlib', _msgpack_zlib_dumps, _msgpack_zlib_loads)
+
+
+# SWF rejects inputs and results over 32768 characters, compressing those
+# can't break the workers that don't know about compression
+default_serializer = Serializer(compress_above=32768)
+serialize_args = default_serializer.serialize_args
+deserialize_args = default_serializer.deserialize_args
+serialize_result = default_serializer.serialize_result
+deserialize_result = default_serializer.deserialize_result
@@ -1,17 +1,37 @@
+import heapq
 import json
 import logging
 
 from flowy.exception import SuspendTask
+from flowy.instrument import null_metrics
 from flowy.result import TaskResult
+from flowy.serialization import default_serializer
 
 
 logger = logging.getLogger(__package__)
 
 
 class Task(object):
-    def __call__(self, *args, **kwargs):
+
+    serializer = default_serializer
+    # set by the poller when the worker is instrumented
+    _metrics = null_metrics
+
+    def __init__(self, input):
+        self._input = input
+
+    def __call__(self):
+        self._metrics.begin()
         try:
-            result = self.run(*args, **kwargs)
+            self._call()
+        finally:
+            self._metrics.finish()
+
+    def _call(self):
+        try:
+            args, kwargs = self._decode_input()
+            with self._metrics.time('run'):
+                result = self.run(*args, **kwargs)
         except SuspendTask:
             self._flush()
         except Exception as e:
@@ -20,6 +40,10 @@ class Task(object):
         else:
             self._finish(result)
 
+    def _decode_input(self):
+        # the codec is picked from the payload tag
+        return self.serializer.deserialize_args(self._input)
+
     def run(self, *args, **kwargs):
         raise NotImplementedError
 
@@ -38,23 +62,57 @@ class restart(object):
         self.a, self.kw = args, kwargs
 
 
+# the states of the calls in Workflow._calls
+_RUNNING, _TIMEDOUT, _RESULT, _ERROR = 'running', 'timedout', 'result', 'error'
+
+
 class Workflow(Task):
 
+    # the maximum number of calls running at the same time, the proxies can
+    # have their own limits and the task lists can be limited by the total
+    # weight of their calls, see _apply_limits
     rate_limit = 64
-
-    def __init__(self, backend, running, timedout, results, errs, ordr):
+    task_list_limits = {}
+    # the maximum number of calls scheduled in a single decision, the rest
+    # spill over into the next decisions
+    decision_limit = 100
+
+    def __init__(self, input, running, timedout, results, errs, ordr,
+                 backend=None):
+        super(Workflow, self).__init__(input)
+        # the workflow is its own backend unless told otherwise
+        if backend is None:
+            backend = self
         self._backend = backend
-        self._running = set(running)
-        self._timedout = set(timedout)
-        self._results = dict(results)
-        self._errors = dict(errs)
-        self._order = list(ordr)
+        # not copied, the poller can pass a mapping that reads the results
+        # from disk only when they are looked up
+        self._results = results
+        self._errors = errs
+        # call_key -> state of the call, so replaying a call takes a single
+        # lookup; the later states win, like the checks order in _lookup
+        self._calls = dict.fromkeys(errs, _ERROR)
+        self._calls.update(dict.fromkeys(results, _RESULT))
+        self._calls.update(dict.fromkeys(running, _RUNNING))
+        self._calls.update(dict.fromkeys(timedout, _TIMEDOUT))
+        self._running = len(running)
+        # call_key -> position in the completion order, so looking up the
+        # order of a finished call during replay doesn't scan the history
+        self._order = dict((k, i) for i, k in enumerate(ordr))
+        # call_key -> deserialized result, replaced by the poller with a
+        # cache that outlives the decision when the history cache allows it
+        self._decoded = {}
         self._call_id = 0
+        self._pending = []
         self._scheduled = []
-        self._flush = 1
+        self._proxy_running = {}
+        self._task_list_running = {}
+        self._deferred = 0
+        # the key of the first call left out by the decision limit
+        self._spill = None
+        self._flushable = True
 
     def abort(self, reason):
-        self._flush = 0
+        self._flushable = False
         self._fail(reason)
         raise SuspendTask
 
@@ -62,49 +120,83 @@ class Workflow(Task):
         self._backend.fail(str(reason))
 
     def _flush(self):
-        if not self._flush:
+        if not self._flushable:
             return
-        for proxy, call_key, a, kw, delay in self._scheduled:
-            try:
-                aa, kwkw = _extract_results(a, kw)
-            except SuspendTask:
-                # One of the .result() call failed, the workflow already failed
-                return
-            else:
-                self._backend.schedule(proxy, call_key, aa, kwkw, delay)
-        self._backend.flush()
-
-    def _finish(self, r):
-        if isinstance(r, restart):
-            errs, placeholders = _short_circuit_on_args(r.a, r.kw)
-            if errs:
-                self._fail(first(errs))
-            elif not placeholders:
+        self._apply_limits()
+        spillover = self._spillover_timer()
+        with self._metrics.time('extract'):
+            for proxy, call_key, a, kw, delay in self._scheduled:
                 try:
                     aa, kwkw = _extract_results(a, kw)
                 except SuspendTask:
-                    # One of the .result() call failed the workflow already
+                    # One of the .result() call failed, the workflow already
+                    # failed
                     return
-                self._backend.restart(aa, kwkw)
+                else:
+                    self._backend.schedule(proxy, call_key, aa, kwkw, delay)
+            if spillover is not None:
+                self._backend.wake_up(spillover)
+        with self._metrics.time('send'):
+            self._backend.flush()
+
+    def _spillover_timer(self):
+        """ The id of a timer that fires right away if some calls didn't fit
+        in this decision, so they are scheduled by the next decision instead
+        of waiting for the running calls to finish. The timer is named after
+        the first call left out, so every decision starts a different one.
+        """
+        timer_id = None
+        if self._spill is not None:
+            timer_id = '%s:spillover' % self._spill
+        if self._deferred:
+            logger.info('%s calls deferred to the next decisions.',
+                        self._deferred)
+        self._metrics.count('scheduled', len(self._scheduled))
+        self._metrics.count('deferred', self._deferred)
+        return timer_id
+
+    def _finish(self, r):
+        if isinstance(r, restart):
+            values = r.a, r.kw
+        else:
+            values = r
+        errs, placeholders = _short_circuit_on_results(values)
+        if errs:
+            self._fail(first(errs))
+        elif placeholders:
+            # the result depends on unfinished calls
+            self._flush()
         else:
-            self._backend.complete(r)
+            try:
+                value = _extract_value(values)
+            except SuspendTask:
+                # One of the .result() call failed the workflow already
+                return
+            if isinstance(r, restart):
+                self._backend.restart(*value)
+            else:
+                self._backend.complete(value)
 
     def _lookup(self, proxy, a, kw):
         r = proxy.Placeholder()
         for call_number, delay in enumerate(proxy):
             call_key = "%s-%s" % (self._call_id, call_number)
-            if call_key in self._timedout:
+            state = self._calls.get(call_key)
+            if state is _TIMEDOUT:
                 continue
-            elif call_key in self._running:
+            elif state is _RUNNING:
+                self._count_running(proxy)
                 break
-            elif call_key in self._results:
+            elif state is _RESULT:
                 result = self._results[call_key]
-                order = self._order.index(call_key)
-                r = ResultWrapper(proxy.Result(result, order), self)
+                order = self._order[call_key]
+                r = ResultWrapper(
+                    proxy.Result(result, order, proxy._serializer), self,
+                    call_key)
                 break
-            elif call_key in self._errors:
+            elif state is _ERROR:
                 raw_error = self._errors[call_key]
-                order = self._order.index(call_key)
+                order = self._order[call_key]
                 r = proxy.Error(raw_error, order)
                 break
             else:
@@ -115,15 +207,57 @@ class Workflow(Task):
                     self._schedule(proxy, call_key, a, kw, delay)
                 break
         else:
-            order = self._order.index(call_key)
-            r = proxy.Timeout(order)
+            order = self._order[call_key]
+            r = proxy.Timeout('A task has timedout.', order)
         self._call_id += 1
         return r
 
     def _schedule(self, proxy, call_key, a, kw, delay):
-        t = len(self._scheduled) + len(self._running)
-        if t < self.rate_limit or max(self.rate_limit, 0) == 0:
-            self._scheduled.append(proxy, call_key, a, kw, delay)
+        # the proxy options may change before the flush, keep the limits
+        limits = proxy, proxy._limit, proxy._task_list, proxy._weight
+        self._pending.append((limits, (proxy, call_key, a, kw, delay)))
+
+    def _count_running(self, proxy):
+        p_running, tl_running = self._proxy_running, self._task_list_running
+        p_running[proxy] = p_running.get(proxy, 0) + 1
+        task_list = proxy._task_list
+        tl_running[task_list] = tl_running.get(task_list, 0) + proxy._weight
+
+    def _apply_limits(self):
+        """ Pick the pending calls that fit in the limits, in the order they
+        were made so every replay picks the same ones. The running calls of
+        the workflow, of each proxy and the weight of the calls running on
+        each task list are limited; the calls over the limits are scheduled
+        by a later decision, after some running calls finish.
+        """
+        running = self._running
+        p_running = dict(self._proxy_running)
+        tl_running = dict(self._task_list_running)
+        tl_limits = self.task_list_limits
+        for (proxy, limit, task_list, weight), call in self._pending:
+            p_count = p_running.get(proxy, 0)
+            tl_weight = tl_running.get(task_list, 0) + weight
+            tl_limit = tl_limits.get(task_list)
+            if ((self.rate_limit > 0 and running >= self.rate_limit)
+                    or (limit is not None and p_count >= limit)
+                    or (tl_limit is not None and tl_weight > tl_limit)):
+                self._deferred += 1
+            elif (self.decision_limit > 0
+                  and len(self._scheduled) >= self.decision_limit):
+                self._deferred += 1
+                if self._spill is None:
+                    self._spill = call[1]
+            else:
+                self._scheduled.append(call)
+                running += 1
+                p_running[proxy] = p_count + 1
+                tl_running[task_list] = tl_weight
+        self._pending = []
+        # the spillover timer counts in the decision limit, but a decision
+        # always schedules at least one call so the workflow makes progress
+        if self._spill is not None and len(self._scheduled) > 1:
+            self._spill = self._scheduled.pop()[1]
+            self._deferred += 1
 
 
 def _short_circuit_on_args(a, kw):
@@ -139,6 +273,43 @@ def _short_circuit_on_args(a, kw):
     return errs, placeholders
 
 
+def _short_circuit_on_results(value):
+    """ Like _short_circuit_on_args for the results nested in the lists,
+    tuples and dicts returned by a workflow.
+    """
+    errs, placeholders = [], False
+    for r in _nested_results(value):
+        try:
+            if r.is_error():
+                errs.append(r)
+        except SuspendTask:
+            placeholders = True
+    return errs, placeholders
+
+
+def _nested_results(value):
+    if isinstance(value, TaskResult):
+        yield value
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            for r in _nested_results(v):
+                yield r
+    elif isinstance(value, dict):
+        for v in value.values():
+            for r in _nested_results(v):
+                yield r
+
+
+def _extract_value(value):
+    if isinstance(value, TaskResult):
+        return value.result()
+    if isinstance(value, (list, tuple)):
+        return type(value)(_extract_value(v) for v in value)
+    if isinstance(value, dict):
+        return dict((k, _extract_value(v)) for k, v in value.items())
+    return value
+
+
 def _i_or_args(result, results):
     if len(results) == 0:
         return iter(result)
@@ -146,8 +317,8 @@ def _i_or_args(result, results):
 
 
 def _extract_results(a, kw):
-    aa = (_result_or_value(r) for r in a)
-    kwkw = dict((k, _result_or_value(v)) for k, v in kw.iteritems())
+    aa = tuple(_result_or_value(r) for r in a)
+    kwkw = dict((k, _result_or_value(v)) for k, v in kw.items())
     return aa, kwkw
 
 
@@ -164,42 +335,101 @@ def wait_for(result, *results):
 
 
 def first(result, *results):
-    return min(_i_or_args(result, results)).wait()
+    return min(_i_or_args(result, results), key=_order_key).wait()
 
 
 def first_n(n, result, *results):
     i = _i_or_args(result, results)
-    if n == 1:
-        yield first(i)
-        return
-    s = sorted(i)
-    for r in s[:n]:
+    for r in heapq.nsmallest(n, i, key=_order_key):
         yield r.wait()
 
 
 def all(result, *results):
-    i = list(_i_or_args(result, results))
-    for r in first_n(len(i), i):
-        yield r
+    # only the results consumed before the first unfinished one are ordered
+    heap = [(_order_key(r), x, r)
+            for x, r in enumerate(_i_or_args(result, results))]
+    heapq.heapify(heap)
+    while heap:
+        yield heapq.heappop(heap)[-1].wait()
+
+
+def as_completed(result, *results):
+    """ Yield the finished results in the order they finished, then suspend
+    if any of the results is not finished yet. Only the finished results are
+    kept while the results are consumed.
+    """
+    heap, unfinished = [], None
+    for x, r in enumerate(_i_or_args(result, results)):
+        key = _order_key(r)
+        if key is _unfinished:
+            if unfinished is None:
+                unfinished = r
+        else:
+            heap.append((key, x, r))
+    heapq.heapify(heap)
+    while heap:
+        yield heapq.heappop(heap)[-1]
+    if unfinished is not None:
+        unfinished.wait()  # suspends
+
+
+_unfinished = float('inf')
+
+
+def _order_key(r):
+    """ The position of a result in the completion order of the calls, the
+    unfinished results sort last.
+    """
+    order = r._order
+    if order is None:
+        return _unfinished
+    return order
 
 
-class ResultWrapper(object):
-    def __init__(self, result, workflow):
+class ResultWrapper(TaskResult):
+    """ A finished result, deserialized only when it's used and only once
+    per decision, or once per run if the workflow shares a cache of the
+    decoded results between decisions.
+
+    Every use of the result returns the same object, the workflows must not
+    modify the values they receive.
+    """
+    __slots__ = ('_r', '_workflow', '_call_key')
+
+    def __init__(self, result, workflow, call_key=None):
         self._r = result
         self._workflow = workflow
+        self._call_key = call_key
 
     def result(self):
+        workflow = self._workflow
         try:
-            return self._r.result()
+            value = workflow._decoded[self._call_key]
+        except KeyError:
+            pass
+        else:
+            workflow._metrics.count('decode_hits')
+            return value
+        try:
+            value = self._r.result()
         except Exception as e:
             logger.exception("Error when loading result:")
-            self._workflow.abort(e)  # This will suspend the execution
+            workflow.abort(e)  # This will suspend the execution
+        workflow._metrics.count('decoded')
+        if self._call_key is not None:
+            workflow._decoded[self._call_key] = value
+        return value
 
     def __lt__(self, other):
         return self._r < other
 
+    @property
+    def _order(self):
+        return self._r._order
+
     def wait(self):
-        return self._r.wait()
+        self._r.wait()
+        return self
 
     def is_error(self):
         return self._r.is_error()
@@ -0,0 +1,62 @@
+""" Synthetic decision histories for the benchmarks.
+
+The histories look like the ones of a fan-out workflow: every decision
+schedules a batch of `width` activities that complete, fail or time out
+before the next decision. The timed out activities are retried in the next
+batch using the next call number, like the workflows do.
+"""
+import json
+import random
+
+
+def synthetic_history(events=1000, width=100, failures=0.0, timeouts=0.0,
+                      result_size=10, seed=0):
+    rnd = random.Random(seed)
+    history = []
+
+    def event(e_type, **attrs):
+        e = {'eventId': len(history) + 1, 'eventType': e_type}
+        if attrs:
+            key = e_type[0].lower() + e_type[1:] + 'EventAttributes'
+            e[key] = attrs
+        history.append(e)
+        return e['eventId']
+
+    event('WorkflowExecutionStarted',
+          input=json.dumps([[], {'width': width}]),
+          workflowType={'name': 'Synthetic', 'version': '1'},
+          taskList={'name': 'bench'},
+          taskStartToCloseTimeout='60',
+          executionStartToCloseTimeout='3600')
+    result = json.dumps('x' * result_size)
+    call_id, retries = 0, []
+    while len(history) < events:
+        event('DecisionTaskScheduled')
+        started = event('DecisionTaskStarted')
+        completed = event('DecisionTaskCompleted', startedEventId=started)
+        calls, retries = retries, []
+        while len(calls) < width:
+            calls.append((call_id, 0))
+            call_id += 1
+        scheduled = []
+        for c_id, attempt in calls:
+            s_id = event('ActivityTaskScheduled',
+                         activityId='%s-%s' % (c_id, attempt),
+                         activityType={'name': 'Identity', 'version': '1'},
+                         decisionTaskCompletedEventId=completed)
+            scheduled.append((s_id, c_id, attempt))
+        for s_id, c_id, attempt in scheduled:
+            p = rnd.random()
+            if p < timeouts:
+                event('ActivityTaskTimedOut', scheduledEventId=s_id,
+                      timeoutType='START_TO_CLOSE')
+                retries.append((c_id, attempt + 1))
+                continue
+            event('ActivityTaskStarted', scheduledEventId=s_id)
+            if p < timeouts + failures:
+                event('ActivityTaskFailed', scheduledEventId=s_id,
+                      reason='synthetic failure')
+            else:
+                event('ActivityTaskCompleted', scheduledEventId=s_id,
+                      result=result)
+    return history[:events]
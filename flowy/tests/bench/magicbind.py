@@ -0,0 +1,47 @@
+""" Compare the overhead of calling through MagicBind with direct calls.
+
+    python -m flowy.tests.bench.magicbind
+"""
+from __future__ import print_function
+
+import argparse
+import timeit
+
+from flowy.util import MagicBind
+
+
+class Client(object):
+    """ Looks like the boto Layer1 methods flowy binds domain/identity to. """
+    def poll_for_activity_task(self, domain, task_list, identity=None):
+        return domain, task_list, identity
+
+    def respond_activity_task_completed(self, task_token, result=None):
+        return task_token, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--number', type=int, default=100000)
+    args = parser.parse_args()
+
+    client = Client()
+    bound = MagicBind(client, domain='domain', identity='identity')
+    cases = [
+        ('direct', lambda: client.poll_for_activity_task(
+            domain='domain', task_list='list', identity='identity')),
+        ('bound, keywords', lambda: bound.poll_for_activity_task(
+            task_list='list')),
+        ('bound, positional', lambda: bound.poll_for_activity_task('list')),
+        ('bound, nothing injected', lambda: (
+            bound.respond_activity_task_completed(task_token='t'))),
+        ('new binding per call', lambda: MagicBind(
+            client, domain='domain', identity='identity'
+        ).poll_for_activity_task(task_list='list')),
+    ]
+    for name, f in cases:
+        best = min(timeit.repeat(f, number=args.number, repeat=3))
+        print('%-25s %7.2fus/call' % (name, best * 1e6 / args.number))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+""" Micro-benchmark for the parsing of the decision history events.
+
+    python -m flowy.tests.bench.parse_events
+"""
+from __future__ import print_function
+
+import argparse
+import timeit
+
+from flowy.backend.poller import SWFWorkflowPoller
+from flowy.tests.bench.history import synthetic_history
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('sizes', nargs='*', type=int,
+                        default=[1000, 10000, 25000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--width', type=int, default=100)
+    args = parser.parse_args()
+
+    poller = SWFWorkflowPoller(None, None, None)
+    for size in args.sizes:
+        events = synthetic_history(size, width=args.width, failures=0.05,
+                                   timeouts=0.05)
+        best = min(timeit.repeat(lambda: poller._parse_events(iter(events)),
+                                 number=1, repeat=args.repeat))
+        print('%6d events: %9.2fms %7.2fus/event' % (
+            size, best * 1000, best * 1e6 / size))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,309 @@
+""" Replay decision histories through the workflow poller, without network.
+
+    python -m flowy.tests.bench.replay --sizes 100 1000 10000 50000
+    python -m flowy.tests.bench.replay --logs '*mapreduce*' --repeat 10
+    python -m flowy.tests.bench.replay --save before.json
+    python -m flowy.tests.bench.replay --compare before.json
+
+The synthetic histories are fan-outs with failures and timed out, retried,
+activities; a decision is replayed at every decision point of the history,
+or at `--decisions` points evenly spread over it. The recorded histories are
+the integration test logs, replaying them needs the integration modules to
+import the tasks from the `flowy` package again. For every scenario the
+decisions/sec, the p50 and p99 decision latency (excluding the poll) and the
+peak memory of a separate, traced, run are reported.
+"""
+from __future__ import print_function
+
+import argparse
+import glob
+import importlib
+import itertools
+import json
+import os
+import platform
+import subprocess
+import time
+import uuid
+
+from boto.swf.layer1 import Layer1
+
+from flowy.backend.cache import HistoryCache
+from flowy.backend.poller import SWFWorkflowPoller
+from flowy.backend.swf import SWFScanner
+from flowy.instrument import Instrumentation
+from flowy.tests.bench.history import synthetic_history
+from flowy.tests.bench.workflows import Synthetic
+from flowy.tests.recorder import Layer1Playback
+from flowy.util import MagicBind
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+    import resource
+
+
+timer = getattr(time, 'perf_counter', time.time)
+logs_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                        'integration', 'logs')
+columns = [
+    ('decisions/s', 'decisions_per_sec'),
+    ('p50 ms', 'p50_ms'),
+    ('p99 ms', 'p99_ms'),
+    ('peak MB', 'peak_mb'),
+]
+
+
+class Layer1Synthetic(Layer1):
+    """ Serve a decision task for every decision point of a history, each
+    one with the events up to that point, and accept any decisions.
+    """
+    page_size = 1000  # the SWF maximum
+
+    def __init__(self, history, decisions=None):
+        self.history = history
+        self.points = [i + 1 for i, e in enumerate(history)
+                       if e['eventType'] == 'DecisionTaskStarted']
+        if decisions is not None and decisions < len(self.points):
+            step = len(self.points) / float(decisions)
+            self.points = [self.points[int(i * step)]
+                           for i in range(decisions)]
+        self.points_i = iter(self.points)
+        self.events = []
+        self.token = None
+
+    def __len__(self):
+        return len(self.points)
+
+    def json_request(self, action, data, object_hook=None):
+        self._normalize_request_dict(data)
+        if action == 'PollForDecisionTask':
+            return self._page(data.get('nextPageToken'),
+                              data.get('reverseOrder'))
+        if action == 'RespondDecisionTaskCompleted':
+            return {}
+        raise ValueError('Unexpected action: %s' % action)
+
+    def _page(self, page_token, reverse_order):
+        offset = 0
+        if page_token is None:
+            end = next(self.points_i)
+            self.events = self.history[:end]
+            if reverse_order:
+                self.events.reverse()
+            self.token = 'token-%s' % end
+        else:
+            offset = int(page_token)
+        page = {
+            'taskToken': self.token,
+            'workflowExecution': {'workflowId': 'bench', 'runId': 'run'},
+            'workflowType': {'name': 'Synthetic', 'version': '1'},
+            'events': self.events[offset:offset + self.page_size],
+        }
+        if offset + self.page_size < len(self.events):
+            page['nextPageToken'] = str(offset + self.page_size)
+        return page
+
+
+class LatencyInstrumentation(Instrumentation):
+    """ Keep the latency of every decision. """
+    def __init__(self, *args, **kwargs):
+        super(LatencyInstrumentation, self).__init__(*args, **kwargs)
+        self.latencies = []
+
+    def export(self, metrics):
+        self.latencies.append(metrics.duration())
+
+
+def synthetic_scenarios(sizes, width, failures, timeouts, result_size,
+                        decisions):
+    for size in sizes:
+        history = synthetic_history(size, width=width, failures=failures,
+                                    timeouts=timeouts,
+                                    result_size=result_size)
+
+        def layer1(history=history):
+            return Layer1Synthetic(history, decisions)
+
+        yield ('synthetic-%s' % size, size, layer1,
+               workflow_factory(Synthetic), 'bench')
+
+
+def recorded_scenarios(pattern):
+    paths = glob.glob(os.path.join(logs_dir, pattern + '.workflow.log'))
+    for path in sorted(paths):
+        module_name, i = os.path.basename(path).rsplit('.', 3)[:2]
+        module = importlib.import_module(module_name)
+        events = 0
+        for response in Layer1Playback(open(path)).responses:
+            if isinstance(response, dict):
+                events += len(response.get('events', []))
+
+        def layer1(path=path):
+            return Layer1Playback(open(path))
+
+        name = '%s-%s' % (module_name.rsplit('.', 1)[-1], i)
+        task_list = module.runs[int(i)]['task_list']
+        scanner = SWFScanner()
+        scanner.scan_workflows(package=module)
+        yield name, events, layer1, scanner, task_list
+
+
+def workflow_factory(workflow):
+    """ A task factory building every decision task with `workflow`. """
+    def factory(spec, *args, **kwargs):
+        return workflow(*args, **kwargs)
+    return factory
+
+
+def replay(layer1_factory, task_factory, task_list, history_cache=False,
+           spill_threshold=None):
+    """ Replay all the decision tasks served by a new layer1 and return the
+    wall time and the latencies of the decisions.
+    """
+    layer1 = layer1_factory()
+    swf_client = MagicBind(layer1, domain='IntegrationTest',
+                           identity='WTestID')
+    instrumentation = LatencyInstrumentation()
+    cache = HistoryCache() if history_cache else None
+    poller = SWFWorkflowPoller(swf_client, task_list, task_factory,
+                               history_cache=cache,
+                               instrumentation=instrumentation,
+                               spill_threshold=spill_threshold)
+    old_uuid4, c = uuid.uuid4, itertools.count(1000)
+    uuid.uuid4 = lambda: next(c)  # same child workflow ids as the recording
+    start = timer()
+    try:
+        for _ in range(len(layer1)):
+            poller.poll_next_task()()
+    finally:
+        uuid.uuid4 = old_uuid4
+    return timer() - start, instrumentation.latencies
+
+
+def peak_memory(f, *args, **kwargs):
+    """ The peak memory allocated while running f, in bytes. Without
+    tracemalloc it's the peak RSS of the whole process.
+    """
+    if tracemalloc is None:
+        f(*args, **kwargs)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    tracemalloc.start()
+    try:
+        f(*args, **kwargs)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def run_scenario(layer1_factory, task_factory, task_list, repeat,
+                 history_cache, spill_threshold=None):
+    best_wall, latencies = None, []
+    for _ in range(repeat):
+        wall, lat = replay(layer1_factory, task_factory, task_list,
+                           history_cache, spill_threshold)
+        latencies.extend(lat)
+        if best_wall is None or wall < best_wall:
+            best_wall = wall
+    decisions = len(latencies) // repeat
+    peak = peak_memory(replay, layer1_factory, task_factory, task_list,
+                       history_cache, spill_threshold)
+    return {
+        'decisions': decisions,
+        'decisions_per_sec': decisions / best_wall,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'peak_mb': peak / 1024.0 / 1024.0,
+    }
+
+
+def commit():
+    try:
+        out = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                      cwd=os.path.dirname(__file__))
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.decode('ascii').strip()
+
+
+def print_results(results, baseline=None):
+    print('%-24s %7s %9s' % ('scenario', 'events', 'decisions'), end='')
+    for title, _ in columns:
+        print(' %12s' % title, end='')
+    print()
+    for name, r in results:
+        print('%-24s %7d %9d' % (name, r['events'], r['decisions']), end='')
+        b = (baseline or {}).get(name)
+        for _, key in columns:
+            cell = '%.2f' % r[key]
+            if b and b.get(key):
+                change = (r[key] - b[key]) / b[key] * 100
+                cell += ' %+.0f%%' % change
+            print(' %12s' % cell, end='')
+        print()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', nargs='*', type=int,
+                        default=[100, 1000, 10000, 50000])
+    parser.add_argument('--width', type=int, default=100)
+    parser.add_argument('--failures', type=float, default=0.05)
+    parser.add_argument('--timeouts', type=float, default=0.05)
+    parser.add_argument('--result-size', type=int, default=10)
+    parser.add_argument('--decisions', type=int, default=50,
+                        help='replay at most this many decisions per history')
+    parser.add_argument('--logs', metavar='PATTERN',
+                        help='replay the recorded logs matching the pattern')
+    parser.add_argument('--history-cache', action='store_true',
+                        help='only for the synthetic histories, the recorded '
+                             'logs expect the history in order')
+    parser.add_argument('--spill-threshold', type=int, metavar='BYTES',
+                        help='keep the results bigger than this on disk')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--save', metavar='FILE')
+    parser.add_argument('--compare', metavar='FILE')
+    args = parser.parse_args()
+    if args.logs and args.history_cache:
+        parser.error('--history-cache cannot replay the recorded logs')
+
+    os.environ['TESTING'] = '1'
+    if args.logs:
+        scenarios = recorded_scenarios(args.logs)
+    else:
+        scenarios = synthetic_scenarios(args.sizes, args.width, args.failures,
+                                        args.timeouts, args.result_size,
+                                        args.decisions)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print('Compared with %s (commit %s).' % (args.compare,
+                                                 baseline['commit']))
+        baseline = baseline['results']
+    results = []
+    for name, events, layer1_factory, task_factory, task_list in scenarios:
+        r = run_scenario(layer1_factory, task_factory, task_list,
+                         args.repeat, args.history_cache,
+                         args.spill_threshold)
+        r['events'] = events
+        results.append((name, r))
+    print_results(results, baseline)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'commit': commit(),
+                       'python': platform.python_version(),
+                       'args': vars(args),
+                       'results': dict(results)}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+""" Measure the memory used by the result objects of a call.
+
+    python -m flowy.tests.bench.results
+
+Every call looked up during a replay creates a result object, and the
+finished ones are also wrapped. The footprint per call is compared with the
+same classes having a __dict__.
+"""
+from __future__ import print_function
+
+import argparse
+import gc
+import tracemalloc
+
+from flowy.result import Error
+from flowy.result import Placeholder
+from flowy.result import Result
+from flowy.result import Timeout
+from flowy.task import ResultWrapper
+
+
+class DictResult(Result):
+    pass
+
+
+class DictError(Error):
+    pass
+
+
+class DictTimeout(Timeout):
+    pass
+
+
+class DictPlaceholder(Placeholder):
+    def __new__(cls):
+        return object.__new__(cls)
+
+
+class DictResultWrapper(ResultWrapper):
+    pass
+
+
+def kinds(result, error, timeout, placeholder, wrapper):
+    return [
+        ('placeholder', lambda i: placeholder()),
+        ('result', lambda i: wrapper(result('"%s"' % i, i), None)),
+        ('error', lambda i: error('reason', i)),
+        ('timeout', lambda i: timeout('reason', i)),
+    ]
+
+
+def footprint(factory, calls):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        objects = [factory(i) for i in range(calls)]
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del objects
+    return (after - before) / float(calls)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--calls', type=int, default=50000)
+    args = parser.parse_args()
+
+    slotted = kinds(Result, Error, Timeout, Placeholder, ResultWrapper)
+    dicts = kinds(DictResult, DictError, DictTimeout, DictPlaceholder,
+                  DictResultWrapper)
+    print('%d calls, bytes per call (including the result payload):'
+          % args.calls)
+    print('%-12s %10s %10s' % ('', '__slots__', '__dict__'))
+    for (name, f), (_, dict_f) in zip(slotted, dicts):
+        print('%-12s %10.1f %10.1f' % (name, footprint(f, args.calls),
+                                       footprint(dict_f, args.calls)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,21 @@
+from flowy.backend.swf import swf_workflow as workflow
+from flowy.backend.swf import SWFActivityProxy as ActivityProxy
+from flowy.backend.swf import SWFWorkflow as Workflow
+
+
+@workflow(1, task_list='bench', workflow_duration=3600, decision_duration=60)
+class Synthetic(Workflow):
+    """ The fan-out workflow of the synthetic histories, it schedules the
+    calls in batches of `width` and waits for every batch to finish.
+    """
+
+    identity = ActivityProxy('Identity', 1, task_list='bench',
+                             heartbeat=10, schedule_to_close=20,
+                             schedule_to_start=10, start_to_close=15,
+                             retry=[0] * 20)
+
+    def run(self, width=100):
+        while 1:
+            batch = [self.identity(i) for i in range(width)]
+            for r in batch:
+                r.wait()
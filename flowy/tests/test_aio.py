@@ -0,0 +1,108 @@
+import threading
+from unittest import skipIf
+from unittest import TestCase
+
+from flowy.backend.aio import asyncio
+from flowy.backend.aio import AsyncActivity
+from flowy.backend.aio import AsyncWorker
+from flowy.serialization import default_serializer
+
+
+class RespondLayer1(object):
+    """ Keep the responses of the activities by task token. """
+    def __init__(self):
+        self.completed = {}
+        self.failed = {}
+        self._lock = threading.Lock()
+
+    def respond_activity_task_completed(self, result, task_token):
+        with self._lock:
+            self.completed[task_token] = result
+
+    def respond_activity_task_failed(self, reason, task_token):
+        with self._lock:
+            self.failed[task_token] = reason
+
+
+class ListPoller(object):
+    def __init__(self, tasks):
+        self.tasks = list(tasks)
+
+    def poll_next_task(self):
+        return self.tasks.pop(0)
+
+
+class Double(AsyncActivity):
+    def run(self, x):
+        return x * 2
+
+
+class Fail(AsyncActivity):
+    def run(self, x):
+        raise ValueError('bad %s' % x)
+
+
+class SleepDouble(AsyncActivity):
+    def run(self, x):
+        return asyncio.sleep(0.01, result=x * 2)
+
+
+class Tracked(AsyncActivity):
+    """ Count the activities in flight at the same time. """
+    in_flight = 0
+    max_in_flight = 0
+
+    def run(self, x):
+        cls = self.__class__
+        cls.in_flight += 1
+        cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+        loop = asyncio.get_event_loop()
+        done = loop.create_future()
+
+        def finish():
+            cls.in_flight -= 1
+            done.set_result(x)
+
+        loop.call_later(0.01, finish)
+        return done
+
+
+def activity(factory, layer1, x, token):
+    input = default_serializer.serialize_args([x], {})
+    return factory(layer1, input, token)
+
+
+@skipIf(asyncio is None, 'asyncio is not available')
+class TestAsyncWorker(TestCase):
+
+    def run_worker(self, tasks, concurrency=100):
+        worker = AsyncWorker(ListPoller(tasks), concurrency, threads=4)
+        worker.run_forever(len(tasks))
+
+    def test_result(self):
+        layer1 = RespondLayer1()
+        self.run_worker([activity(Double, layer1, 21, 't1')])
+        self.assertEqual(layer1.completed, {'t1': '42'})
+        self.assertEqual(layer1.failed, {})
+
+    def test_failure(self):
+        layer1 = RespondLayer1()
+        self.run_worker([activity(Fail, layer1, 1, 't1')])
+        self.assertEqual(layer1.completed, {})
+        self.assertEqual(layer1.failed, {'t1': 'bad 1'})
+
+    def test_coroutine_run(self):
+        layer1 = RespondLayer1()
+        tasks = [activity(SleepDouble, layer1, i, 't%s' % i)
+                 for i in range(5)]
+        self.run_worker(tasks)
+        self.assertEqual(layer1.completed,
+                         dict(('t%s' % i, str(i * 2)) for i in range(5)))
+
+    def test_concurrency_bound(self):
+        layer1 = RespondLayer1()
+        Tracked.in_flight = Tracked.max_in_flight = 0
+        tasks = [activity(Tracked, layer1, i, 't%s' % i) for i in range(10)]
+        self.run_worker(tasks, concurrency=3)
+        self.assertEqual(len(layer1.completed), 10)
+        self.assertTrue(1 < Tracked.max_in_flight <= 3)
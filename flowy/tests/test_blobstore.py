@@ -0,0 +1,56 @@
+import shutil
+import tempfile
+from unittest import TestCase
+
+from flowy.blobstore import LocalBlobStore
+from flowy.proxy import TaskProxy
+from flowy.serialization import Serializer
+from flowy.tests.test_task import DummyWorkflow
+
+
+class TestLocalBlobStore(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.store = LocalBlobStore(self.dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_round_trip(self):
+        key = self.store.put(b'data')
+        self.assertEqual(self.store.get(key), b'data')
+
+    def test_invalid_keys(self):
+        for key in ['../../etc/passwd', '/etc/passwd', 'a' * 39,
+                    'A' * 40, 'g' * 40, 'a' * 40 + '\n', 'a' * 41]:
+            self.assertRaises(ValueError, self.store.get, key)
+
+
+class TestProxyBlobStore(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_result_from_proxy_store(self):
+        serializer = Serializer(offload_above=10,
+                                blob_store=LocalBlobStore(self.dir))
+        payload = serializer.serialize_result('x' * 100)
+        self.assertTrue(payload.startswith('!blob:'))
+
+        class OffloadProxy(TaskProxy):
+            _serializer = serializer
+
+        class WF(DummyWorkflow):
+            task = OffloadProxy()
+
+            def run(self):
+                return self.task().result()
+
+        # no default blob store, only the one of the proxy
+        w = WF('[[], {}]', [], [], {'0-0': payload}, {}, ['0-0'])
+        w()
+        self.assertEqual(w.state, [('COMPLETE', '"%s"' % ('x' * 100))])
@@ -0,0 +1,210 @@
+import os
+import pickle
+import threading
+import time
+from unittest import skipIf
+from unittest import TestCase
+
+from flowy.backend.client import ConnectionPool
+from flowy.backend.client import PooledLayer1
+from flowy.backend.client import SWFClientFactory
+
+HOST = 'swf.us-east-1.amazonaws.com', 443, True
+CREDENTIALS = {'aws_access_key_id': 'key', 'aws_secret_access_key': 'secret'}
+
+
+class StubResponse(object):
+    def __init__(self, closed):
+        self.closed = closed
+
+    def isclosed(self):
+        return self.closed
+
+
+class StubConnection(object):
+    """ Stand in for an HTTPConnection, `reading` while its last response
+    wasn't read yet.
+    """
+    def __init__(self, name, reading=False):
+        self.name = name
+        self.closed = False
+        self._HTTPConnection__response = StubResponse(not reading)
+
+    def close(self):
+        self.closed = True
+
+    def __repr__(self):
+        return 'StubConnection(%r)' % self.name
+
+
+def in_thread(f, *args):
+    result = []
+    t = threading.Thread(target=lambda: result.append(f(*args)))
+    t.start()
+    t.join()
+    return result[0]
+
+
+class TestConnectionPool(TestCase):
+
+    def test_reuse(self):
+        pool = ConnectionPool()
+        self.assertEqual(pool.get_http_connection(*HOST), None)
+        conn = StubConnection('a')
+        pool.put_http_connection(*(HOST + (conn,)))
+        self.assertTrue(pool.get_http_connection(*HOST) is conn)
+        self.assertEqual(pool.get_http_connection(*HOST), None)
+        self.assertEqual(pool.stats(), {'hits': 1, 'misses': 2,
+                                        'discarded': 0, 'idle': 0})
+
+    def test_hosts(self):
+        pool = ConnectionPool()
+        pool.put_http_connection(*(HOST + (StubConnection('a'),)))
+        self.assertEqual(pool.get_http_connection('other', 443, True), None)
+        self.assertEqual(pool.get_http_connection(HOST[0], 80, False), None)
+        self.assertEqual(pool.stats()['idle'], 1)
+
+    def test_thread_affinity(self):
+        pool = ConnectionPool()
+        mine, other = StubConnection('mine'), StubConnection('other')
+        pool.put_http_connection(*(HOST + (mine,)))
+        in_thread(pool.put_http_connection, *(HOST + (other,)))
+        # not the most recently used one
+        self.assertTrue(pool.get_http_connection(*HOST) is mine)
+        self.assertTrue(pool.get_http_connection(*HOST) is other)
+
+    def test_no_thread_affinity(self):
+        pool = ConnectionPool(thread_affinity=False)
+        mine, other = StubConnection('mine'), StubConnection('other')
+        pool.put_http_connection(*(HOST + (mine,)))
+        in_thread(pool.put_http_connection, *(HOST + (other,)))
+        self.assertTrue(pool.get_http_connection(*HOST) is other)
+
+    def test_other_thread_connection(self):
+        pool = ConnectionPool()
+        conn = StubConnection('a')
+        in_thread(pool.put_http_connection, *(HOST + (conn,)))
+        self.assertTrue(pool.get_http_connection(*HOST) is conn)
+
+    def test_skip_unread_response(self):
+        pool = ConnectionPool()
+        ready, reading = StubConnection('ready'), StubConnection('r', True)
+        pool.put_http_connection(*(HOST + (ready,)))
+        pool.put_http_connection(*(HOST + (reading,)))
+        self.assertTrue(pool.get_http_connection(*HOST) is ready)
+        self.assertEqual(pool.get_http_connection(*HOST), None)
+        self.assertEqual(pool.stats()['idle'], 1)
+
+    def test_bound(self):
+        pool = ConnectionPool(size=3)
+        conns = [StubConnection(i) for i in range(5)]
+        for conn in conns:
+            pool.put_http_connection(*(HOST + (conn,)))
+        # the oldest ones are closed
+        self.assertEqual([c.closed for c in conns],
+                         [True, True, False, False, False])
+        self.assertEqual(pool.stats()['discarded'], 2)
+        self.assertEqual(pool.stats()['idle'], 3)
+
+    def test_keep_alive(self):
+        pool = ConnectionPool(keep_alive=0.05)
+        conn = StubConnection('a')
+        pool.put_http_connection(*(HOST + (conn,)))
+        time.sleep(0.1)
+        self.assertEqual(pool.get_http_connection(*HOST), None)
+        self.assertTrue(conn.closed)
+        self.assertEqual(pool.stats(), {'hits': 0, 'misses': 1,
+                                        'discarded': 1, 'idle': 0})
+
+    def test_reset_in_other_process(self):
+        pool = ConnectionPool()
+        pool.put_http_connection(*(HOST + (StubConnection('a'),)))
+        pool.get_http_connection('other', 443, True)
+        pool._pid = -1  # as seen from a forked child
+        self.assertEqual(pool.get_http_connection(*HOST), None)
+        self.assertEqual(pool.stats(), {'hits': 0, 'misses': 1,
+                                        'discarded': 0, 'idle': 0})
+
+    @skipIf(not hasattr(os, 'fork'), 'fork is not available')
+    def test_fork(self):
+        pool = ConnectionPool()
+        pool.put_http_connection(*(HOST + (StubConnection('a'),)))
+        self.assertEqual(run_in_fork(lambda: pool.get_http_connection(*HOST)),
+                         'None')
+        self.assertEqual(pool.stats()['idle'], 1)
+
+    def test_pickle(self):
+        pool = ConnectionPool(size=3)
+        pool.put_http_connection(*(HOST + (StubConnection('a'),)))
+        pool = pickle.loads(pickle.dumps(pool))
+        self.assertEqual(pool.stats()['idle'], 0)
+        self.assertEqual(pool._size, 3)
+
+
+def run_in_fork(f):
+    # the repr of the result of f in a forked child
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.write(write, repr(f()).encode('utf-8'))
+        finally:
+            os._exit(0)
+    os.close(write)
+    os.waitpid(pid, 0)
+    with os.fdopen(read, 'rb') as f:
+        return f.read().decode('utf-8')
+
+
+class TestPooledLayer1(TestCase):
+
+    def test_pool(self):
+        pool = ConnectionPool()
+        layer1 = PooledLayer1(pool, **CREDENTIALS)
+        conn = StubConnection('a')
+        layer1.put_http_connection(*(HOST + (conn,)))
+        self.assertTrue(layer1.get_http_connection(*HOST) is conn)
+        # a new connection is made on a miss, without connecting yet
+        self.assertFalse(layer1.get_http_connection(*HOST) is conn)
+        self.assertEqual(pool.stats()['hits'], 1)
+        self.assertEqual(pool.stats()['misses'], 1)
+
+    def test_shared_pool(self):
+        pool = ConnectionPool()
+        conn = StubConnection('a')
+        PooledLayer1(pool, **CREDENTIALS).put_http_connection(
+            *(HOST + (conn,)))
+        other = PooledLayer1(pool, **CREDENTIALS)
+        self.assertTrue(other.get_http_connection(*HOST) is conn)
+
+
+class TestSWFClientFactory(TestCase):
+
+    def test_one_client_per_process(self):
+        factory = SWFClientFactory(pool_size=3, **CREDENTIALS)
+        client = factory()
+        self.assertTrue(isinstance(client, PooledLayer1))
+        self.assertTrue(factory() is client)
+        self.assertTrue(in_thread(factory) is client)
+        self.assertTrue(client._pool is factory.pool)
+
+    def test_stale_client(self):
+        factory = SWFClientFactory(**CREDENTIALS)
+        client = factory()
+        factory._clients = {-1: client}  # as seen from a forked child
+        self.assertFalse(factory() is client)
+        self.assertEqual(list(factory._clients), [os.getpid()])
+
+    @skipIf(not hasattr(os, 'fork'), 'fork is not available')
+    def test_fork(self):
+        factory = SWFClientFactory(**CREDENTIALS)
+        client = factory()
+        self.assertEqual(run_in_fork(lambda: factory() is client), 'False')
+        self.assertTrue(factory() is client)
+
+    def test_pickle(self):
+        factory = SWFClientFactory(pool_size=3, **CREDENTIALS)
+        client = factory()
+        factory = pickle.loads(pickle.dumps(factory))
+        self.assertFalse(factory() is client)
+        self.assertEqual(factory.pool._size, 3)
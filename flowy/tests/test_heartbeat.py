@@ -0,0 +1,154 @@
+import threading
+import time
+from unittest import TestCase
+
+from boto.swf.exceptions import SWFResponseError
+
+from flowy.backend.heartbeat import Heartbeater
+from flowy.backend.poller import SWFActivityPoller
+from flowy.backend.swf import SWFActivity
+from flowy.serialization import default_serializer
+from flowy.worker import SingleThreadedWorker
+
+
+class HeartbeatClient(object):
+    """ Record the heartbeats, answer the ones of the `cancel` tokens with a
+    cancellation and fail the ones of the `broken` tokens.
+    """
+    def __init__(self, tasks=(), cancel=(), broken=()):
+        self.tasks = list(tasks)
+        self.cancel = set(cancel)
+        self.broken = set(broken)
+        self.beats = []
+        self.completed = {}
+        self._lock = threading.Lock()
+
+    def poll_for_activity_task(self, task_list):
+        if not self.tasks:
+            return {}
+        token, seconds = self.tasks.pop(0)
+        return {'activityType': {'name': 'Sleep', 'version': '1'},
+                'input': default_serializer.serialize_args([seconds], {}),
+                'taskToken': token}
+
+    def record_activity_task_heartbeat(self, task_token, details=None):
+        with self._lock:
+            self.beats.append((time.time(), task_token, details))
+        if task_token in self.broken:
+            raise SWFResponseError(400, 'Bad Request')
+        return {'cancelRequested': task_token in self.cancel}
+
+    def respond_activity_task_completed(self, result, task_token):
+        self.completed[task_token] = result
+
+    def respond_activity_task_failed(self, reason, task_token):
+        pass
+
+    def beats_of(self, token):
+        with self._lock:
+            return [b for b in self.beats if b[1] == token]
+
+
+class Sleep(SWFActivity):
+    def run(self, seconds, details=()):
+        for d in details:
+            self.heartbeat(d)
+        time.sleep(seconds)
+        return self.heartbeat()
+
+
+class UntilCancelled(SWFActivity):
+    def run(self, timeout):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if not self.heartbeat():
+                return self.cancel_requested
+            time.sleep(0.01)
+        return 'timed out'
+
+
+def sleep_factory(spec_key, swf_client, input, token):
+    return Sleep(swf_client, input, token)
+
+
+def activity(factory, client, heartbeater, token, *args, **kwargs):
+    input = default_serializer.serialize_args(args, kwargs)
+    task = factory(client, input, token)
+    task._heartbeater = heartbeater
+    return task
+
+
+def heartbeat_threads():
+    return [t for t in threading.enumerate() if t.name == 'flowy-heartbeat']
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline and not condition():
+        time.sleep(0.01)
+    return condition()
+
+
+class TestHeartbeater(TestCase):
+
+    def setUp(self):
+        # an interval of 0.1s
+        self.client = HeartbeatClient(cancel=['c'], broken=['b'])
+        self.heartbeater = Heartbeater(self.client, 0.2)
+
+    def run_activity(self, factory, token, *args, **kwargs):
+        activity(factory, self.client, self.heartbeater, token, *args,
+                 **kwargs)()
+        return self.client.completed.get(token)
+
+    def test_cadence(self):
+        start = time.time()
+        self.assertEqual(self.run_activity(Sleep, 't', 0.45), 'true')
+        beats = [at for at, _, _ in self.client.beats_of('t')]
+        self.assertTrue(3 <= len(beats) <= 5)
+        self.assertTrue(beats[0] - start >= 0.09)
+        for before, after in zip(beats, beats[1:]):
+            self.assertTrue(after - before >= 0.09)
+
+    def test_coalesced_details(self):
+        self.run_activity(Sleep, 't', 0.15, details=['first', 'last'])
+        self.assertEqual(self.client.beats_of('t')[0][2], 'last')
+
+    def test_no_beats_after_stop(self):
+        self.run_activity(Sleep, 't', 0.15)
+        beats = len(self.client.beats_of('t'))
+        self.assertTrue(beats >= 1)
+        time.sleep(0.3)
+        self.assertEqual(len(self.client.beats_of('t')), beats)
+        task = activity(Sleep, self.client, self.heartbeater, 't', 0)
+        self.assertFalse(self.heartbeater.update(task))
+
+    def test_cancel_requested(self):
+        self.assertEqual(self.run_activity(UntilCancelled, 'c', 5), 'true')
+
+    def test_failed_heartbeat(self):
+        self.assertEqual(self.run_activity(UntilCancelled, 'b', 5), 'false')
+
+    def test_concurrent_activities(self):
+        tasks = [activity(Sleep, self.client, self.heartbeater, token, 0.35)
+                 for token in ['t1', 't2', 't3']]
+        threads = [threading.Thread(target=t) for t in tasks]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        for token in ['t1', 't2', 't3']:
+            self.assertTrue(len(self.client.beats_of(token)) >= 2)
+
+    def test_thread_stops_with_the_worker(self):
+        self.client.tasks = [('t1', 0.15), ('t2', 0.15)]
+        poller = SWFActivityPoller(self.client, 'tl', sleep_factory,
+                                   heartbeater=self.heartbeater)
+        SingleThreadedWorker(poller).run_forever(2)
+        self.assertEqual(sorted(self.client.completed), ['t1', 't2'])
+        self.assertTrue(self.client.beats_of('t1'))
+        self.assertTrue(self.client.beats_of('t2'))
+        self.assertTrue(wait_for(lambda: not heartbeat_threads()))
+        # and starts again with the next activity
+        self.run_activity(Sleep, 't3', 0.15)
+        self.assertTrue(self.client.beats_of('t3'))
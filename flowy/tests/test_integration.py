@@ -1,18 +1,13 @@
 import importlib
 import itertools
-import json
 import os
 import sys
 import unittest
 import uuid
-from pprint import pformat as pf
-
-from boto.swf.exceptions import SWFResponseError
-from boto.swf.exceptions import SWFTypeAlreadyExistsError
-from boto.swf.layer1 import Layer1
 
 from flowy import start_activity_worker
 from flowy import start_workflow_worker
+from flowy.tests.recorder import Layer1Playback
 
 os.environ['TESTING'] = '1'
 
@@ -32,60 +27,6 @@ test_modules = [
 ]
 
 
-class Layer1Playback(Layer1):
-
-    def __len__(self):
-        assert len(self.responses) == len(self.requests)
-        skip = 0
-        for action, data in self.requests:
-            if action in ['RegisterWorkflowType', 'DescribeWorkflowType',
-                          'RegisterActivityType', 'DescribeActivityType',
-                          'RecordActivityTaskHeartbeat']:
-                skip += 1
-            if action == 'PollForDecisionTask' and data.get('nextPageToken'):
-                skip += 1
-        return (len(self.responses) - skip) // 2
-
-    def __init__(self, log_file):
-        self.responses = []
-        self.requests = []
-        for line in log_file:
-            sep, data = line.split('\t', 1)
-            if sep == '<<<':
-                try:
-                    data = json.loads(data)
-                except ValueError:
-                    pass
-                self.responses.append(data)
-            else:
-                action, request = data.split('\t', 1)
-                self.requests.append((action, json.loads(request)))
-        log_file.close()
-        if not len(self.responses) == len(self.requests):
-            raise ValueError('Unbalanced log file.')
-        self.responses_i = iter(self.responses)
-        self.requests_i = iter(self.requests)
-
-    def json_request(self, action, data, object_hook=None):
-        self._normalize_request_dict(data)
-        next_action, next_data = next(self.requests_i)
-        action_msg = ("The actions don't match."
-                      " Expected action: %s. Actual action: %s.")
-        assert next_action == action, action_msg % (next_action, action)
-        data_msg = ("Request data doesn't match."
-                    " Expected data:\n%r\nActual data:\n%r\n")
-        assert next_data == data, data_msg % (pf(next_data), pf(data))
-        next_response = next(self.responses_i)
-        try:
-            if next_response.strip() == 'SWFResponseError':
-                raise SWFResponseError(None, None)
-            if next_response.strip() == 'SWFTypeAlreadyExistsError':
-                raise SWFTypeAlreadyExistsError(None, None)
-        except AttributeError:
-            pass
-        return next_response
-
-
 class TestIntegration(unittest.TestCase):
     def setUp(self):
         self._old_uuid4 = uuid.uuid4
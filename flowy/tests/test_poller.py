@@ -0,0 +1,275 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from boto.swf.exceptions import SWFResponseError
+
+from flowy.backend.boilerplate import start_workflow_worker
+from flowy.backend.cache import HistoryCache
+from flowy.backend.poller import _History
+from flowy.backend.poller import SWFWorkflowPoller
+from flowy.backend.retry import RetryPolicy
+from flowy.backend.spec import SWFWorkflowSpec
+from flowy.backend.swf import SWFTaskRegistry
+from flowy.backend.swf import SWFWorkflow
+from flowy.tests.bench.history import synthetic_history
+
+
+class HistoryLayer1(object):
+    """ Serve a decision task at every decision point of a history, the
+    events split in pages of `page_size`.
+    """
+    def __init__(self, history, page_size):
+        self.history = history
+        self.page_size = page_size
+        self.points = [i + 1 for i, e in enumerate(history)
+                       if e['eventType'] == 'DecisionTaskStarted']
+        self.point = None
+
+    def poll_for_decision_task(self, task_list, next_page_token=None,
+                               reverse_order=None):
+        offset = 0
+        if next_page_token is None:
+            self.point = self.points.pop(0)
+        else:
+            offset = int(next_page_token)
+        events = self.history[:self.point]
+        if reverse_order:
+            events.reverse()
+        page = {
+            'taskToken': 'token-%s' % self.point,
+            'workflowExecution': {'workflowId': 'wid', 'runId': 'rid'},
+            'events': events[offset:offset + self.page_size],
+        }
+        if offset + self.page_size < len(events):
+            page['nextPageToken'] = str(offset + self.page_size)
+        return page
+
+
+class FlakyLayer1(HistoryLayer1):
+    """ Fail the next `failures` page fetches. """
+    failures = 0
+
+    def poll_for_decision_task(self, task_list, next_page_token=None,
+                               reverse_order=None):
+        if next_page_token is not None and self.failures:
+            self.failures -= 1
+            raise SWFResponseError(400, 'Throttled')
+        return super(FlakyLayer1, self).poll_for_decision_task(
+            task_list, next_page_token, reverse_order)
+
+
+class ParsedState(object):
+    """ A task factory keeping the state parsed for the decision. """
+    def __init__(self, spec, swf_client, input, token, running, timedout,
+                 results, errors, order, *args, **kwargs):
+        self.state = (set(running), set(timedout),
+                      dict((k, results[k]) for k in results),
+                      dict(errors), list(order))
+        self.extra = kwargs['extra']
+
+
+class TestCachedHistory(TestCase):
+
+    def decisions(self, history, page_size, **kwargs):
+        layer1 = HistoryLayer1(history, page_size)
+        poller = SWFWorkflowPoller(layer1, 'tl', ParsedState, **kwargs)
+        return [poller.poll_next_task().state
+                for _ in range(len(layer1.points))]
+
+    def assert_same_decisions(self, page_size, **kwargs):
+        history = synthetic_history(600, width=10, failures=0.1,
+                                    timeouts=0.1)
+        full = self.decisions(history, page_size)
+        cached = self.decisions(history, page_size,
+                                history_cache=HistoryCache(), **kwargs)
+        self.assertTrue(len(full) > 10)
+        for decision, (expected, state) in enumerate(zip(full, cached)):
+            self.assertEqual(state, expected, 'decision %s' % decision)
+
+    def test_single_page(self):
+        self.assert_same_decisions(page_size=1000)
+
+    def test_page_boundaries(self):
+        # the new events of most decisions span a page boundary
+        self.assert_same_decisions(page_size=7)
+
+    def test_spilled_results(self):
+        self.assert_same_decisions(page_size=7, spill_threshold=0)
+
+    def test_page_prefetch(self):
+        self.assert_same_decisions(page_size=7, page_prefetch=2)
+
+    def test_keep_decoded(self):
+        history = synthetic_history(200, width=10)
+        for keep_decoded in (False, True):
+            layer1 = HistoryLayer1(history, 1000)
+            cache = HistoryCache(keep_decoded=keep_decoded)
+            poller = SWFWorkflowPoller(layer1, 'tl', ParsedState,
+                                       history_cache=cache)
+            first, second = poller.poll_next_task(), poller.poll_next_task()
+            decoded = cache.get('rid').decoded
+            self.assertEqual(getattr(first, '_decoded', None) is decoded,
+                             keep_decoded)
+            self.assertEqual(getattr(second, '_decoded', None) is decoded,
+                             keep_decoded)
+
+
+def _signaled(h, e):
+    attrs = e['workflowExecutionSignaledEventAttributes']
+    h.extra.setdefault('signals', []).append(attrs['signalName'])
+
+
+def signaled_history(events, every):
+    # turn some of the ignored events into signals, the ids are kept
+    history = synthetic_history(events, width=5)
+    scheduled = [e for e in history
+                 if e['eventType'] == 'DecisionTaskScheduled']
+    signals = []
+    for i, e in enumerate(scheduled[1::every]):
+        e['eventType'] = 'WorkflowExecutionSignaled'
+        e['workflowExecutionSignaledEventAttributes'] = {
+            'signalName': 's%s' % i}
+        signals.append('s%s' % i)
+    return history, signals
+
+
+class RespondLayer1(HistoryLayer1):
+    def respond_decision_task_completed(self, task_token, decisions):
+        pass
+
+
+class Signals(SWFWorkflow):
+    """ Keep the signals seen by every decision. """
+    seen = []
+
+    def run(self, width):
+        Signals.seen.append(list(self.extra.get('signals', [])))
+
+
+class TestEventHandlers(TestCase):
+
+    def signals(self, **kwargs):
+        history, signals = signaled_history(200, 3)
+        layer1 = HistoryLayer1(history, 7)
+        poller = SWFWorkflowPoller(layer1, 'tl', ParsedState,
+                                   event_handlers={
+                                       'WorkflowExecutionSignaled': _signaled,
+                                   }, **kwargs)
+        seen = [list(poller.poll_next_task().extra.get('signals', []))
+                for _ in range(len(layer1.points))]
+        self.assertTrue(len(signals) > 2)
+        self.assertEqual(seen[-1], signals)
+        # every decision sees the signals received so far
+        for before, after in zip(seen, seen[1:]):
+            self.assertEqual(after[:len(before)], before)
+        return seen
+
+    def test_extra(self):
+        self.signals()
+
+    def test_cached_extra(self):
+        self.assertEqual(self.signals(history_cache=HistoryCache()),
+                         self.signals())
+
+    def test_default_extra(self):
+        layer1 = HistoryLayer1(synthetic_history(50, width=5), 7)
+        poller = SWFWorkflowPoller(layer1, 'tl', ParsedState)
+        self.assertEqual(poller.poll_next_task().extra, {})
+
+    def test_worker(self):
+        history, signals = signaled_history(200, 3)
+        layer1 = RespondLayer1(history, 7)
+        decisions = len(layer1.points)
+        directory = tempfile.mkdtemp()
+        try:
+            manifest = os.path.join(directory, 'manifest.json')
+            registry = SWFTaskRegistry()
+            registry.add(SWFWorkflowSpec('Synthetic', '1'), Signals)
+            registry.write_manifest(manifest)
+            del Signals.seen[:]
+            start_workflow_worker(
+                'd', 'tl', layer1=layer1, reg_remote=False,
+                loop=decisions, setup_log=False, manifest=manifest,
+                history_cache=HistoryCache(),
+                event_handlers={'WorkflowExecutionSignaled': _signaled})
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(len(Signals.seen), decisions)
+        self.assertEqual(Signals.seen[-1], signals)
+
+
+class TestPageRetries(TestCase):
+
+    def setUp(self):
+        history = synthetic_history(100, width=5)
+        self.expected = TestCachedHistory().decisions(history, 10)
+        self.layer1 = FlakyLayer1(history, 10)
+        self.delays = []
+        # the circuit would open after two failures
+        policy = RetryPolicy(base=1, jitter=False, max_failures=2,
+                             pause=60, sleep=self.delays.append)
+        self.poller = SWFWorkflowPoller(self.layer1, 'tl', ParsedState,
+                                        retry_policy=policy)
+
+    def test_retry(self):
+        self.poller.poll_next_task()
+        self.layer1.failures = 3
+        self.assertEqual(self.poller.poll_next_task().state,
+                         self.expected[1])
+        self.assertEqual(self.delays, [1, 2, 4])
+
+    def test_give_up(self):
+        self.poller.poll_next_task()
+        self.layer1.failures = SWFWorkflowPoller._page_attempts
+        # the decision task is dropped, the next one is polled
+        self.assertEqual(self.poller.poll_next_task().state,
+                         self.expected[2])
+        # no sleep after the last attempt and no circuit breaker pause
+        self.assertEqual(self.delays, [1, 2, 4, 8, 16, 20])
+
+
+class TestHistorySize(TestCase):
+
+    def expected_size(self, h):
+        # the size walking the whole history
+        size = sum(len(k) + len(h.errors[k] or '') for k in h.errors)
+        size += sum(h.payload_size(k) for k in h.decoded)
+        size += 64 * (len(h.running) + len(h.timedout) + len(h.event2call))
+        if isinstance(h.results, dict):
+            return size + sum(len(k) + len(h.results[k] or '')
+                              for k in h.results)
+        return size + h.results.memory_size
+
+    def assert_size(self, spill_threshold):
+        history = synthetic_history(600, width=10, failures=0.1,
+                                    timeouts=0.1, result_size=50)
+        poller = SWFWorkflowPoller(None, 'tl', None,
+                                   spill_threshold=spill_threshold)
+        h = _History(spill_threshold=spill_threshold)
+        for start in range(0, len(history), 100):
+            poller._parse_events(history[start:start + 100], h)
+            self.assertEqual(h.size, self.expected_size(h))
+        size = h.size
+        for call_key in list(h.results)[:10]:
+            h.decoded[call_key] = 'decoded'
+            h.decoded[call_key] = 'decoded again'
+        self.assertTrue(h.size > size)
+        self.assertEqual(h.size, self.expected_size(h))
+
+    def test_in_memory(self):
+        self.assert_size(None)
+
+    def test_spilled(self):
+        self.assert_size(20)
+
+    def test_cache_counts_decoded(self):
+        cache = HistoryCache(max_size=None)
+        h = _History()
+        h.add_result('0-0', '"%s"' % ('x' * 100))
+        cache.put('run', h)
+        h.decoded['0-0'] = 'x' * 100
+        cache.put('run', h)
+        self.assertEqual(cache._size, h.size)
+        self.assertEqual(h.size, 3 + 2 * 102)
@@ -0,0 +1,137 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import TestCase
+
+from flowy.__main__ import start_many
+from flowy.backend.boilerplate import SWFWorkflowStarter
+from flowy.backend.emulator import _error
+from flowy.backend.emulator import SWFEmulator
+from flowy.backend.retry import RetryPolicy
+from flowy.backend.spec import SWFWorkflowSpec
+from flowy.util import MagicBind
+
+
+class ThrottlingEmulator(SWFEmulator):
+    """ Throttle the first `throttle` starts of every workflow id. """
+    def __init__(self, throttle=0):
+        super(ThrottlingEmulator, self).__init__()
+        self.throttle = throttle
+        self.attempts = {}
+
+    def _start_workflow_execution(self, data):
+        id = data['workflowId']
+        with self._lock:
+            attempt = self.attempts[id] = self.attempts.get(id, 0) + 1
+        if attempt <= self.throttle:
+            raise _error('ThrottlingException', 'Rate exceeded')
+        return super(ThrottlingEmulator, self)._start_workflow_execution(data)
+
+
+class TestStartMany(TestCase):
+
+    def starter(self, throttle=0):
+        self.emulator = ThrottlingEmulator(throttle)
+        self.emulator.register_workflow_type(
+            'd', 'W', '1', task_list='tl',
+            default_task_start_to_close_timeout='10',
+            default_execution_start_to_close_timeout='100')
+        return SWFWorkflowStarter(SWFWorkflowSpec('W', '1'),
+                                  MagicBind(self.emulator, domain='d'))
+
+    def start_many(self, rows, throttle=0, **kwargs):
+        starter = self.starter(throttle)
+        kwargs.setdefault('retry_policy', RetryPolicy(base=0.001,
+                                                      jitter=False))
+        return dict((id, (run_id, error)) for id, run_id, error
+                    in starter.start_many(iter(rows), **kwargs))
+
+    def test_start(self):
+        rows = [{'id': 'a', 'args': [1]}, {'kwargs': {'x': 1}}, {}]
+        started = self.start_many(rows, workers=2)
+        self.assertEqual(len(started), 3)
+        for run_id, error in started.values():
+            self.assertTrue(run_id)
+            self.assertEqual(error, None)
+        self.assertTrue('a' in started)
+
+    def test_duplicates(self):
+        starter = self.starter()
+        list(starter.start_many([{'id': 'running'}]))
+        rows = [{'id': 'a'}, {'id': 'a'}, {'id': 'running'}]
+        outcomes = list(starter.start_many(rows, workers=2))
+        errors = sorted((id, error or '') for id, _, error in outcomes)
+        self.assertEqual(errors, [('a', ''), ('a', 'duplicate'),
+                                  ('running', 'duplicate')])
+
+    def test_throttled_retries(self):
+        started = self.start_many([{'id': 'a'}, {'id': 'b'}], throttle=2,
+                                  retries=2)
+        self.assertEqual([started[id][1] for id in 'ab'], [None, None])
+        self.assertEqual(self.emulator.attempts, {'a': 3, 'b': 3})
+
+    def test_throttled_too_many_times(self):
+        started = self.start_many([{'id': 'a'}], throttle=3, retries=2)
+        self.assertEqual(started['a'][0], None)
+        self.assertTrue('Rate exceeded' in started['a'][1])
+        self.assertEqual(self.emulator.attempts, {'a': 3})
+
+    def test_rate(self):
+        rows = [{'id': str(i)} for i in range(11)]
+        start = time.time()
+        started = self.start_many(rows, workers=4, rate=50)
+        # the starts are spaced by 20ms
+        self.assertTrue(time.time() - start >= 0.18)
+        self.assertEqual(len(started), 11)
+
+    def test_close_early(self):
+        def rows():
+            i = 0
+            while 1:
+                yield {'id': str(i)}
+                i += 1
+
+        starts = self.starter().start_many(rows(), workers=2)
+        for _ in range(5):
+            next(starts)
+        starts.close()
+        deadline = time.time() + 10
+        while time.time() < deadline and self.start_threads():
+            time.sleep(0.05)
+        self.assertEqual(self.start_threads(), [])
+
+    def start_threads(self):
+        return [t for t in threading.enumerate()
+                if t.name.startswith('flowy-start')]
+
+
+class TestStartManyCommand(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_many(self):
+        emulator = SWFEmulator()
+        emulator.register_workflow_type(
+            'd', 'W', '1', task_list='tl',
+            default_task_start_to_close_timeout='10',
+            default_execution_start_to_close_timeout='100')
+        starter = SWFWorkflowStarter(SWFWorkflowSpec('W', '1'),
+                                     MagicBind(emulator, domain='d'))
+        path = os.path.join(self.dir, 'rows.jsonl')
+        output_path = os.path.join(self.dir, 'out.jsonl')
+        with open(path, 'w') as f:
+            f.write('{"id": "a", "args": [1]}\n\n[2, 3]\n{"id": "a"}\n')
+        failed = start_many(starter, path, output_path, 2, None)
+        self.assertEqual(failed, 1)
+        with open(output_path) as f:
+            outcomes = [json.loads(line) for line in f]
+        self.assertEqual(len(outcomes), 3)
+        self.assertEqual(sum('runId' in o for o in outcomes), 2)
+        self.assertTrue({'id': 'a', 'error': 'duplicate'} in outcomes)
@@ -0,0 +1,192 @@
+import importlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+from unittest import TestCase
+
+from boto.swf.exceptions import SWFResponseError
+
+from flowy.backend.cache import RegistrationCache
+from flowy.backend.spec import SWFActivitySpec
+from flowy.backend.spec import SWFSpecKey
+from flowy.backend.spec import SWFWorkflowSpec
+from flowy.backend.swf import _import_path
+from flowy.backend.swf import _LazyFactory
+from flowy.backend.swf import load_manifest
+from flowy.backend.swf import SWFTaskRegistry
+
+TASKS_MODULE = '''
+class Outer(object):
+    class Inner(object):
+        def __init__(self, *args):
+            self.args = args
+
+
+def activity(*args):
+    return ('activity',) + args
+'''
+
+
+class TestManifest(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.module = 'flowy_manifest_tasks'
+        with open(os.path.join(self.dir, self.module + '.py'), 'w') as f:
+            f.write(TASKS_MODULE)
+        sys.path.insert(0, self.dir)
+        self.path = os.path.join(self.dir, 'manifest.json')
+
+    def tearDown(self):
+        sys.path.remove(self.dir)
+        sys.modules.pop(self.module, None)
+        shutil.rmtree(self.dir)
+
+    def write_manifest(self):
+        tasks = importlib.import_module(self.module)
+        registry = SWFTaskRegistry()
+        registry.add(SWFActivitySpec('a', 1, 'tl', heartbeat=5),
+                     tasks.activity)
+        registry.add(SWFWorkflowSpec('w', 2, 'tl', 10, 60), tasks.Outer.Inner)
+        registry.write_manifest(self.path)
+        del sys.modules[self.module]
+
+    def test_format(self):
+        self.write_manifest()
+        with open(self.path) as f:
+            entries = json.load(f)
+        self.assertEqual([e['kind'] for e in entries],
+                         ['activity', 'workflow'])
+        self.assertEqual(entries[0]['factory'],
+                         'flowy_manifest_tasks:activity')
+        self.assertEqual(entries[1]['factory'],
+                         'flowy_manifest_tasks:Outer.Inner')
+        self.assertEqual(entries[1]['spec'], {
+            'name': 'w', 'version': 2, 'task_list': 'tl',
+            'decision_duration': 10, 'workflow_duration': 60})
+
+    def test_round_trip(self):
+        self.write_manifest()
+        registry = load_manifest(self.path)
+        self.assertEqual(sorted(registry._registry),
+                         [SWFSpecKey('a', 1), SWFSpecKey('w', 2)])
+        spec = [s for s in registry._registry if s == SWFSpecKey('a', 1)][0]
+        self.assertEqual(spec._heartbeat, 5)
+        # the modules are imported by the first task, not by the load
+        self.assertFalse(self.module in sys.modules)
+        workflow = registry(SWFSpecKey('w', 2), 'x', 'y')
+        self.assertTrue(self.module in sys.modules)
+        self.assertEqual(workflow.__class__.__name__, 'Inner')
+        self.assertEqual(workflow.args, ('x', 'y'))
+        self.assertEqual(registry(SWFSpecKey('a', 1), 'z'),
+                         ('activity', 'z'))
+
+    def test_kind(self):
+        self.write_manifest()
+        registry = load_manifest(self.path, 'workflow')
+        self.assertEqual(list(registry._registry), [SWFSpecKey('w', 2)])
+
+    def test_missing_module(self):
+        factory = _LazyFactory('flowy_no_such_module:Task')
+        self.assertRaises(ImportError, factory)
+
+    def test_local_factory(self):
+        class Local(object):
+            pass
+        self.assertRaises(ValueError, _import_path, Local)
+
+
+class RegisterLayer1(object):
+    """ Register the activity types, failing for the names in `broken`. """
+    def __init__(self, broken=()):
+        self.broken = set(broken)
+        self.registered = []
+        self._lock = threading.Lock()
+
+    def register_activity_type(self, name, **kwargs):
+        with self._lock:
+            self.registered.append(name)
+        if name in self.broken:
+            raise SWFResponseError(400, 'Bad Request')
+
+    def describe_activity_type(self, activity_name, activity_version):
+        raise SWFResponseError(400, 'Bad Request')
+
+
+class TestRegisterRemote(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'registered.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def registry(self, names, task_list='tl'):
+        registry = SWFTaskRegistry()
+        for name in names:
+            registry.add(SWFActivitySpec(name, 1, task_list), None)
+        return registry
+
+    def test_skip_cached(self):
+        layer1 = RegisterLayer1()
+        cache = RegistrationCache(self.path, 'domain')
+        self.registry(['a', 'b']).register_remote(layer1, cache)
+        self.assertEqual(sorted(layer1.registered), ['a', 'b'])
+        # a new worker loads the cache from disk
+        layer1 = RegisterLayer1()
+        cache = RegistrationCache(self.path, 'domain')
+        self.registry(['a', 'b', 'c']).register_remote(layer1, cache)
+        self.assertEqual(layer1.registered, ['c'])
+
+    def test_invalidation(self):
+        cache = RegistrationCache(self.path, 'domain')
+        self.registry(['a']).register_remote(RegisterLayer1(), cache)
+        layer1 = RegisterLayer1()
+        changed = self.registry(['a'], task_list='other')
+        changed.register_remote(layer1, RegistrationCache(self.path,
+                                                          'domain'))
+        self.assertEqual(layer1.registered, ['a'])
+        layer1 = RegisterLayer1()
+        other_domain = RegistrationCache(self.path, 'other')
+        self.registry(['a']).register_remote(layer1, other_domain)
+        self.assertEqual(layer1.registered, ['a'])
+
+    def test_concurrent_failures(self):
+        names = ['t%s' % i for i in range(10)]
+        layer1 = RegisterLayer1(broken=['t3', 't7'])
+        cache = RegistrationCache(self.path, 'domain')
+        failed = self.registry(names).register_remote(layer1, cache, 4)
+        self.assertEqual(sorted(spec._name for spec in failed),
+                         ['t3', 't7'])
+        self.assertEqual(sorted(layer1.registered), names)
+        # only the failed ones are registered again
+        layer1 = RegisterLayer1()
+        cache = RegistrationCache(self.path, 'domain')
+        self.registry(names).register_remote(layer1, cache, 4)
+        self.assertEqual(sorted(layer1.registered), ['t3', 't7'])
+
+    def test_atomic_save(self):
+        cache = RegistrationCache(self.path, 'domain')
+        self.registry(['a']).register_remote(RegisterLayer1(), cache)
+        with open(self.path) as f:
+            saved = f.read()
+        # fails while the keys are written
+        cache._keys = set([object()])
+        self.assertRaises(TypeError, cache.save)
+        with open(self.path) as f:
+            self.assertEqual(f.read(), saved)
+        self.assertEqual(os.listdir(self.dir), ['registered.json'])
+
+    def test_corrupted_cache(self):
+        with open(self.path, 'w') as f:
+            f.write('[not json')
+        layer1 = RegisterLayer1()
+        cache = RegistrationCache(self.path, 'domain')
+        self.registry(['a']).register_remote(layer1, cache)
+        self.assertEqual(layer1.registered, ['a'])
+        self.assertTrue(RegistrationCache(self.path, 'domain').is_registered(
+            SWFActivitySpec('a', 1, 'tl')))
@@ -1,13 +1,22 @@
+import json
 from unittest import TestCase
 
+from flowy.instrument import InMemoryInstrumentation
+from flowy.instrument import Metrics
 from flowy.proxy import TaskProxy
+from flowy.serialization import Serializer
+from flowy.task import as_completed
+from flowy.task import first
+from flowy.task import first_n
 from flowy.task import Workflow
 
 
+class DummyWorkflow(Workflow):
+    """ A workflow that is its own backend and records what it sends. """
 
-class DummyBackend(Workflow):
-
-    def __init__(self):
+    def __init__(self, input, running, timedout, results, errors, order):
+        super(DummyWorkflow, self).__init__(input, running, timedout,
+                                            results, errors, order)
         self.state = None
         self.scheduled = []
 
@@ -15,20 +24,25 @@ class DummyBackend(Workflow):
         assert self.state is None, "Extra flush call."
         self.state = self.scheduled
 
-    def schedule(self, proxy,
+    def schedule(self, proxy, call_key, a, kw, delay):
+        self.scheduled.append((proxy, call_key, list(a), kw, delay))
 
     def restart(self, a, kw):
         assert self.state is None, "Extra restart call."
-        self.state = [('RESTART', a, kw)]
+        self.state = [('RESTART', json.dumps([list(a), kw]))]
+
+    def wake_up(self, timer_id):
+        self.scheduled.append(('WAKE_UP', timer_id))
 
     def complete(self, result):
         assert self.state is None, "Extra complete call."
-        self.state = [('COMPLETE', result)]
+        self.state = [('COMPLETE', json.dumps(result))]
 
     def fail(self, reason):
         assert self.state is None, "Extra fail call."
         self.state = [('FAIL', reason)]
 
+
 default_order = ['%s-%s' % (x, y) for x in range(100) for y in range(100)]
 
 
@@ -85,6 +99,36 @@ class TestSimpleWorkflow(TestWorkflow):
         )
 
 
+class TestInput(TestWorkflow):
+
+    class WF(DummyWorkflow):
+        a = TaskProxy()
+        def run(self, x, y=None):
+            return self.a(x, y=y)
+
+    def test_tagged_input(self):
+        s = Serializer('json+zlib')
+        self.run_workflow(input=s.serialize_args([1], {'y': [2]}))
+        self.assert_state(
+            (self.WF.a, '0-0', [1], {'y': [2]}, 0)
+        )
+
+    def test_compressed_input(self):
+        s = Serializer(compress_above=0)
+        input = s.serialize_args([1], {})
+        self.assertTrue(input.startswith('!zlib:'))
+        self.run_workflow(input=input)
+        self.assert_state(
+            (self.WF.a, '0-0', [1], {'y': None}, 0)
+        )
+
+    def test_invalid_input(self):
+        self.run_workflow(input='!unknown:')
+        self.assert_state(
+            ('FAIL', "Unknown or unavailable codec: 'unknown'")
+        )
+
+
 class TestReturnEarly(TestWorkflow):
 
     class WF(DummyWorkflow):
@@ -174,6 +218,102 @@ class TestParallel(TestWorkflow):
         )
 
 
+class TestSpillover(TestWorkflow):
+
+    class WF(DummyWorkflow):
+        decision_limit = 3
+        a = TaskProxy()
+        def run(self):
+            return [self.a(x) for x in range(5)]
+
+    def test_spillover(self):
+        self.run_workflow()
+        self.assert_state(
+            (self.WF.a, '0-0', [0], {}, 0),
+            (self.WF.a, '1-0', [1], {}, 0),
+            ('WAKE_UP', '2-0:spillover'),
+        )
+        self.assertEquals(self.w._deferred, 3)
+
+    def test_spillover_continue(self):
+        self.run_workflow(running=['0-0', '1-0'])
+        self.assert_state(
+            (self.WF.a, '2-0', [2], {}, 0),
+            (self.WF.a, '3-0', [3], {}, 0),
+            (self.WF.a, '4-0', [4], {}, 0),
+        )
+
+    def test_no_spillover_on_rate_limit(self):
+        self.WF.rate_limit = 4
+        try:
+            self.run_workflow(running=['0-0', '1-0'])
+        finally:
+            del self.WF.rate_limit
+        self.assert_state(
+            (self.WF.a, '2-0', [2], {}, 0),
+            (self.WF.a, '3-0', [3], {}, 0),
+        )
+
+
+class TestSpilloverOne(TestWorkflow):
+
+    class WF(DummyWorkflow):
+        decision_limit = 1
+        a = TaskProxy()
+        def run(self):
+            return [self.a(x) for x in range(3)]
+
+    def test_spillover(self):
+        self.run_workflow()
+        self.assert_state(
+            (self.WF.a, '0-0', [0], {}, 0),
+            ('WAKE_UP', '1-0:spillover'),
+        )
+
+    def test_spillover_continue(self):
+        self.run_workflow(running=['0-0'])
+        self.assert_state(
+            (self.WF.a, '1-0', [1], {}, 0),
+            ('WAKE_UP', '2-0:spillover'),
+        )
+
+    def test_spillover_last(self):
+        self.run_workflow(running=['0-0', '1-0'])
+        self.assert_state(
+            (self.WF.a, '2-0', [2], {}, 0),
+        )
+
+
+class LimitedProxy(TaskProxy):
+    _limit = 2
+
+
+class TestLimits(TestWorkflow):
+
+    class WF(DummyWorkflow):
+        a = LimitedProxy()
+        b = TaskProxy()
+        def run(self):
+            return [self.a(x) for x in range(3)], self.b(3)
+
+    def test_proxy_limit(self):
+        self.run_workflow(running=['0-0'])
+        self.assert_state(
+            (self.WF.a, '1-0', [1], {}, 0),
+            (self.WF.b, '3-0', [3], {}, 0),
+        )
+
+    def test_task_list_limit(self):
+        self.WF.task_list_limits = {None: 2}
+        try:
+            self.run_workflow(running=['0-0'])
+        finally:
+            del self.WF.task_list_limits
+        self.assert_state(
+            (self.WF.a, '1-0', [1], {}, 0),
+        )
+
+
 class TestRetry(TestWorkflow):
 
     class WF(DummyWorkflow):
@@ -211,7 +351,7 @@ class TestFirst(TestWorkflow):
     class WF(DummyWorkflow):
         a = TaskProxy()
         def run(self):
-            return self.first(self.a(), self.a(), self.a())
+            return first(self.a(), self.a(), self.a())
 
     def test_first_1(self):
         self.run_workflow(results={'0-0': '10', '1-0': '20', '2-0': '30'},
@@ -247,7 +387,7 @@ class TestFirstN(TestWorkflow):
     class WF(DummyWorkflow):
         a = TaskProxy()
         def run(self):
-            first_2 = self.first_n(2, self.a(), self.a(), self.a())
+            first_2 = first_n(2, self.a(), self.a(), self.a())
             return self.a(*first_2)
 
     def test_first_2(self):
@@ -270,6 +410,27 @@ class TestFirstN(TestWorkflow):
         self.assert_state()
 
 
+class TestAsCompleted(TestWorkflow):
+
+    class WF(DummyWorkflow):
+        a = TaskProxy()
+        def run(self):
+            rs = as_completed(self.a(), self.a(), self.a())
+            return self.a(*[r.result() for r in rs])
+
+    def test_finish_order(self):
+        self.run_workflow(results={'0-0': '10', '1-0': '20', '2-0': '30'},
+                          order=['2-0', '0-0', '1-0'])
+        self.assert_state(
+            (self.WF.a, '3-0', [30, 10, 20], {}, 0),
+        )
+
+    def test_running(self):
+        self.run_workflow(results={'2-0': '30'}, running=['0-0', '1-0'],
+                          order=['2-0'])
+        self.assert_state()
+
+
 class TestErrorHandling(TestWorkflow):
 
     class WF(DummyWorkflow):
@@ -291,9 +452,13 @@ class TestErrorHandling(TestWorkflow):
         )
 
     def test_error_on_result_load(self):
-        self.run_workflow(results={'0-0': 'invalid'})
+        try:
+            json.loads('invalid')
+        except ValueError as e:
+            message = str(e)  # differs between the Python versions
+        self.run_workflow(results={'0-0': 'invalid', '1-0': '1'})
         self.assert_state(
-            ('FAIL', 'No JSON object could be decoded')
+            ('FAIL', message)
         )
 
     def test_error_on_timeout(self):
@@ -353,3 +518,40 @@ class TestRestart(TestWorkflow):
         self.assert_state(
             ('RESTART', '[[1, 2], {}]')
         )
+
+
+class TestDecodedResults(TestCase):
+
+    class WF(DummyWorkflow):
+        a = TaskProxy()
+
+        def run(self):
+            x, y = self.a(), self.a()
+            return [x.result(), x.result(), y.result(), first(x, y),
+                    y.result()]
+
+    def decide(self, decoded=None):
+        w = self.WF('[[], {}]', [], [], {'0-0': '[1]', '1-0': '[2]'}, {},
+                    ['0-0', '1-0'])
+        if decoded is not None:
+            w._decoded = decoded
+        w._metrics = Metrics('decision', InMemoryInstrumentation())
+        w()
+        self.assertEqual(w.state,
+                         [('COMPLETE', '[[1], [1], [2], [1], [2]]')])
+        return w._metrics.counts
+
+    def test_once_per_decision(self):
+        counts = self.decide()
+        self.assertEqual(counts['decoded'], 2)
+        self.assertTrue(counts['decode_hits'] >= 3)
+        # a new decision decodes them again
+        self.assertEqual(self.decide()['decoded'], 2)
+
+    def test_reuse_between_decisions(self):
+        decoded = {}
+        self.assertEqual(self.decide(decoded)['decoded'], 2)
+        self.assertEqual(sorted(decoded), ['0-0', '1-0'])
+        counts = self.decide(decoded)
+        self.assertFalse('decoded' in counts)
+        self.assertTrue(counts['decode_hits'] >= 5)
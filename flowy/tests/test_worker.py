@@ -0,0 +1,253 @@
+import os
+import pickle
+import shutil
+import signal
+import tempfile
+import threading
+import time
+from functools import partial
+from unittest import skipIf
+from unittest import TestCase
+
+from flowy.backend.aio import asyncio
+from flowy.backend.aio import AsyncWorker
+from flowy.backend.boilerplate import _activity_poller
+from flowy.backend.boilerplate import _workflow_poller
+from flowy.backend.cache import HistoryCache
+from flowy.backend.poller import PrefetchPoller
+from flowy.backend.poller import SWFActivityPoller
+from flowy.backend.poller import SWFWorkflowPoller
+from flowy.backend.retry import RetryPolicy
+from flowy.backend.swf import SWFScanner
+from flowy.instrument import InMemoryInstrumentation
+from flowy.worker import _Countdown
+from flowy.worker import _take
+from flowy.worker import ProcessPoolWorker
+from flowy.worker import SingleThreadedWorker
+from flowy.worker import ThreadPoolWorker
+
+
+class CountingPoller(object):
+    """ Hand out numbered tasks, the `stop_at` task stops the worker or,
+    with `sigterm`, sends a SIGTERM to the process.
+    """
+    def __init__(self, stop_at=None, limit=None, sigterm=False):
+        self.stop_at = stop_at
+        self.limit = limit
+        self.sigterm = sigterm
+        self.worker = None
+        self.polled = 0
+        self.executed = []
+        self._lock = threading.Lock()
+
+    def poll_next_task(self):
+        with self._lock:
+            if self.polled == self.limit:
+                return None
+            self.polled += 1
+            return Task(self, self.polled)
+
+
+class Task(object):
+    def __init__(self, poller, number):
+        self.poller = poller
+        self.number = number
+
+    def __call__(self):
+        with self.poller._lock:
+            self.poller.executed.append(self.number)
+        if self.number != self.poller.stop_at:
+            return
+        if self.poller.sigterm:
+            os.kill(os.getpid(), signal.SIGTERM)
+        else:
+            self.poller.worker.stop()
+
+
+class TestSingleThreadedWorker(TestCase):
+
+    def test_loop(self):
+        poller = CountingPoller()
+        SingleThreadedWorker(poller).run_forever(5)
+        self.assertEqual(poller.executed, [1, 2, 3, 4, 5])
+
+    def test_no_more_tasks(self):
+        poller = CountingPoller(limit=3)
+        SingleThreadedWorker(poller).run_forever()
+        self.assertEqual(poller.executed, [1, 2, 3])
+
+    def test_stop(self):
+        poller = CountingPoller(stop_at=3)
+        poller.worker = SingleThreadedWorker(poller)
+        poller.worker.run_forever()
+        self.assertEqual(poller.executed, [1, 2, 3])
+
+    def test_drain_prefetched(self):
+        poller = CountingPoller(stop_at=2)
+        poller.worker = SingleThreadedWorker(PrefetchPoller(poller, 3))
+        poller.worker.run_forever()
+        # every task received before the stop is executed
+        self.assertTrue(poller.polled >= 2)
+        self.assertEqual(poller.executed,
+                         list(range(1, poller.polled + 1)))
+
+
+@skipIf(asyncio is None, 'asyncio is not available')
+class TestAsyncWorkerStop(TestCase):
+
+    def test_no_more_tasks(self):
+        poller = CountingPoller(limit=3)
+        AsyncWorker(poller, threads=2).run_forever()
+        self.assertEqual(sorted(poller.executed), [1, 2, 3])
+
+    def test_drain_prefetched(self):
+        poller = CountingPoller(stop_at=2)
+        poller.worker = AsyncWorker(PrefetchPoller(poller, 3), 4, threads=2)
+        poller.worker.run_forever()
+        self.assertTrue(poller.polled >= 2)
+        self.assertEqual(sorted(poller.executed),
+                         list(range(1, poller.polled + 1)))
+
+
+class TestCountdown(TestCase):
+
+    def test_shared(self):
+        loop = _Countdown(1000)
+        taken = []
+
+        def take():
+            n = 0
+            while _take(loop):
+                n += 1
+            taken.append(n)
+
+        threads = [threading.Thread(target=take) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(sum(taken), 1000)
+        self.assertEqual(loop.value, 0)
+
+    def test_unlimited(self):
+        loop = _Countdown(-1)
+        self.assertTrue(all(_take(loop) for _ in range(100)))
+        self.assertFalse(_take(_Countdown(0)))
+
+
+class TestThreadPoolWorker(TestCase):
+
+    def run_worker(self, poller, wrap=None):
+        poller.worker = ThreadPoolWorker(wrap(poller) if wrap else poller, 4)
+        poller.worker.run_forever()
+        return poller
+
+    def test_loop(self):
+        poller = CountingPoller()
+        ThreadPoolWorker(poller, 4).run_forever(50)
+        self.assertEqual(sorted(poller.executed), list(range(1, 51)))
+
+    def test_sigterm(self):
+        poller = self.run_worker(CountingPoller(stop_at=10, sigterm=True))
+        # the tasks of the polls in flight are executed too
+        self.assertEqual(sorted(poller.executed),
+                         list(range(1, poller.polled + 1)))
+
+    def test_sigterm_drain_prefetched(self):
+        poller = self.run_worker(CountingPoller(stop_at=10, sigterm=True),
+                                 lambda p: PrefetchPoller(p, 5))
+        self.assertTrue(poller.polled >= 10)
+        self.assertEqual(sorted(poller.executed),
+                         list(range(1, poller.polled + 1)))
+
+
+class FilePoller(object):
+    """ Mark every task polled and executed with a file, the processes
+    can't share the state of the test.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.polled = 0
+
+    def poll_next_task(self):
+        self.polled += 1
+        name = '%s-%s' % (os.getpid(), self.polled)
+        open(os.path.join(self.path, 'polled-' + name), 'w').close()
+        return partial(_file_task, self.path, name)
+
+
+def _file_task(path, name):
+    time.sleep(0.01)
+    open(os.path.join(path, 'done-' + name), 'w').close()
+
+
+def _file_poller(path, prefetch=None):
+    poller = FilePoller(path)
+    if prefetch:
+        poller = PrefetchPoller(poller, prefetch)
+    return poller
+
+
+class TestProcessPoolWorker(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def marks(self, kind):
+        return set(name.split('-', 1)[1] for name in os.listdir(self.dir)
+                   if name.startswith(kind + '-'))
+
+    def run_worker(self, poller_factory, loop=-1, stop_after=None):
+        # spawned processes get the factory pickled
+        poller_factory = pickle.loads(pickle.dumps(poller_factory))
+        worker = ProcessPoolWorker(poller_factory, 2)
+        if stop_after is not None:
+            timer = threading.Timer(stop_after, worker.stop)
+            timer.start()
+        worker.run_forever(loop)
+
+    def test_loop(self):
+        self.run_worker(partial(_file_poller, self.dir), loop=20)
+        self.assertEqual(len(self.marks('done')), 20)
+
+    def test_stop(self):
+        self.run_worker(partial(_file_poller, self.dir), stop_after=0.5)
+        self.assertTrue(self.marks('done'))
+        self.assertEqual(self.marks('done'), self.marks('polled'))
+
+    def test_stop_drain_prefetched(self):
+        self.run_worker(partial(_file_poller, self.dir, 3), stop_after=0.5)
+        self.assertTrue(self.marks('done'))
+        self.assertEqual(self.marks('done'), self.marks('polled'))
+
+
+class PicklableLayer1(object):
+    def poll_for_activity_task(self, domain, task_list, identity=None):
+        pass
+
+    def poll_for_decision_task(self, domain, task_list, identity=None,
+                               maximum_page_size=None, next_page_token=None,
+                               reverse_order=None):
+        pass
+
+
+class TestPollerFactories(TestCase):
+
+    def test_pickle(self):
+        activity = partial(_activity_poller, PicklableLayer1(), 'd', 'id',
+                           None, 'tl', SWFScanner(), RetryPolicy(),
+                           InMemoryInstrumentation(), 10, 2)
+        workflow = partial(_workflow_poller, PicklableLayer1(), 'd', 'id',
+                           None, 'tl', SWFScanner(), HistoryCache(),
+                           RetryPolicy(), InMemoryInstrumentation(), None, 0)
+        poller = pickle.loads(pickle.dumps(activity))()
+        self.assertTrue(isinstance(poller, PrefetchPoller))
+        self.assertTrue(isinstance(poller._poller, SWFActivityPoller))
+        poller = pickle.loads(pickle.dumps(workflow))()
+        self.assertTrue(isinstance(poller, SWFWorkflowPoller))
+        # the locks are rebuilt by the unpickling
+        poller._retry_policy.success()
+        self.assertEqual(poller._history_cache.get('run'), None)
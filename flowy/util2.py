@@ -3,6 +3,7 @@ def init():
     import functools
     import inspect
     import types
+    import weakref
     from itertools import izip_longest
 
 
@@ -26,10 +27,62 @@ def init():
             return wrapper(*args, **kwargs)
 
 
+    # the signature analysis only depends on the function and on the names
+    # of the bound arguments, share it between all the MagicBind instances;
+    # the functions are weakly referenced so the ones created on the fly can
+    # still be collected
+    _compiled_cache = weakref.WeakKeyDictionary()
+
     def _make_wrapper(func, update_with):
+        f = getattr(func, 'im_func', func)
+        key = isinstance(func, types.MethodType), frozenset(update_with)
+        try:
+            compiled = _compiled_cache[f][key]
+        except KeyError:
+            compiled = _compile(func, update_with)
+            _compiled_cache.setdefault(f, {})[key] = compiled
+        except TypeError:  # can't be weakly referenced or hashed
+            compiled = _compile(func, update_with)
+        func_call, f_func, args, varargs, keywords = compiled
+        if func_call:
+            func = getattr(func, '__call__')
+        injected = dict((a, update_with[a]) for a in args if a in update_with)
+
+        def slow_call(positional, named):
+            call_args = inspect.getcallargs(f_func, *positional, **named)
+            actual_args = []
+            for arg in args:
+                actual_args.append(
+                    call_args.get(arg, update_with.get(arg))
+                )
+            if varargs is not None:
+                actual_args += call_args[varargs]
+            actual_kwargs = {}
+            if keywords is not None:
+                actual_kwargs = call_args[keywords]
+            return func(*actual_args, **actual_kwargs)
+
+        @functools.wraps(func)
+        def wrapper(*positional, **named):
+            # fast path: only keyword arguments, the bound ones can be merged
+            # in and the function does the checking
+            if positional:
+                return slow_call(positional, named)
+            for name in injected:
+                if name in named:
+                    msg = "%s() got multiple values for argument %r"
+                    raise TypeError(msg % (func.__name__, name))
+            named.update(injected)
+            return func(**named)
+
+        return wrapper
+
+    def _compile(func, update_with):
+        func_call = False
         try:
             args, varargs, keywords, defaults = inspect.getargspec(func)
         except TypeError:
+            func_call = True
             func = getattr(func, '__call__')
             args, varargs, keywords, defaults = inspect.getargspec(func)
         if defaults is None:
@@ -72,22 +125,6 @@ def init():
             code.co_lnotab
         )
         f_func = types.FunctionType(f_code, {}, None, tuple(new_defaults))
-
-        @functools.wraps(func)
-        def wrapper(*positional, **named):
-            call_args = inspect.getcallargs(f_func, *positional, **named)
-            actual_args = []
-            for arg in args:
-                actual_args.append(
-                    call_args.get(arg, update_with.get(arg))
-                )
-            if varargs is not None:
-                actual_args += call_args[varargs]
-            actual_kwargs = {}
-            if keywords is not None:
-                actual_kwargs = call_args[keywords]
-            return func(*actual_args, **actual_kwargs)
-
-        return wrapper
+        return func_call, f_func, args, varargs, keywords
 
     return MagicBind
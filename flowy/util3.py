@@ -3,6 +3,7 @@ def init():
     import functools
     import inspect
     import types
+    import weakref
 
 
     class MagicBind(object):
@@ -51,42 +52,82 @@ def init():
             return wrapper(*args, **kwargs)
 
 
-    def _make_wrapper(func, update_with):
-        signature = inspect.signature(func)
-        args = {}
-        kwargs = {}
-        parameters = signature.parameters.values()
-        new_parameters = list(parameters)
-        for pos, p in enumerate(parameters):
-            if p.name not in update_with:
-                continue
-            if p.kind in [p.VAR_POSITIONAL, p.VAR_KEYWORD]:
-                continue
-            if p.kind in [p.POSITIONAL_ONLY or p.POSITIONAL_OR_KEYWORD]:
-                args[pos] = update_with[p.name]
-            if p.kind == p.KEYWORD_ONLY:
-                kwargs[p.name] = update_with[p.name]
-            del new_parameters[pos + (len(new_parameters) - len(parameters))]
-
-        new_signature = signature.replace(parameters=new_parameters)
+    # the signature analysis only depends on the function and on the names
+    # of the bound arguments, share it between all the MagicBind instances;
+    # the functions are weakly referenced so the ones created on the fly can
+    # still be collected
+    _compiled_cache = weakref.WeakKeyDictionary()
 
-        @functools.wraps(func)
-        def wrapper(*in_args, **in_kwargs):
+    def _make_wrapper(func, update_with):
+        f = getattr(func, '__func__', func)
+        key = inspect.ismethod(func), frozenset(update_with)
+        try:
+            compiled = _compiled_cache[f][key]
+        except KeyError:
+            compiled = _compile(func, update_with)
+            _compiled_cache.setdefault(f, {})[key] = compiled
+        except TypeError:  # can't be weakly referenced or hashed
+            compiled = _compile(func, update_with)
+        new_signature, arg_names, kwarg_names, fast = compiled
+        args = dict((pos, update_with[name]) for pos, name in arg_names)
+        kwargs = dict((name, update_with[name]) for name in kwarg_names)
+        injected = dict(kwargs)
+        injected.update((name, update_with[name]) for _, name in arg_names)
+
+        def slow_call(in_args, in_kwargs):
             b = new_signature.bind(*in_args, **in_kwargs)
             c_args = list(b.args)
             c_kwargs = dict(b.kwargs)
-            for pos, value in args.items():
+            for pos, value in sorted(args.items()):
                 c_args[pos:pos] = [value]
             for kwarg, value in kwargs.items():
                 if kwarg in c_kwargs:
                     msg = "%s() got multiple values for argument %r"
                     raise TypeError(msg % (func.__name__, kwarg))
                 c_kwargs[kwarg] = value
-
             return func(*c_args, **c_kwargs)
 
+        if fast:
+            @functools.wraps(func)
+            def wrapper(*in_args, **in_kwargs):
+                # fast path: only keyword arguments, the bound ones can be
+                # merged in and the function does the checking
+                if in_args:
+                    return slow_call(in_args, in_kwargs)
+                for name in injected:
+                    if name in in_kwargs:
+                        msg = "%s() got multiple values for argument %r"
+                        raise TypeError(msg % (func.__name__, name))
+                in_kwargs.update(injected)
+                return func(**in_kwargs)
+        else:
+            @functools.wraps(func)
+            def wrapper(*in_args, **in_kwargs):
+                return slow_call(in_args, in_kwargs)
+
         wrapper.__signature__ = new_signature
 
         return wrapper
 
+    def _compile(func, update_with):
+        signature = inspect.signature(func)
+        arg_names = []
+        kwarg_names = []
+        parameters = list(signature.parameters.values())
+        new_parameters = []
+        fast = True
+        for pos, p in enumerate(parameters):
+            if (p.name not in update_with
+                    or p.kind in [p.VAR_POSITIONAL, p.VAR_KEYWORD]):
+                new_parameters.append(p)
+                continue
+            if p.kind in [p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD]:
+                arg_names.append((pos, p.name))
+            if p.kind == p.POSITIONAL_ONLY:
+                fast = False
+            if p.kind == p.KEYWORD_ONLY:
+                kwarg_names.append(p.name)
+        new_signature = signature.replace(parameters=new_parameters)
+        return new_signature, tuple(arg_names), tuple(kwarg_names), fast
+
     return MagicBind
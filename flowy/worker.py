@@ -1,7 +1,206 @@
+import logging
+import multiprocessing
+import signal
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
 class SingleThreadedWorker(object):
+    """ Poll and execute the tasks one at a time on the calling thread.
+
+    On SIGTERM (or KeyboardInterrupt) the worker stops after the current
+    task; a poller with a `stop` method, like the PrefetchPoller, is stopped
+    and the tasks it already received are executed first.
+    """
     def __init__(self, poller):
         self._poller = poller
+        self._stop = threading.Event()
+
+    def run_forever(self, loop=-1):
+        self._stop.clear()
+        loop = _Countdown(loop)
+        with _on_sigterm(self.stop):
+            try:
+                _work(self._poller, self._stop, loop)
+            except KeyboardInterrupt:
+                self.stop()
+                _work(self._poller, self._stop, loop)
+                raise
+
+    def stop(self):
+        logger.info('Stopping the worker, waiting for the running task.')
+        self._stop.set()
+        _stop_poller(self._poller)
+
+
+class ThreadPoolWorker(object):
+    """ Poll and execute tasks on a number of threads sharing the same poller.
+
+    On SIGTERM (or KeyboardInterrupt) the threads stop polling for new tasks;
+    the tasks already received, including the ones of the long-polls in
+    flight, are executed before :meth:`run_forever` returns. A poller with a
+    `stop` method, like the PrefetchPoller, is stopped too and drained. The
+    `loop` argument limits the total number of tasks executed by all the
+    threads.
+    """
+    def __init__(self, poller, workers=4):
+        self._poller = poller
+        self._workers = max(int(workers), 1)
+        self._stop = threading.Event()
+        self._loop = None
+
+    def run_forever(self, loop=-1):
+        self._stop.clear()
+        self._loop = _Countdown(loop)
+        threads = []
+        with _on_sigterm(self.stop):
+            for i in range(self._workers):
+                t = threading.Thread(target=self._work,
+                                     name='flowy-worker-%s' % i)
+                t.daemon = True
+                t.start()
+                threads.append(t)
+            try:
+                _join_all(threads)
+            except KeyboardInterrupt:
+                self.stop()
+                _join_all(threads)
+                raise
+
+    def stop(self):
+        logger.info('Stopping the worker, waiting for the running tasks.')
+        self._stop.set()
+        _stop_poller(self._poller)
+
+    def _work(self):
+        _work(self._poller, self._stop, self._loop)
+
+
+class ProcessPoolWorker(object):
+    """ Poll and execute tasks on a number of processes.
+
+    Each process calls `poller_factory` to build its own poller; the
+    connections of the parent process are not shared as long as the factory
+    builds a new client too, a client created before the fork is shared by
+    all the processes. The factory must be picklable, like a module level
+    function or a partial of one, where the processes are spawned instead of
+    forked (macOS, Windows). SIGTERM (or KeyboardInterrupt) is forwarded to
+    the processes as SIGTERM and they exit after finishing the tasks already
+    received. The `loop` argument limits the total number of tasks executed
+    by all the processes.
+    """
+    def __init__(self, poller_factory, workers=None):
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        self._poller_factory = poller_factory
+        self._workers = max(int(workers), 1)
+        self._processes = []
+
+    def run_forever(self, loop=-1):
+        loop = multiprocessing.Value('l', loop)
+        self._processes = []
+        with _on_sigterm(self.stop):
+            for i in range(self._workers):
+                p = multiprocessing.Process(target=_process_work,
+                                            args=(self._poller_factory, loop),
+                                            name='flowy-worker-%s' % i)
+                p.start()
+                self._processes.append(p)
+            try:
+                _join_all(self._processes)
+            except KeyboardInterrupt:
+                self.stop()
+                _join_all(self._processes)
+                raise
 
-    def run_forever(self):
-        for task in self._poller:
+    def stop(self):
+        logger.info('Stopping the worker processes.')
+        for p in self._processes:
+            if p.is_alive():
+                p.terminate()  # SIGTERM, the process drains its task
+
+
+def _process_work(poller_factory, loop):
+    stop = threading.Event()
+    pollers = []
+
+    def on_sigterm(signum, frame):
+        stop.set()
+        for poller in pollers:
+            _stop_poller(poller)
+
+    signal.signal(signal.SIGTERM, on_sigterm)
+    # the parent process translates the interrupt into a SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    poller = poller_factory()
+    pollers.append(poller)
+    if stop.is_set():
+        # terminated while the poller was built
+        _stop_poller(poller)
+    _work(poller, stop, loop)
+
+
+def _work(poller, stop, loop):
+    # a poller that can be stopped hands out the tasks it already received
+    # after the stop, then None
+    drain = hasattr(poller, 'stop')
+    while (drain or not stop.is_set()) and _take(loop):
+        try:
+            task = poller.poll_next_task()
+            if task is None:
+                break
             task()
+        except Exception:
+            logger.exception('Unhandled error in the worker:')
+
+
+def _stop_poller(poller):
+    stop = getattr(poller, 'stop', None)
+    if stop is not None:
+        stop()
+
+
+class _Countdown(object):
+    """ The number of tasks left to run by the threads of a worker, with the
+    interface of the multiprocessing.Value shared by the processes.
+    """
+    def __init__(self, value):
+        self.value = value
+        self._lock = threading.Lock()
+
+    def get_lock(self):
+        return self._lock
+
+
+def _take(loop):
+    # the number of tasks left to run is shared between all the workers;
+    # negative values mean there is no limit
+    with loop.get_lock():
+        if loop.value == 0:
+            return False
+        loop.value -= 1
+        return True
+
+
+def _join_all(workers):
+    # join with a timeout so the main thread can still handle signals
+    while any(w.is_alive() for w in workers):
+        for w in workers:
+            w.join(0.5)
+
+
+@contextmanager
+def _on_sigterm(callback):
+    try:
+        old_handler = signal.signal(signal.SIGTERM,
+                                    lambda signum, frame: callback())
+    except ValueError:
+        # signals can only be handled in the main thread
+        yield
+        return
+    try:
+        yield
+    finally:
+        signal.signal(signal.SIGTERM, old_handler)